@@ -0,0 +1,158 @@
+import os
+import math
+import time
+import logging
+import functools
+import threading
+from typing import Any, Callable, Dict
+
+from flask import jsonify
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Concurrent requests, waiting requests and seconds a request may wait, per route class.
+# Each is overridable, e.g. ADMISSION_UPLOAD_CONCURRENCY=4 or ADMISSION_METADATA_QUEUE=0.
+DEFAULT_LIMITS = {
+    "upload": (2, 8, 30.0),
+    "convert": (8, 32, 60.0),
+    "upstream_llm": (32, 128, 30.0),
+    "upstream_notion": (8, 32, 30.0),
+    "metadata": (4, 16, 10.0),
+}
+
+# Weight of the latest request in the moving average used to estimate Retry-After
+_DURATION_SMOOTHING = 0.2
+
+ADMISSION_IN_FLIGHT = metrics.registry.gauge(
+    "notypdf_admission_in_flight",
+    "Requests admitted and running, by route class",
+    ["route_class"],
+)
+ADMISSION_QUEUED = metrics.registry.gauge(
+    "notypdf_admission_queued",
+    "Requests waiting for admission, by route class",
+    ["route_class"],
+)
+ADMISSION_WAIT = metrics.registry.histogram(
+    "notypdf_admission_wait_seconds",
+    "Time admitted requests waited for a slot, by route class",
+    ["route_class"],
+)
+ADMISSION_REJECTED = metrics.registry.counter(
+    "notypdf_admission_rejected_total",
+    "Requests answered with 503 by admission control, by route class and reason",
+    ["route_class", "reason"],
+)
+
+
+def _setting(route_class: str, name: str, default: float) -> float:
+    value = os.environ.get(f"ADMISSION_{route_class.upper()}_{name}")
+    return float(value) if value else default
+
+
+class AdmissionGate:
+    """Concurrency limit with a bounded wait queue for one class of routes.
+
+    A request that finds the queue full, or waits longer than the timeout, is
+    rejected at once instead of tying up a server thread behind heavy work.
+    """
+
+    def __init__(self, name: str, concurrency: int, queue_size: int, timeout: float):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(0, queue_size)
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.average_duration = 1.0
+        self._condition = threading.Condition()
+
+    def enter(self) -> bool:
+        start = time.monotonic()
+        with self._condition:
+            if self.active >= self.concurrency or self.waiting:
+                if self.waiting >= self.queue_size:
+                    ADMISSION_REJECTED.labels(self.name, "queue_full").inc()
+                    return False
+                self.waiting += 1
+                ADMISSION_QUEUED.labels(self.name).inc()
+                deadline = start + self.timeout
+                try:
+                    while self.active >= self.concurrency:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            ADMISSION_REJECTED.labels(self.name, "timeout").inc()
+                            return False
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+                    ADMISSION_QUEUED.labels(self.name).dec()
+            self.active += 1
+        ADMISSION_IN_FLIGHT.labels(self.name).inc()
+        ADMISSION_WAIT.labels(self.name).observe(time.monotonic() - start)
+        return True
+
+    def exit(self, duration: float) -> None:
+        with self._condition:
+            self.active -= 1
+            self.average_duration += _DURATION_SMOOTHING * (duration - self.average_duration)
+            self._condition.notify()
+        ADMISSION_IN_FLIGHT.labels(self.name).dec()
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free, from the queue length and recent request durations"""
+        with self._condition:
+            backlog = self.waiting + 1
+        return max(1, math.ceil(self.average_duration * backlog / self.concurrency))
+
+    def status(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                "active": self.active,
+                "waiting": self.waiting,
+                "concurrency": self.concurrency,
+                "queue_size": self.queue_size,
+                "timeout_seconds": self.timeout,
+            }
+
+
+gates: Dict[str, AdmissionGate] = {
+    name: AdmissionGate(
+        name,
+        int(_setting(name, "CONCURRENCY", concurrency)),
+        int(_setting(name, "QUEUE", queue_size)),
+        _setting(name, "TIMEOUT", timeout),
+    )
+    for name, (concurrency, queue_size, timeout) in DEFAULT_LIMITS.items()
+}
+
+
+def limit(route_class: str) -> Callable:
+    """Decorator admitting a view through the gate of its route class, answering 503 when it is saturated"""
+    gate = gates[route_class]
+
+    def decorator(view: Callable) -> Callable:
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not gate.enter():
+                retry_after = gate.retry_after()
+                logger.warning(f"Rejected {view.__name__}: {route_class} routes are saturated, retry after {retry_after}s")
+                response = jsonify({"error": "Server busy, please retry later", "route_class": route_class})
+                response.status_code = 503
+                response.headers["Retry-After"] = str(retry_after)
+                return response
+            start = time.monotonic()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                gate.exit(time.monotonic() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def status() -> Dict[str, Dict[str, Any]]:
+    return {name: gate.status() for name, gate in gates.items()}
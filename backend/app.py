@@ -1,25 +1,58 @@
 from flask import Flask, request, jsonify, send_file, after_this_request
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
 import json
 import logging
+import threading
 from datetime import datetime
-from notion_client import Client
 import tempfile
 import zipfile
+import tarfile
 import re
+import time
+import mimetypes
+import posixpath
 import unicodedata
-import shutil
+from typing import Optional, Tuple
 from translation import translation_service
-from markitdown import MarkItDown
+import metrics
+import admission
+import structured_logging
+import profiling
+from singleflight import SingleFlight
+import scheduler
+import artifacts
+import pdf_metadata
+import pdf_optimize
+import file_operations
+import conversion_workers
+import translation_jobs
+import workspace_backup
+import document_state
+import fingerprints
+import shared_state
+import storage
+import janitor
+from startup import Lazy, warmup
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+structured_logging.configure()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
 
+# Reverse proxies in front of the backend whose X-Forwarded-For is trusted; the shipped image has one (nginx)
+TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", "1"))
+if TRUSTED_PROXIES > 0:
+    # Without this every request seems to come from the proxy, so per-client fairness has one client
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
+metrics.instrument_app(app)
+structured_logging.instrument_app(app)
+scheduler.instrument_app(app)
+profiling.instrument_app(app)
+
 # Set maximum file upload size to 500MB
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB
 
@@ -38,10 +71,24 @@ logger.info(f"DEEPSEEK_API_KEY configured: {'Yes' if DEEPSEEK_API_KEY else 'No'}
 if not NOTION_API_KEY:
     logger.error("NOTION_API_KEY environment variable is not set!")
     
-notion = Client(auth=NOTION_API_KEY)
+# Notion API base URL, overridable to point at a local stand-in
+NOTION_BASE_URL = os.environ.get("NOTION_BASE_URL", "https://api.notion.com")
+
+def create_notion_client():
+    import httpx
+    from notion_client import Client
+    http_client = httpx.Client(event_hooks={"request": [structured_logging.add_request_id]})
+    return Client(auth=NOTION_API_KEY, base_url=NOTION_BASE_URL, client=http_client, logger=logging.getLogger("notion_client"))
+
+# Notion client, created on first use
+notion = Lazy("Notion client", create_notion_client)
+
+# Notion calls in flight at once; Notion allows an average of three requests per second
+NOTION_MAX_CONCURRENCY = int(os.environ.get("NOTION_MAX_CONCURRENCY", "3"))
+notion_scheduler = scheduler.Scheduler("notion", NOTION_MAX_CONCURRENCY)
 
 # Configuration file path
-CONFIG_FILE_PATH = '/app/data/config.json'
+CONFIG_FILE_PATH = os.environ.get("CONFIG_FILE_PATH", '/app/data/config.json')
 
 # Document storage path
 # Use environment variable or default to a local "myworkspace" folder
@@ -60,8 +107,26 @@ os.makedirs(WORKSPACE_PATH, exist_ok=True)
 # Ensure archive directory exists
 os.makedirs(ARCHIVE_PATH, exist_ok=True)
 
-# Initialize MarkItDown converter
-md_converter = MarkItDown()
+# Key of the archive folder in document storage
+ARCHIVE_KEY = os.path.basename(ARCHIVE_PATH)
+
+# Global document storage instance: the workspace folder, or an S3-compatible bucket
+document_storage = storage.create_storage(WORKSPACE_PATH)
+
+def create_converter():
+    # Importing MarkItDown loads the whole conversion stack, so it waits until needed
+    from markitdown import MarkItDown
+    return MarkItDown()
+
+# MarkItDown converter, created on first conversion or during warm-up
+md_converter = Lazy("MarkItDown converter", create_converter)
+
+# Concurrent requests for the same missing sidecar share one conversion
+markdown_conversions = SingleFlight("markdown")
+
+# Conversions running at once; the rest wait by priority class instead of in arrival order
+CONVERSION_SLOTS = int(os.environ.get("CONVERSION_SLOTS", str(conversion_workers.WORKERS)))
+conversion_scheduler = scheduler.Scheduler("conversion", CONVERSION_SLOTS)
 
 # Default translation prompt template
 DEFAULT_TRANSLATION_PROMPT = (
@@ -70,6 +135,9 @@ DEFAULT_TRANSLATION_PROMPT = (
     "and other formatting. Return only the translated text formatted as markdown.\n\n{{text}}"
 )
 
+# Maximum number of segments accepted by the batch translation endpoint
+TRANSLATION_BATCH_MAX_SEGMENTS = int(os.environ.get("TRANSLATION_BATCH_MAX_SEGMENTS", "500"))
+
 # Allowed file extensions for documents
 ALLOWED_EXTENSIONS = {'pdf', 'doc', 'docx', 'txt', 'png', 'jpg', 'jpeg', 'gif'}
 
@@ -113,39 +181,188 @@ def safe_join(base: str, *paths: str) -> str:
         raise ValueError('Invalid path')
     return final_path
 
+def storage_key(*paths: str) -> str:
+    """Storage key of a path relative to the workspace, refusing paths that escape it."""
+    key = posixpath.normpath("/".join(path.strip("/") for path in paths if path))
+    if key == ".":
+        return ""
+    if key == ".." or key.startswith("../") or key.startswith("/"):
+        raise ValueError('Invalid path')
+    return key
+
+def file_info(entry: storage.Entry) -> dict:
+    """Name, size, modification time and type of a stored document or folder."""
+    return {
+        "name": entry.name,
+        "size": entry.size,
+        "lastModified": datetime.fromtimestamp(entry.mtime).isoformat(),
+        "type": "folder" if entry.is_dir else entry.name.rsplit('.', 1)[1].lower() if '.' in entry.name else 'unknown'
+    }
+
+def send_document(key: str, entry: storage.Entry):
+    """Send a stored document as an attachment, honouring Range requests.
+
+    PDFs are sent as their linearised copy once one exists, unless the
+    original is asked for with ?variant=original.
+    """
+    if entry.name.lower().endswith('.pdf') and request.args.get("variant") != "original":
+        local_path = document_storage.cached_path(key)
+        optimized_path = pdf_optimize.optimized(local_path) if local_path and pdf_optimize.enabled() else None
+        if optimized_path:
+            response = send_file(optimized_path, mimetype="application/pdf", as_attachment=True, download_name=entry.name, conditional=True)
+            response.headers["X-PDF-Variant"] = "optimized"
+            return response
+        # Documents stored before optimisation was enabled are optimised on first download
+        pdf_optimize.schedule(key, document_storage.local_path, entry.size)
+    if document_storage.is_local:
+        return send_file(document_storage.local_path(key), as_attachment=True)
+    byte_range = request.range.range_for_length(entry.size) if request.range else None
+    if request.range and byte_range is None:
+        response = app.response_class(status=416)
+        response.headers["Content-Range"] = f"bytes */{entry.size}"
+        return response
+    start, stop = byte_range or (0, entry.size)
+    body = document_storage.open_range(key, start, stop - 1) if stop > start else iter(())
+    response = app.response_class(
+        body,
+        status=206 if byte_range else 200,
+        mimetype=mimetypes.guess_type(entry.name)[0] or "application/octet-stream"
+    )
+    response.content_length = stop - start
+    response.accept_ranges = "bytes"
+    response.last_modified = entry.mtime
+    if byte_range:
+        response.content_range = f"bytes {start}-{stop - 1}/{entry.size}"
+    response.headers.set("Content-Disposition", "attachment", filename=entry.name)
+    return response
+
+def pdf_page_count(pdf_path: str):
+    """Return the page count from the cached PDF metadata."""
+    try:
+        return pdf_metadata.get(pdf_path).get("pages")
+    except Exception as e:
+        logger.warning(f"Could not read page count for {pdf_path}: {str(e)}")
+        return None
+
 def pdf_to_markdown(pdf_path: str, md_path: str) -> None:
     """Convert a PDF file to Markdown using MarkItDown."""
-    result = md_converter.convert(pdf_path)
-    with open(md_path, 'w', encoding='utf-8') as f:
-        f.write(result.text_content)
+    if conversion_workers.ISOLATION_ENABLED:
+        # The worker process writes the artifact itself
+        with profiling.span("conversion", isolated=True), metrics.track_conversion(pdf_page_count(pdf_path)):
+            conversion_workers.conversion_pool.convert(pdf_path, md_path)
+        return
+    with profiling.span("conversion"), metrics.track_conversion(pdf_page_count(pdf_path)):
+        result = md_converter.get().convert(pdf_path)
+    with profiling.span("disk_io", op="write", path=md_path):
+        artifacts.write_text(md_path, result.text_content)
+
+def ensure_markdown(pdf_path: str) -> Tuple[str, bool]:
+    """Return the PDF's Markdown sidecar, generating it once for all concurrent callers.
+
+    Also returns whether the sidecar was already cached.
+    """
+    md_path = artifacts.find_markdown(pdf_path)
+    if md_path:
+        return md_path, True
+    md_path = artifacts.markdown_path(pdf_path)
+
+    document = os.path.realpath(pdf_path)
+
+    def convert() -> None:
+        # A conversion that finished just before this flight started already wrote the file
+        if os.path.exists(md_path):
+            return
+        # Another replica may be converting the same document; wait for it and reuse its result
+        with shared_state.lock(f"markdown:{document}", kind="conversion"):
+            if os.path.exists(md_path):
+                return
+            with conversion_scheduler.slot(document=document):
+                meta = pdf_metadata.get(pdf_path)
+                if meta.get("has_text_layer") is False and meta.get("text_layer_certain"):
+                    # No page declares a font, so there is no text for MarkItDown to extract
+                    logger.info(f"Skipping conversion of image-only PDF {pdf_path}")
+                    artifacts.write_text(md_path, "")
+                    return
+                pdf_to_markdown(pdf_path, md_path)
+
+    # A queued conversion this caller is about to join runs at the caller's priority
+    conversion_scheduler.promote(document, scheduler.current().priority)
+    markdown_conversions.do(os.path.realpath(md_path), convert)
+    return md_path, False
+
+def read_markdown(pdf_path: str) -> str:
+    """Return the Markdown text of a PDF, converting it first if needed."""
+    md_path, _ = ensure_markdown(pdf_path)
+    return artifacts.read_text(md_path)
+
+translation_jobs.job_manager.configure(document_storage.local_root, read_markdown, document_storage.local_path)
+janitor.janitor.configure(document_storage)
+
+def notion_call(operation: str, func, **kwargs):
+    """Call a Notion client method, recording its latency per operation."""
+    with notion_scheduler.slot():
+        with profiling.span("upstream", provider="notion", operation=operation):
+            with metrics.track_upstream("notion", "", operation):
+                return func(**kwargs)
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Expose request, upstream and conversion metrics in Prometheus format"""
+    return app.response_class(metrics.registry.render(), content_type=metrics.CONTENT_TYPE_LATEST)
+
+@app.route("/profiles", methods=["GET"])
+def list_profiles():
+    """List captured request profiles, newest first"""
+    try:
+        return jsonify({"profiles": profiling.list_profiles()})
+    except Exception as e:
+        logger.error(f"Error listing profiles: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/profiles/<profile_id>", methods=["GET"])
+def get_profile(profile_id):
+    """Return the span breakdown and hottest functions of a captured profile"""
+    path = profiling.profile_path(profile_id, ".json")
+    if not path:
+        return jsonify({"error": "Profile not found"}), 404
+    return send_file(path, mimetype="application/json")
+
+@app.route("/profiles/<profile_id>/download", methods=["GET"])
+def download_profile(profile_id):
+    """Download the raw cProfile stats of a captured profile"""
+    path = profiling.profile_path(profile_id, ".prof")
+    if not path:
+        return jsonify({"error": "Profile not found"}), 404
+    return send_file(path, as_attachment=True, download_name=f"{profile_id}.prof")
 
 @app.route("/notion/databases/<database_id>", methods=["GET"])
+@admission.limit("upstream_notion")
 def get_database(database_id):
     try:
-        db = notion.databases.retrieve(database_id=database_id)
+        db = notion_call("databases.retrieve", notion.databases.retrieve, database_id=database_id)
         return jsonify(db)
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 @app.route("/notion/databases/<database_id>/query", methods=["POST"])
+@admission.limit("upstream_notion")
 def query_database(database_id):
     try:
-        logger.info(f"Querying database: {database_id}")
+        logger.debug(f"Querying database: {database_id}")
         
         # Get the request data
         request_data = request.get_json() if request.is_json else {}
         filter_data = request_data.get("filter") if request_data else None
         
-        logger.info(f"Request data: {json.dumps(request_data, default=str)}")
-        logger.info(f"Filter data: {json.dumps(filter_data, default=str) if filter_data else 'None'}")
+        logger.debug(f"Filter data: {json.dumps(filter_data, default=str) if filter_data else 'None'}")
         
         # Query the database
         if filter_data:
-            results = notion.databases.query(database_id=database_id, filter=filter_data)
+            results = notion_call("databases.query", notion.databases.query, database_id=database_id, filter=filter_data)
         else:
-            results = notion.databases.query(database_id=database_id)
+            results = notion_call("databases.query", notion.databases.query, database_id=database_id)
             
-        logger.info(f"Query successful, returned {len(results.get('results', []))} results")
+        logger.debug(f"Query successful, returned {len(results.get('results', []))} results")
         return jsonify(results)
     except Exception as e:
         logger.error(f"Error querying database {database_id}: {str(e)}")
@@ -153,18 +370,18 @@ def query_database(database_id):
         return jsonify({"error": str(e), "type": type(e).__name__}), 400
 
 @app.route("/notion/pages", methods=["POST"])
+@admission.limit("upstream_notion")
 def create_page():
     try:
         data = request.get_json()
-        logger.info(f"Creating page with data: {json.dumps(data, default=str)}")
         
         parent = data.get("parent")
         properties = data.get("properties")
         
-        logger.info(f"Parent: {json.dumps(parent, default=str)}")
-        logger.info(f"Properties: {json.dumps(properties, default=str)}")
+        # Property values are user content; only their names are logged
+        logger.debug(f"Creating page under {json.dumps(parent, default=str)} with properties {sorted(properties or {})}")
         
-        page = notion.pages.create(parent=parent, properties=properties)
+        page = notion_call("pages.create", notion.pages.create, parent=parent, properties=properties)
         logger.info("Page created successfully")
         return jsonify(page)
     except Exception as e:
@@ -173,16 +390,16 @@ def create_page():
         return jsonify({"error": str(e), "type": type(e).__name__}), 400
 
 @app.route("/notion/pages/<page_id>", methods=["PATCH"])
+@admission.limit("upstream_notion")
 def update_page(page_id):
     try:
         data = request.get_json()
-        logger.info(f"Updating page {page_id} with data: {json.dumps(data, default=str)}")
         
         properties = data.get("properties")
         
-        logger.info(f"Properties: {json.dumps(properties, default=str)}")
+        logger.debug(f"Updating page {page_id} properties {sorted(properties or {})}")
         
-        page = notion.pages.update(page_id=page_id, properties=properties)
+        page = notion_call("pages.update", notion.pages.update, page_id=page_id, properties=properties)
         logger.info("Page updated successfully")
         return jsonify(page)
     except Exception as e:
@@ -191,10 +408,11 @@ def update_page(page_id):
         return jsonify({"error": str(e), "type": type(e).__name__}), 400
 
 @app.route("/notion/test-connection", methods=["GET"])
+@admission.limit("upstream_notion")
 def test_notion_connection():
     try:
         # Try to list users as a simple test
-        users = notion.users.list()
+        users = notion_call("users.list", notion.users.list)
         return jsonify({"success": True, "message": "Connection successful", "user_count": len(users.get('results', []))})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 400
@@ -259,8 +477,6 @@ def load_config():
                 # Ensure required keys exist
                 if "tagMappings" not in config:
                     config["tagMappings"] = {}
-                if "bookmarks" not in config:
-                    config["bookmarks"] = {}
                 if "translationPrompts" not in config:
                     config["translationPrompts"] = [DEFAULT_TRANSLATION_PROMPT]
                 if "selectedTranslationPromptIndex" not in config:
@@ -274,7 +490,6 @@ def load_config():
                 "tagMappings": {},
                 "translationPrompts": [DEFAULT_TRANSLATION_PROMPT],
                 "selectedTranslationPromptIndex": 0,
-                "bookmarks": {},
                 "lastUpdated": datetime.now().isoformat()
             }
     except Exception as e:
@@ -283,7 +498,6 @@ def load_config():
             "savedDatabaseIds": [],
             "columnMappings": {},
             "tagMappings": {},
-            "bookmarks": {},
             "lastUpdated": datetime.now().isoformat()
         }
 
@@ -291,8 +505,16 @@ def save_config(config_data):
     """Save configuration to file"""
     try:
         config_data["lastUpdated"] = datetime.now().isoformat()
-        with open(CONFIG_FILE_PATH, 'w') as f:
-            json.dump(config_data, f, indent=2)
+        # Other replicas read the file while it is written, so it is replaced in one step
+        tmp_path = f"{CONFIG_FILE_PATH}.{os.getpid()}-{threading.get_ident()}.partial"
+        with shared_state.file_lock(CONFIG_FILE_PATH):
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(config_data, f, indent=2)
+                os.replace(tmp_path, CONFIG_FILE_PATH)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
         return True
     except Exception as e:
         logger.error(f"Error saving config: {str(e)}")
@@ -302,6 +524,7 @@ def save_config(config_data):
 def get_config():
     """Get current configuration"""
     try:
+        ensure_bookmarks_migrated()
         config = load_config()
         return jsonify(config)
     except Exception as e:
@@ -311,36 +534,136 @@ def get_config():
 def update_config():
     """Update configuration"""
     try:
+        ensure_bookmarks_migrated()
         data = request.get_json()
         if not data:
             return jsonify({"error": "No data provided"}), 400
-        current_config = load_config()
-        # Update the configuration with provided data
-        if "savedDatabaseIds" in data:
-            current_config["savedDatabaseIds"] = data["savedDatabaseIds"]
-        if "columnMappings" in data:
-            current_config["columnMappings"] = data["columnMappings"]
-        if "tagMappings" in data:
-            current_config["tagMappings"] = data["tagMappings"]
-        if "translationPrompts" in data:
-            current_config["translationPrompts"] = data["translationPrompts"]
-        if "selectedTranslationPromptIndex" in data:
-            current_config["selectedTranslationPromptIndex"] = data["selectedTranslationPromptIndex"]
-        if "bookmarks" in data:
-            current_config["bookmarks"] = data["bookmarks"]
-        if save_config(current_config):
-            return jsonify({"success": True, "message": "Configuration updated successfully"})
-        else:
-            return jsonify({"error": "Failed to save configuration"}), 500
+        # Held from read to write so a concurrent update on another replica is not lost
+        with shared_state.file_lock(CONFIG_FILE_PATH):
+            current_config = load_config()
+            # Update the configuration with provided data
+            if "savedDatabaseIds" in data:
+                current_config["savedDatabaseIds"] = data["savedDatabaseIds"]
+            if "columnMappings" in data:
+                current_config["columnMappings"] = data["columnMappings"]
+            if "tagMappings" in data:
+                current_config["tagMappings"] = data["tagMappings"]
+            if "translationPrompts" in data:
+                current_config["translationPrompts"] = data["translationPrompts"]
+            if "selectedTranslationPromptIndex" in data:
+                current_config["selectedTranslationPromptIndex"] = data["selectedTranslationPromptIndex"]
+            if "bookmarks" in data:
+                # Older clients send every bookmark by file name; they are kept per document now
+                import_named_bookmarks(data["bookmarks"] or {})
+            if save_config(current_config):
+                return jsonify({"success": True, "message": "Configuration updated successfully"})
+            else:
+                return jsonify({"error": "Failed to save configuration"}), 500
     except Exception as e:
         logger.error(f"Error updating config: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+# Keys a configuration backup must contain to be restored
+BACKUP_REQUIRED_KEYS = [
+    "savedDatabaseIds",
+    "columnMappings",
+    "tagMappings",
+    "translationPrompts",
+    "selectedTranslationPromptIndex",
+]
+
+def document_hash(key: str) -> str:
+    """Content hash of a stored document, which keys its bookmarks and other state."""
+    return fingerprints.content_hash(document_storage.local_path(key))
+
+def bookmark_page(page) -> Optional[int]:
+    """Page number of a bookmark saved by an older client, or None if it is not one."""
+    if isinstance(page, bool):
+        return None
+    try:
+        number = int(page)
+    except (TypeError, ValueError):
+        return None
+    return number if number >= 1 else None
+
+def import_named_bookmarks(bookmarks: dict) -> dict:
+    """Store bookmarks given by workspace file name, returning those that could not be stored.
+
+    Older clients only knew a document's file name, so a name that is not a
+    path from the workspace root is matched against every stored document,
+    archived ones included, as long as exactly one has that name. Bookmarks
+    of files that are missing, or whose page is not a page number, are
+    returned unchanged so they are not lost.
+    """
+    unresolved = {}
+    by_name = None
+    for name, page in bookmarks.items():
+        number = bookmark_page(page)
+        try:
+            key = storage_key(name)
+            entry = document_storage.stat(key)
+        except ValueError:
+            key, entry = None, None
+        if (entry is None or entry.is_dir) and key and "/" not in key:
+            if by_name is None:
+                by_name = {}
+                for item in document_storage.walk():
+                    by_name.setdefault(item.name, []).append(item.key)
+            matches = by_name.get(key, [])
+            if len(matches) == 1:
+                key, entry = matches[0], document_storage.stat(matches[0])
+        if number is None or entry is None or entry.is_dir:
+            unresolved[name] = page
+            continue
+        try:
+            document_state.patch(document_hash(key), {"bookmark": number})
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not store the bookmark of {name}: {str(e)}")
+            unresolved[name] = page
+    return unresolved
+
+def save_restored_config(config_data: dict) -> bool:
+    """Save a restored configuration, moving its document states and bookmarks into the document store."""
+    config_data = dict(config_data)
+    document_state.import_states(config_data.pop("documents", None) or {})
+    unresolved = import_named_bookmarks(config_data.pop("bookmarks", None) or {})
+    if unresolved:
+        # Kept until the files reappear, e.g. once the workspace has been restored too
+        config_data["bookmarks"] = unresolved
+    return save_config(config_data)
+
+def migrate_config_bookmarks() -> None:
+    """Move bookmarks left in config.json by earlier versions into the document store."""
+    with shared_state.file_lock(CONFIG_FILE_PATH):
+        config = load_config()
+        bookmarks = config.get("bookmarks")
+        if not bookmarks:
+            return
+        unresolved = import_named_bookmarks(bookmarks)
+        if unresolved:
+            config["bookmarks"] = unresolved
+        else:
+            del config["bookmarks"]
+        save_config(config)
+        logger.info(f"Moved {len(bookmarks) - len(unresolved)} bookmarks out of config.json, {len(unresolved)} left for missing files or invalid pages")
+
+# Runs once per process, on the first use of document state or the configuration, with or without warm-up
+legacy_bookmarks = Lazy("legacy bookmark migration", migrate_config_bookmarks)
+
+def ensure_bookmarks_migrated() -> None:
+    """Move legacy bookmarks before they are read; a failure is logged and retried on the next request."""
+    try:
+        legacy_bookmarks.get()
+    except Exception as e:
+        logger.warning(f"Could not move bookmarks out of config.json: {str(e)}")
+
 @app.route("/config/backup", methods=["GET"])
 def download_backup():
     """Download configuration as backup file"""
     try:
+        ensure_bookmarks_migrated()
         config = load_config()
+        config["documents"] = document_state.export()
         
         # Generate filename with timestamp
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -380,19 +703,11 @@ def restore_backup():
             return jsonify({"error": "Invalid JSON file"}), 400
         
         # Validate the backup data structure
-        required_keys = [
-            "savedDatabaseIds",
-            "columnMappings",
-            "tagMappings",
-            "translationPrompts",
-            "selectedTranslationPromptIndex",
-            "bookmarks",
-        ]
-        if not all(key in backup_data for key in required_keys):
+        if not all(key in backup_data for key in BACKUP_REQUIRED_KEYS):
             return jsonify({"error": "Invalid backup file structure"}), 400
         
         # Save the restored configuration
-        if save_config(backup_data):
+        if save_restored_config(backup_data):
             return jsonify({"success": True, "message": "Configuration restored successfully"})
         else:
             return jsonify({"error": "Failed to save restored configuration"}), 500
@@ -401,6 +716,73 @@ def restore_backup():
         logger.error(f"Error restoring backup: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+def restore_config_data(config_data):
+    """Validate and save a configuration read from a workspace backup"""
+    if not isinstance(config_data, dict) or not all(key in config_data for key in BACKUP_REQUIRED_KEYS):
+        raise ValueError("Invalid configuration in backup")
+    if not save_restored_config(config_data):
+        raise RuntimeError("Failed to save restored configuration")
+
+@app.route("/backup", methods=["GET", "POST"])
+def download_workspace_backup():
+    """Stream a tar backup of the configuration and workspace, in full or since a manifest or timestamp"""
+    if not document_storage.is_local:
+        return jsonify({"error": f"Workspace backups are not supported with {document_storage.name} storage"}), 501
+    try:
+        base = None
+        since = None
+        if request.method == "POST":
+            if 'manifest' in request.files:
+                base = json.load(request.files['manifest'].stream)
+            else:
+                base = request.get_json(silent=True)
+            if not isinstance(base, dict) or not isinstance(base.get("files"), dict):
+                return jsonify({"error": "A manifest from an earlier backup is required"}), 400
+        elif request.args.get("since"):
+            since = workspace_backup.parse_since(request.args["since"])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        kind = "full" if base is None and since is None else "incremental"
+        filename = f"notypdf_workspace_{kind}_{timestamp}.tar"
+        response = app.response_class(
+            workspace_backup.stream_backup(WORKSPACE_PATH, CONFIG_FILE_PATH, base, since, document_state.STATE_DIR),
+            status=200,
+            mimetype='application/x-tar'
+        )
+        response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+        return response
+
+    except Exception as e:
+        logger.error(f"Error creating workspace backup: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/backup/restore", methods=["POST"])
+def restore_workspace_backup():
+    """Restore the configuration and workspace from a streamed tar backup"""
+    if not document_storage.is_local:
+        return jsonify({"error": f"Workspace backups are not supported with {document_storage.name} storage"}), 501
+    try:
+        # Backups outgrow the upload limit; they are written out as they arrive
+        request.max_content_length = workspace_backup.MAX_RESTORE_BYTES
+        if request.mimetype == "multipart/form-data":
+            # Werkzeug would spool the whole form to a temporary file before the restore could start
+            return jsonify({"error": "Send the backup as the raw request body (Content-Type: application/x-tar)"}), 415
+        prune = request.args.get("prune", "false").lower() in ("1", "true", "yes")
+        result = workspace_backup.restore(request.stream, WORKSPACE_PATH, restore_config_data, prune, document_state.STATE_DIR)
+        # Bookmarks by file name in an older configuration can be resolved now that the files are back
+        migrate_config_bookmarks()
+        return jsonify({"success": True, **result})
+
+    except (ValueError, tarfile.TarError) as e:
+        logger.error(f"Invalid workspace backup: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error restoring workspace backup: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/config/clear", methods=["DELETE"])
 def clear_config():
     """Clear all configuration data"""
@@ -412,11 +794,11 @@ def clear_config():
             "tagMappings": {},
             "translationPrompts": [DEFAULT_TRANSLATION_PROMPT],
             "selectedTranslationPromptIndex": 0,
-            "bookmarks": {},
             "lastUpdated": datetime.now().isoformat()
         }
         
         if save_config(empty_config):
+            document_state.clear()
             logger.info("Configuration cleared successfully")
             return jsonify({"success": True, "message": "All configurations cleared successfully"})
         else:
@@ -430,36 +812,28 @@ def clear_config():
 def list_files():
     """List all files and folders in the workspace directory or subfolders"""
     try:
-        rel_path = request.args.get("path", "").strip("/")
-        directory = safe_join(WORKSPACE_PATH, rel_path)
+        rel_path = storage_key(request.args.get("path", ""))
 
         files = []
-        for filename in os.listdir(directory):
-            if filename.lower().endswith('.md'):
+        for item in document_storage.list(rel_path):
+            filename = item.name
+            if artifacts.is_sidecar(filename):
                 continue
-            # Skip the internal archive folder
-            if rel_path == "" and filename == os.path.basename(ARCHIVE_PATH):
+            # Skip the internal archive folder and batches' pending deletions
+            if rel_path == "" and (filename == ARCHIVE_KEY or file_operations.is_trash(filename)):
                 continue
 
-            filepath = os.path.join(directory, filename)
-            stat = os.stat(filepath)
-
-            if os.path.isdir(filepath):
-                files.append({
-                    "name": filename,
-                    "path": f"{rel_path}/{filename}".lstrip("/"),
-                    "size": 0,
-                    "lastModified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                    "type": "folder"
-                })
-            elif os.path.isfile(filepath):
-                files.append({
-                    "name": filename,
-                    "path": f"{rel_path}/{filename}".lstrip("/"),
-                    "size": stat.st_size,
-                    "lastModified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                    "type": filename.rsplit('.', 1)[1].lower() if '.' in filename else 'unknown'
-                })
+            entry = file_info(item)
+            entry["path"] = item.key
+            if entry["type"] == "pdf" and document_storage.is_local:
+                # Only include metadata that is already known; extract the rest in the background
+                filepath = document_storage.local_path(item.key)
+                meta = pdf_metadata.cached(filepath, os.stat(filepath))
+                if meta is not None:
+                    entry["meta"] = pdf_metadata.summary(meta)
+                else:
+                    pdf_metadata.prefetch(filepath)
+            files.append(entry)
 
         return jsonify({"files": files})
 
@@ -473,18 +847,10 @@ def list_archived_files():
     """List all files in the archive directory"""
     try:
         files = []
-        for filename in os.listdir(ARCHIVE_PATH):
-            if filename.lower().endswith('.md'):
+        for item in document_storage.list(ARCHIVE_KEY):
+            if artifacts.is_sidecar(item.name) or item.is_dir:
                 continue
-            filepath = os.path.join(ARCHIVE_PATH, filename)
-            if os.path.isfile(filepath):
-                stat = os.stat(filepath)
-                files.append({
-                    "name": filename,
-                    "size": stat.st_size,
-                    "lastModified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                    "type": filename.rsplit('.', 1)[1].lower() if '.' in filename else 'unknown',
-                })
+            files.append(file_info(item))
 
         return jsonify({"files": files})
 
@@ -497,13 +863,7 @@ def list_archived_files():
 def list_all_folders():
     """Recursively list all folder paths relative to the workspace"""
     try:
-        folder_paths = [""]
-        for dirpath, dirnames, _ in os.walk(WORKSPACE_PATH):
-            if dirpath.startswith(ARCHIVE_PATH):
-                continue
-            rel_dir = os.path.relpath(dirpath, WORKSPACE_PATH)
-            if rel_dir != ".":
-                folder_paths.append(rel_dir.replace(os.sep, "/"))
+        folder_paths = [""] + document_storage.folders(exclude=ARCHIVE_KEY)
         folder_paths = sorted(set(folder_paths))
         return jsonify({"folders": folder_paths})
     except Exception as e:
@@ -521,13 +881,12 @@ def create_folder():
             return jsonify({"error": "folderName is required"}), 400
 
         folder_name = safe_filename(folder_name)
-        folder_path = os.path.join(WORKSPACE_PATH, folder_name)
 
-        if os.path.exists(folder_path):
+        if document_storage.stat(folder_name) is not None:
             return jsonify({"error": "Folder already exists"}), 400
 
-        os.makedirs(folder_path, exist_ok=True)
-        logger.info(f"Folder created: {folder_path}")
+        document_storage.make_folder(folder_name)
+        logger.info(f"Folder created: {folder_name}")
         return jsonify({"success": True, "folder": folder_name})
 
     except Exception as e:
@@ -535,59 +894,42 @@ def create_folder():
         return jsonify({"error": str(e)}), 500
 
 @app.route("/files/upload", methods=["POST"])
+@admission.limit("upload")
 def upload_file():
     """Upload a file to the workspace directory"""
     try:
-        logger.info("Received file upload request")
-        logger.info(f"Request files: {list(request.files.keys())}")
+        logger.debug(f"Received file upload request: {list(request.files.keys())}")
         
         if 'file' not in request.files:
             logger.error("No 'file' key in request.files")
             return jsonify({"error": "No file provided"}), 400
         
         file = request.files['file']
-        logger.info(f"File object: {file}")
-        logger.info(f"File filename: '{file.filename}'")
         
         if file.filename == '':
             logger.error("Empty filename")
             return jsonify({"error": "No file selected"}), 400
         
-        logger.info(f"Checking if file is allowed: {file.filename}")
         if file and allowed_file(file.filename):
             # Sanitize the filename
             original_filename = file.filename
             filename = safe_filename(file.filename)
-            logger.info(f"Original filename: '{original_filename}', Sanitized: '{filename}'")
+            logger.debug(f"Original filename: '{original_filename}', Sanitized: '{filename}'")
             
             # Check if file already exists
-            filepath = os.path.join(WORKSPACE_PATH, filename)
-            logger.info(f"Target filepath: {filepath}")
-            
-            if os.path.exists(filepath):
+            if document_storage.stat(filename) is not None:
                 # Add timestamp to make it unique
                 name, ext = os.path.splitext(filename)
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 filename = f"{name}_{timestamp}{ext}"
-                filepath = os.path.join(WORKSPACE_PATH, filename)
-                logger.info(f"File exists, using unique name: {filename}")
+                logger.debug(f"File exists, using unique name: {filename}")
             
-            # Save the file
-            logger.info(f"Attempting to save file to: {filepath}")
-            file.save(filepath)
-            logger.info(f"File saved successfully to: {filepath}")
-            
-            # Get file stats for response
-            stat = os.stat(filepath)
-            file_info = {
-                "name": filename,
-                "size": stat.st_size,
-                "lastModified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                "type": filename.rsplit('.', 1)[1].lower()
-            }
+            # Stream the file into storage
+            entry = document_storage.put_stream(filename, file.stream, keep_copy=pdf_optimize.wanted(filename))
+            pdf_optimize.schedule(filename, document_storage.local_path, entry.size)
             
             logger.info(f"File uploaded successfully: {filename}")
-            return jsonify({"success": True, "file": file_info})
+            return jsonify({"success": True, "file": file_info(entry)})
         
         else:
             logger.error(f"File type not allowed for file: '{file.filename}'")
@@ -599,17 +941,16 @@ def upload_file():
         return jsonify({"error": str(e)}), 500
 
 @app.route("/files/upload/multiple", methods=["POST"])
+@admission.limit("upload")
 def upload_multiple_files():
     """Upload multiple files to the workspace directory"""
     try:
-        logger.info("=== Starting multiple file upload process ===")
-        
         if 'files' not in request.files:
             logger.error("No files provided in request")
             return jsonify({"error": "No files provided"}), 400
         
         files = request.files.getlist('files')
-        logger.info(f"Received {len(files)} file(s) for upload")
+        logger.debug(f"Received {len(files)} file(s) for upload")
         
         if not files or all(file.filename == '' for file in files):
             logger.error("No files selected or all files have empty names")
@@ -617,49 +958,31 @@ def upload_multiple_files():
         
         results = []
         for index, file in enumerate(files, 1):
-            logger.info(f"Processing file {index}/{len(files)}: '{file.filename}'")
-            
             if file and file.filename != '' and allowed_file(file.filename):
                 try:
                     # Sanitize the filename
                     original_filename = file.filename
                     filename = safe_filename(file.filename)
-                    logger.info(f"File {index} - Original: '{original_filename}', Sanitized: '{filename}'")
+                    logger.debug(f"File {index} - Original: '{original_filename}', Sanitized: '{filename}'")
                     
                     # Check if file already exists
-                    filepath = os.path.join(WORKSPACE_PATH, filename)
-                    if os.path.exists(filepath):
+                    if document_storage.stat(filename) is not None:
                         # Add timestamp to make it unique
                         name, ext = os.path.splitext(filename)
                         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                         filename = f"{name}_{timestamp}{ext}"
-                        filepath = os.path.join(WORKSPACE_PATH, filename)
-                        logger.info(f"File {index} - File exists, renamed to: '{filename}'")
-                    
-                    # Log file details before saving
-                    content_length = request.content_length
-                    logger.info(f"File {index} - Saving to: '{filepath}', Content-Length: {content_length}")
+                        logger.debug(f"File {index} - File exists, renamed to: '{filename}'")
                     
-                    # Save the file
-                    file.save(filepath)
+                    # Stream the file into storage
+                    entry = document_storage.put_stream(filename, file.stream, keep_copy=pdf_optimize.wanted(filename))
+                    pdf_optimize.schedule(filename, document_storage.local_path, entry.size)
                     
-                    # Get file stats for response
-                    stat = os.stat(filepath)
-                    file_size = stat.st_size
-                    file_info = {
-                        "name": filename,
-                        "size": file_size,
-                        "lastModified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                        "type": filename.rsplit('.', 1)[1].lower()
-                    }
-                    
-                    results.append({"success": True, "file": file_info})
-                    logger.info(f"✅ File {index} uploaded successfully: '{filename}' ({file_size} bytes)")
+                    results.append({"success": True, "file": file_info(entry)})
+                    logger.debug(f"File {index} uploaded successfully: '{filename}' ({entry.size} bytes)")
                     
                 except Exception as e:
                     error_msg = str(e)
-                    logger.error(f"❌ Error uploading file {index} '{file.filename}': {error_msg}")
-                    logger.error(f"Error type: {type(e).__name__}")
+                    logger.error(f"Error uploading file {index} '{file.filename}': {type(e).__name__}: {error_msg}")
                     results.append({"success": False, "error": error_msg, "filename": file.filename})
             else:
                 if not file or file.filename == '':
@@ -672,7 +995,7 @@ def upload_multiple_files():
         success_count = sum(1 for r in results if r["success"])
         failed_count = len(files) - success_count
         
-        logger.info(f"=== Upload process completed: {success_count} successful, {failed_count} failed out of {len(files)} total ===")
+        logger.info(f"Upload completed: {success_count} successful, {failed_count} failed out of {len(files)} total")
         
         return jsonify({
             "success": True, 
@@ -694,14 +1017,16 @@ def upload_multiple_files():
 def download_all_pdfs():
     """Download all PDF files in a single ZIP archive"""
     try:
-        pdf_files = [f for f in os.listdir(WORKSPACE_PATH) if f.lower().endswith('.pdf')]
+        pdf_files = [item for item in document_storage.list() if not item.is_dir and item.name.lower().endswith('.pdf')]
         if not pdf_files:
             return jsonify({"error": "No PDF files found"}), 404
 
         temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
         with zipfile.ZipFile(temp_file.name, 'w') as zipf:
-            for fname in pdf_files:
-                zipf.write(os.path.join(WORKSPACE_PATH, fname), arcname=fname)
+            for item in pdf_files:
+                with zipf.open(zipfile.ZipInfo(item.name, time.localtime(item.mtime)[:6]), 'w') as member:
+                    for chunk in document_storage.open_range(item.key):
+                        member.write(chunk)
         temp_file.close()
 
         @after_this_request
@@ -721,12 +1046,13 @@ def download_all_pdfs():
 def download_file(filename):
     """Download a file from the workspace directory"""
     try:
-        filepath = safe_join(WORKSPACE_PATH, filename)
+        key = storage_key(filename)
+        entry = document_storage.stat(key)
         
-        if not os.path.exists(filepath):
+        if entry is None or entry.is_dir:
             return jsonify({"error": "File not found"}), 404
         
-        return send_file(filepath, as_attachment=True)
+        return send_document(key, entry)
     
     except Exception as e:
         logger.error(f"Error downloading file {filename}: {str(e)}")
@@ -737,83 +1063,145 @@ def download_file(filename):
 def archived_file_operations(filename):
     """Download or delete a file from the archive directory"""
     try:
-        filepath = safe_join(ARCHIVE_PATH, filename)
+        key = storage_key(ARCHIVE_KEY, filename)
+        entry = document_storage.stat(key)
 
-        if not os.path.exists(filepath):
+        if entry is None or entry.is_dir:
             return jsonify({"error": "File not found"}), 404
 
         if request.method == "DELETE":
-            os.remove(filepath)
+            document_storage.delete(key)
             logger.info(f"Archived file deleted successfully: {filename}")
             return jsonify({"success": True, "message": f"File '{filename}' deleted"})
 
-        return send_file(filepath, as_attachment=True)
+        return send_document(key, entry)
 
     except Exception as e:
         logger.error(f"Error processing archived file {filename}: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 @app.route("/files/<path:filename>/markdown", methods=["GET"])
+@admission.limit("convert")
 def get_markdown(filename):
     """Return Markdown for a PDF file, generating it if needed."""
     try:
         if not filename.lower().endswith('.pdf'):
             return jsonify({"error": "Only PDF files supported"}), 400
-        pdf_path = safe_join(WORKSPACE_PATH, filename)
-        if not os.path.exists(pdf_path):
+        key = storage_key(filename)
+        if document_storage.stat(key) is None:
             return jsonify({"error": "File not found"}), 404
 
-        md_filename = os.path.splitext(filename)[0] + '.md'
-        md_path = safe_join(WORKSPACE_PATH, md_filename)
-
-        if not os.path.exists(md_path):
-            try:
-                pdf_to_markdown(pdf_path, md_path)
-            except Exception as e:
-                logger.error(f"Error generating markdown for {filename}: {str(e)}")
-                return jsonify({"error": str(e)}), 500
+        try:
+            # The Markdown sits next to the document's local path; the document is only fetched to convert it
+            pdf_path = document_storage.path(key)
+            if not artifacts.find_markdown(pdf_path):
+                pdf_path = document_storage.local_path(key)
+            md_path, cached = ensure_markdown(pdf_path)
+            metrics.record_cache("markdown", cached)
+        except conversion_workers.ConversionError as e:
+            return jsonify({"error": str(e), "failure": e.to_dict()}), e.status_code
+        except Exception as e:
+            logger.error(f"Error generating markdown for {filename}: {str(e)}")
+            return jsonify({"error": str(e)}), 500
+
+        raw = request.args.get("format") == "raw" or request.accept_mimetypes.best == artifacts.MARKDOWN_MIMETYPE
+        if raw:
+            encoding = artifacts.content_encoding(md_path)
+            if encoding and request.accept_encodings[encoding]:
+                # Pass the stored bytes through untouched; the client decompresses them
+                response = send_file(md_path, mimetype=artifacts.MARKDOWN_MIMETYPE, conditional=True, etag=True)
+                response.headers["Content-Encoding"] = encoding
+            else:
+                with profiling.span("disk_io", op="read", path=md_path):
+                    response = app.response_class(artifacts.read_text(md_path), mimetype=artifacts.MARKDOWN_MIMETYPE)
+            response.vary.add("Accept-Encoding")
+            return response
 
-        with open(md_path, 'r', encoding='utf-8') as f:
-            text = f.read()
+        with profiling.span("disk_io", op="read", path=md_path):
+            text = artifacts.read_text(md_path)
 
         return jsonify({"markdown": text})
     except Exception as e:
         logger.error(f"Error retrieving markdown for {filename}: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/files/<path:filename>/meta", methods=["GET"])
+@admission.limit("metadata")
+def get_file_meta(filename):
+    """Return page count, info, outline and text layer presence of a PDF file"""
+    try:
+        if not filename.lower().endswith('.pdf'):
+            return jsonify({"error": "Only PDF files supported"}), 400
+        key = storage_key(filename)
+        entry = document_storage.stat(key)
+        if entry is None or entry.is_dir:
+            return jsonify({"error": "File not found"}), 404
+        return jsonify({"meta": pdf_metadata.get(document_storage.local_path(key))})
+    except Exception as e:
+        logger.error(f"Error reading metadata for {filename}: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+def document_state_response(digest: str):
+    """Return or update the state stored for a document's content hash."""
+    ensure_bookmarks_migrated()
+    if request.method == "PATCH":
+        changes = request.get_json(silent=True)
+        if not isinstance(changes, dict):
+            return jsonify({"error": "A JSON object with the changes is required"}), 400
+        state = document_state.patch(digest, changes)
+    else:
+        state = document_state.get(digest)
+    return jsonify({"hash": digest, "state": state})
+
+@app.route("/files/<path:filename>/state", methods=["GET", "PATCH"])
+def file_document_state(filename):
+    """Return or merge-patch the bookmark and other state of a workspace document"""
+    try:
+        key = storage_key(filename)
+        entry = document_storage.stat(key)
+        if entry is None or entry.is_dir:
+            return jsonify({"error": "File not found"}), 404
+        return document_state_response(document_hash(key))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error handling document state of {filename}: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/documents/<digest>/state", methods=["GET", "PATCH"])
+def hashed_document_state(digest):
+    """Return or merge-patch the state of a document by its content hash"""
+    try:
+        return document_state_response(digest)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error handling document state of {digest}: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/files/<path:filename>", methods=["DELETE"])
 def delete_file(filename):
     """Delete a file or folder from the workspace directory"""
     try:
-        filepath = safe_join(WORKSPACE_PATH, filename)
+        key = storage_key(filename)
 
         # Prevent deletion of the archive folder
-        if os.path.abspath(filepath) == os.path.abspath(ARCHIVE_PATH):
+        if key == ARCHIVE_KEY or key == "":
             logger.warning("Attempt to delete archive folder prevented")
             return jsonify({"error": "Archive folder cannot be deleted"}), 400
 
-        if not os.path.exists(filepath):
+        entry = document_storage.stat(key)
+        if entry is None:
             return jsonify({"error": "File not found"}), 404
 
-        if os.path.isdir(filepath):
-            shutil.rmtree(filepath)
+        # A PDF goes together with its Markdown sidecars and translations
+        document_storage.delete(key)
+
+        if entry.is_dir:
             logger.info(f"Folder deleted successfully: {filename}")
             return jsonify({"success": True, "message": f"Folder '{filename}' deleted successfully"})
 
-        os.remove(filepath)
         logger.info(f"File deleted successfully: {filename}")
-
-        # If a PDF was deleted, remove its associated markdown file as well
-        if filename.lower().endswith('.pdf'):
-            md_filename = os.path.splitext(filename)[0] + '.md'
-            md_path = safe_join(WORKSPACE_PATH, md_filename)
-            if os.path.exists(md_path):
-                try:
-                    os.remove(md_path)
-                    logger.info(f"Associated markdown deleted: {md_filename}")
-                except Exception as md_err:
-                    logger.error(f"Error deleting markdown file {md_filename}: {md_err}")
-
         return jsonify({"success": True, "message": f"File '{filename}' deleted successfully"})
 
     except Exception as e:
@@ -825,13 +1213,13 @@ def delete_file(filename):
 def archive_file(filename):
     """Move a file from the workspace to the archive directory"""
     try:
-        src = safe_join(WORKSPACE_PATH, filename)
-        dst = os.path.join(ARCHIVE_PATH, os.path.basename(filename))
+        src = storage_key(filename)
+        dst = storage_key(ARCHIVE_KEY, posixpath.basename(src))
 
-        if not os.path.exists(src):
+        if document_storage.stat(src) is None:
             return jsonify({"error": "File not found"}), 404
 
-        os.rename(src, dst)
+        document_storage.move(src, dst)
         logger.info(f"File archived successfully: {filename}")
         return jsonify({"success": True, "message": f"File '{filename}' archived"})
     except Exception as e:
@@ -843,13 +1231,13 @@ def archive_file(filename):
 def unarchive_file(filename):
     """Move a file from the archive directory back to the workspace"""
     try:
-        src = safe_join(ARCHIVE_PATH, filename)
-        dst = safe_join(WORKSPACE_PATH, os.path.basename(filename))
+        src = storage_key(ARCHIVE_KEY, filename)
+        dst = storage_key(posixpath.basename(src))
 
-        if not os.path.exists(src):
+        if document_storage.stat(src) is None:
             return jsonify({"error": "File not found"}), 404
 
-        os.rename(src, dst)
+        document_storage.move(src, dst)
         logger.info(f"File unarchived successfully: {filename}")
         return jsonify({"success": True, "message": f"File '{filename}' unarchived"})
     except Exception as e:
@@ -865,22 +1253,25 @@ def move_files():
         filenames = data.get("filenames", [])
         destination = data.get("destination", "")
 
-        dest_dir = safe_join(WORKSPACE_PATH, destination) if destination else WORKSPACE_PATH
+        dest_dir = storage_key(destination)
 
-        if destination and not os.path.isdir(dest_dir):
+        dest = document_storage.stat(dest_dir) if dest_dir else None
+        if dest_dir and (dest is None or not dest.is_dir):
             return jsonify({"error": "Destination folder not found"}), 404
 
         moved = []
         errors = []
         for name in filenames:
-            src = safe_join(WORKSPACE_PATH, name)
-            fname = os.path.basename(name)
-            if not os.path.exists(src):
+            src = storage_key(name)
+            fname = posixpath.basename(src)
+            if document_storage.stat(src) is None:
                 errors.append({"file": fname, "error": "File not found"})
                 continue
-            dst = os.path.join(dest_dir, fname)
+            dst = storage_key(dest_dir, fname)
             try:
-                os.rename(src, dst)
+                if document_storage.stat(dst) is not None:
+                    raise FileExistsError(f"Destination already exists: {fname}")
+                document_storage.move(src, dst)
                 moved.append(os.path.join(destination, fname).lstrip('/'))
             except Exception as e:
                 errors.append({"file": fname, "error": str(e)})
@@ -890,6 +1281,46 @@ def move_files():
         logger.error(f"Error moving files: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/files/batch", methods=["POST"])
+def batch_file_operations():
+    """Run a list of move, copy, archive, unarchive and delete operations in one request"""
+    if not document_storage.is_local:
+        return jsonify({"error": f"Batch file operations are not supported with {document_storage.name} storage"}), 501
+    try:
+        data = request.get_json() or {}
+        operations = data.get("operations")
+        if not isinstance(operations, list) or not operations:
+            return jsonify({"error": "operations must be a non-empty list"}), 400
+        if len(operations) > file_operations.MAX_BATCH_OPERATIONS:
+            return jsonify({"error": f"At most {file_operations.MAX_BATCH_OPERATIONS} operations per batch"}), 400
+        atomic = bool(data.get("atomic", True))
+
+        steps = file_operations.plan(operations, WORKSPACE_PATH, ARCHIVE_PATH, safe_join)
+        invalid = [step.event("invalid", step.error) for step in steps if step.error]
+        if invalid and atomic:
+            # Nothing has been touched yet; report every problem at once
+            return jsonify({"success": False, "errors": invalid}), 409
+
+        batch = file_operations.Batch([step for step in steps if not step.error], WORKSPACE_PATH, atomic)
+        logger.info(f"Running batch of {len(batch.steps)} file operations (atomic={atomic})")
+
+        if request.args.get("stream") in ("1", "true") or request.accept_mimetypes.best == "application/x-ndjson":
+            def generate():
+                for event in invalid:
+                    yield json.dumps(event) + "\n"
+                for event in batch.run():
+                    yield json.dumps(event) + "\n"
+            return app.response_class(generate(), mimetype="application/x-ndjson")
+
+        events = list(batch.run())
+        summary = events.pop()
+        summary["results"] = sorted(invalid + events, key=lambda event: event["index"])
+        summary["success"] = summary["success"] and not invalid
+        return jsonify(summary), 200 if summary["success"] else 207
+    except Exception as e:
+        logger.error(f"Error running batch file operations: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/files/clear", methods=["DELETE"])
 def clear_all_files():
     """Delete all files from the workspace directory"""
@@ -897,18 +1328,17 @@ def clear_all_files():
         deleted_files = []
         failed_files = []
         
-        # Get list of all files in workspace
-        if os.path.exists(WORKSPACE_PATH):
-            for filename in os.listdir(WORKSPACE_PATH):
-                filepath = os.path.join(WORKSPACE_PATH, filename)
-                if os.path.isfile(filepath):
-                    try:
-                        os.remove(filepath)
-                        deleted_files.append(filename)
-                        logger.info(f"File deleted successfully: {filename}")
-                    except Exception as e:
-                        failed_files.append({"filename": filename, "error": str(e)})
-                        logger.error(f"Error deleting file {filename}: {str(e)}")
+        # Get list of all files in workspace; deleting a PDF also deletes its sidecars
+        for item in document_storage.list():
+            filename = item.name
+            if not item.is_dir and not artifacts.is_sidecar(filename):
+                try:
+                    document_storage.delete(item.key)
+                    deleted_files.append(filename)
+                    logger.info(f"File deleted successfully: {filename}")
+                except Exception as e:
+                    failed_files.append({"filename": filename, "error": str(e)})
+                    logger.error(f"Error deleting file {filename}: {str(e)}")
         
         total_deleted = len(deleted_files)
         total_failed = len(failed_files)
@@ -942,17 +1372,16 @@ def clear_all_archived_files():
         deleted_files = []
         failed_files = []
 
-        if os.path.exists(ARCHIVE_PATH):
-            for filename in os.listdir(ARCHIVE_PATH):
-                filepath = os.path.join(ARCHIVE_PATH, filename)
-                if os.path.isfile(filepath):
-                    try:
-                        os.remove(filepath)
-                        deleted_files.append(filename)
-                        logger.info(f"Archived file deleted: {filename}")
-                    except Exception as e:
-                        failed_files.append({"filename": filename, "error": str(e)})
-                        logger.error(f"Error deleting archived file {filename}: {str(e)}")
+        for item in document_storage.list(ARCHIVE_KEY):
+            filename = item.name
+            if not item.is_dir and not artifacts.is_sidecar(filename):
+                try:
+                    document_storage.delete(item.key)
+                    deleted_files.append(filename)
+                    logger.info(f"Archived file deleted: {filename}")
+                except Exception as e:
+                    failed_files.append({"filename": filename, "error": str(e)})
+                    logger.error(f"Error deleting archived file {filename}: {str(e)}")
 
         total_deleted = len(deleted_files)
         total_failed = len(failed_files)
@@ -984,14 +1413,13 @@ def test_files_endpoint():
         workspace_writable = os.access(WORKSPACE_PATH, os.W_OK) if workspace_exists else False
         
         # List existing files
-        existing_files = []
-        if workspace_exists:
-            existing_files = [f for f in os.listdir(WORKSPACE_PATH) if os.path.isfile(os.path.join(WORKSPACE_PATH, f))]
+        existing_files = [item.name for item in document_storage.list() if not item.is_dir]
         
         return jsonify({
             "workspace_path": WORKSPACE_PATH,
             "workspace_exists": workspace_exists,
             "workspace_writable": workspace_writable,
+            "storage": document_storage.status(),
             "existing_files": existing_files,
             "allowed_extensions": list(ALLOWED_EXTENSIONS)
         })
@@ -1018,29 +1446,73 @@ def test_files_endpoint():
 #         return jsonify({"error": str(e)}), 500
 
 @app.route("/translation/translate", methods=["POST"])
+@admission.limit("upstream_llm")
 def translate_text():
     """Translate text using the specified provider"""
     try:
         data = request.get_json()
-        logger.info(f"Translation request data: {json.dumps(data, default=str)}")
         
         text = data.get("text")
         provider = data.get("provider")
         model = data.get("model")
         target_language = data.get("target_language")
         prompt_template = data.get("prompt")
+        # The text itself is user content and can be large; log only its size
+        logger.info(f"Translation request: {len(text or '')} chars via {provider}/{model} to {target_language}")
         
         if not all([text, provider, model, target_language]):
             return jsonify({"error": "Text, provider, model, and target_language are required"}), 400
         
-        result = translation_service.translate(text, provider, model, target_language, prompt_template)
+        with scheduler.work(priority=data.get("priority"), document=data.get("document")):
+            result = translation_service.translate(text, provider, model, target_language, prompt_template, data.get("fallbacks"))
         return jsonify(result)
     
     except Exception as e:
         logger.error(f"Error in translation service: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/translation/translate/batch", methods=["POST"])
+@admission.limit("upstream_llm")
+def translate_batch():
+    """Translate many segments concurrently, returning results in the same order"""
+    try:
+        data = request.get_json() or {}
+        segments = data.get("segments")
+        provider = data.get("provider")
+        model = data.get("model")
+        target_language = data.get("target_language")
+        prompt_template = data.get("prompt")
+
+        if not isinstance(segments, list) or not all(isinstance(s, str) for s in segments):
+            return jsonify({"error": "segments must be a list of strings"}), 400
+        if not all([provider, model, target_language]):
+            return jsonify({"error": "Provider, model, and target_language are required"}), 400
+        if len(segments) > TRANSLATION_BATCH_MAX_SEGMENTS:
+            return jsonify({"error": f"At most {TRANSLATION_BATCH_MAX_SEGMENTS} segments per batch"}), 400
+
+        logger.info(f"Batch translation request: {len(segments)} segments via {provider}/{model}")
+        with scheduler.work(priority=data.get("priority"), document=data.get("document")):
+            results = translation_service.translate_batch(segments, provider, model, target_language, prompt_template, data.get("fallbacks"))
+        return jsonify({
+            "success": all(r.get("success") for r in results),
+            "results": results
+        })
+
+    except Exception as e:
+        logger.error(f"Error in batch translation: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/translation/providers/status", methods=["GET"])
+def translation_provider_status():
+    """Report circuit breaker state and observed p95 latency per translation provider"""
+    try:
+        return jsonify({"providers": translation_service.provider_status()})
+    except Exception as e:
+        logger.error(f"Error reading translation provider status: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/translation/test-connection", methods=["POST"])
+@admission.limit("upstream_llm")
 def test_translation_connection():
     """Test connection to the specified translation provider"""
     try:
@@ -1058,7 +1530,134 @@ def test_translation_connection():
         logger.error(f"Error in translation test connection: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/files/<path:filename>/translation", methods=["POST"])
+def start_document_translation(filename):
+    """Start, or resume, translating a whole PDF in the background"""
+    try:
+        data = request.get_json() or {}
+        provider = data.get("provider")
+        model = data.get("model")
+        target_language = data.get("target_language")
+
+        if not filename.lower().endswith('.pdf'):
+            return jsonify({"error": "Only PDF files supported"}), 400
+        if not all([provider, model, target_language]):
+            return jsonify({"error": "Provider, model, and target_language are required"}), 400
+        key = storage_key(filename)
+        entry = document_storage.stat(key)
+        if entry is None or entry.is_dir:
+            return jsonify({"error": "File not found"}), 404
+
+        job = translation_jobs.job_manager.start(
+            key, target_language, provider, model,
+            data.get("prompt"), data.get("fallbacks"), data.get("priority") or request.headers.get(scheduler.PRIORITY_HEADER),
+        )
+        logger.info(f"Document translation job {job.id} for {filename} to {target_language}: {job.status}")
+        return jsonify({"job": job.to_dict()}), 202
+    except Exception as e:
+        logger.error(f"Error starting translation of {filename}: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/translation/jobs", methods=["GET"])
+def list_translation_jobs():
+    """List document translation jobs, newest first"""
+    try:
+        return jsonify({"jobs": [job.to_dict() for job in translation_jobs.job_manager.list()]})
+    except Exception as e:
+        logger.error(f"Error listing translation jobs: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/translation/jobs/<job_id>", methods=["GET"])
+def get_translation_job(job_id):
+    """Return the status, progress and ETA of a document translation job"""
+    try:
+        job = translation_jobs.job_manager.get(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify({"job": job.to_dict()})
+    except Exception as e:
+        logger.error(f"Error reading translation job {job_id}: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/translation/jobs/<job_id>/<action>", methods=["POST"])
+def control_translation_job(job_id, action):
+    """Resume a failed or cancelled job, or cancel a running one"""
+    try:
+        if action not in ("resume", "cancel"):
+            return jsonify({"error": f"Unsupported action: {action}"}), 400
+        manager = translation_jobs.job_manager
+        job = manager.resume(job_id) if action == "resume" else manager.cancel(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify({"job": job.to_dict()})
+    except Exception as e:
+        logger.error(f"Error on {action} of translation job {job_id}: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/translation/jobs/<job_id>/result", methods=["GET"])
+def get_translation_job_result(job_id):
+    """Return the translated Markdown of a completed job"""
+    try:
+        job = translation_jobs.job_manager.get(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        if job.status != "completed" or not job.output:
+            return jsonify({"error": "Translation not finished", "job": job.to_dict()}), 409
+        output_path = safe_join(document_storage.local_root, job.output)
+        if not os.path.isfile(output_path):
+            return jsonify({"error": "Translated file not found"}), 404
+        text = artifacts.read_text(output_path)
+        if request.args.get("format") == "raw":
+            return app.response_class(text, mimetype=artifacts.MARKDOWN_MIMETYPE)
+        return jsonify({"markdown": text, "job": job.to_dict()})
+    except Exception as e:
+        logger.error(f"Error reading result of translation job {job_id}: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+def generate_next_identifier(pattern, existing_identifiers):
+    """Return the identifier following the highest existing one for a pattern."""
+    if not pattern:
+        return "ID001"
+    if "_" in pattern:
+        parts = pattern.split("_")
+        if len(parts) == 2:
+            base_pattern = parts[0]
+            increment_part = parts[1]
+            m = re.match(r"^(.+?)(\d+)$", increment_part)
+            if m:
+                increment_prefix, increment_number_str = m.groups()
+                matching = [id for id in existing_identifiers if id.startswith(base_pattern + "_" + increment_prefix)]
+                max_number = 0
+                for id in matching:
+                    id_parts = id.split("_")
+                    if len(id_parts) == 2 and id_parts[0] == base_pattern:
+                        num_match = re.match(rf"^{re.escape(increment_prefix)}(\d+)$", id_parts[1])
+                        if num_match:
+                            num = int(num_match.group(1))
+                            if num > max_number:
+                                max_number = num
+                next_number = max_number + 1
+                padded = str(next_number).zfill(len(increment_number_str))
+                return f"{base_pattern}_{increment_prefix}{padded}"
+    # fallback: just increment last number
+    m = re.match(r"^(.*?)(\d+)$", pattern)
+    if m:
+        prefix, number_str = m.groups()
+        matching = [id for id in existing_identifiers if id.startswith(prefix)]
+        max_number = 0
+        for id in matching:
+            match = re.match(rf"^{re.escape(prefix)}(\d+)$", id)
+            if match:
+                num = int(match.group(1))
+                if num > max_number:
+                    max_number = num
+        next_number = max_number + 1
+        padded = str(next_number).zfill(len(number_str))
+        return f"{prefix}{padded}"
+    return pattern
+
 @app.route("/notion/save-text-with-identifier", methods=["POST"])
+@admission.limit("upstream_notion")
 def save_text_with_identifier():
     """Save text with generated identifier and all Notion logic (moved from frontend)"""
     try:
@@ -1080,7 +1679,7 @@ def save_text_with_identifier():
         enable_document_id_insertion = config.get("enableDocumentIdInsertion", False)
 
         # 1. Get all existing identifiers
-        db_query = notion.databases.query(database_id=database_id)
+        db_query = notion_call("databases.query", notion.databases.query, database_id=database_id)
         existing_pages = db_query.get("results", [])
         existing_identifiers = []
         for page in existing_pages:
@@ -1092,54 +1691,11 @@ def save_text_with_identifier():
                     existing_identifiers.append(prop["title"][0]["plain_text"])
 
         # 2. Generate next identifier (mimic frontend logic)
-        def generate_next_identifier(pattern, existing_identifiers):
-            if not pattern:
-                return "ID001"
-            if "_" in pattern:
-                parts = pattern.split("_")
-                if len(parts) == 2:
-                    base_pattern = parts[0]
-                    increment_part = parts[1]
-                    import re
-                    m = re.match(r"^(.+?)(\d+)$", increment_part)
-                    if m:
-                        increment_prefix, increment_number_str = m.groups()
-                        matching = [id for id in existing_identifiers if id.startswith(base_pattern + "_" + increment_prefix)]
-                        max_number = 0
-                        for id in matching:
-                            id_parts = id.split("_")
-                            if len(id_parts) == 2 and id_parts[0] == base_pattern:
-                                num_match = re.match(rf"^{re.escape(increment_prefix)}(\d+)$", id_parts[1])
-                                if num_match:
-                                    num = int(num_match.group(1))
-                                    if num > max_number:
-                                        max_number = num
-                        next_number = max_number + 1
-                        padded = str(next_number).zfill(len(increment_number_str))
-                        return f"{base_pattern}_{increment_prefix}{padded}"
-            # fallback: just increment last number
-            import re
-            m = re.match(r"^(.*?)(\d+)$", pattern)
-            if m:
-                prefix, number_str = m.groups()
-                matching = [id for id in existing_identifiers if id.startswith(prefix)]
-                max_number = 0
-                for id in matching:
-                    match = re.match(rf"^{re.escape(prefix)}(\d+)$", id)
-                    if match:
-                        num = int(match.group(1))
-                        if num > max_number:
-                            max_number = num
-                next_number = max_number + 1
-                padded = str(next_number).zfill(len(number_str))
-                return f"{prefix}{padded}"
-            return pattern
-
         identifier = generate_next_identifier(identifier_pattern, existing_identifiers)
 
         # 3. Prepare properties for the new page
         # Fetch property types from database
-        db = notion.databases.retrieve(database_id=database_id)
+        db = notion_call("databases.retrieve", notion.databases.retrieve, database_id=database_id)
         db_properties = db.get("properties", {})
         def get_property_type(name):
             prop = db_properties.get(name)
@@ -1184,11 +1740,71 @@ def save_text_with_identifier():
                 elif docid_type == "title":
                     properties[document_id_insertion_column] = {"title": [{"text": {"content": prefix}}]}
         # 4. Create the page
-        page = notion.pages.create(parent={"database_id": database_id}, properties=properties)
+        page = notion_call("pages.create", notion.pages.create, parent={"database_id": database_id}, properties=properties)
         return jsonify({"success": True, "identifier": identifier, "page": page})
     except Exception as e:
         logger.error(f"Error in save_text_with_identifier: {str(e)}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+def warm_notion_connection():
+    """Open the pooled Notion connection so the first real call skips the TLS handshake"""
+    if NOTION_API_KEY:
+        notion.client.get(NOTION_BASE_URL)
+
+warmup.step("converter", conversion_workers.conversion_pool.warm if conversion_workers.ISOLATION_ENABLED else md_converter.get)
+warmup.step("notion", warm_notion_connection)
+warmup.step("translation", translation_service.warm_up)
+warmup.step("document_state", legacy_bookmarks.get)
+
+@app.route("/janitor", methods=["GET"])
+def janitor_report():
+    """Report of the last janitor run and the quotas it enforces"""
+    try:
+        return jsonify({
+            "enabled": janitor.JANITOR_ENABLED,
+            "interval_seconds": janitor.INTERVAL_SECONDS,
+            "running": shared_state.locked("janitor"),
+            "last_run": janitor.janitor.last_report(),
+        })
+    except Exception as e:
+        logger.error(f"Error reading janitor report: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/janitor/run", methods=["POST"])
+def janitor_run():
+    """Run the janitor now; ?dry_run=true reports what it would remove without removing it"""
+    try:
+        dry_run = request.args.get("dry_run", "false").lower() in ("1", "true", "yes")
+        report = janitor.janitor.run(dry_run=dry_run)
+        if report is None:
+            return jsonify({"error": "The janitor is already running"}), 409
+        return jsonify(report)
+    except Exception as e:
+        logger.error(f"Error running janitor: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/health/live", methods=["GET"])
+def health_live():
+    """Report that the process is up and serving requests"""
+    return jsonify({"status": "ok"})
+
+@app.route("/health/ready", methods=["GET"])
+def health_ready():
+    """Report whether warm-up has finished, answering 503 until it has"""
+    warmup.start()
+    status = warmup.status()
+    status["admission"] = admission.status()
+    status["shared_state"] = shared_state.status()
+    status["storage"] = document_storage.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+# Jobs left behind by a replica that stopped are picked up by the leader
+shared_state.sweeper.register("translation_jobs", translation_jobs.SWEEP_SECONDS, translation_jobs.job_manager.resume_interrupted)
+# Derived files of documents that are gone are collected, and quotas enforced, by the leader
+if janitor.JANITOR_ENABLED:
+    shared_state.sweeper.register("janitor", janitor.INTERVAL_SECONDS, janitor.janitor.run)
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
+    warmup.start()
+    shared_state.sweeper.start()
+    app.run(host="0.0.0.0", port=int(os.environ.get("BACKEND_PORT", "5000")))
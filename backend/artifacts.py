@@ -0,0 +1,147 @@
+import os
+import re
+import gzip
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is always available
+    zstandard = None
+
+import shared_state
+
+# Compression used for newly written artifacts: "gzip", "zstd" (needs zstandard) or "none"
+ARTIFACT_COMPRESSION = os.environ.get("ARTIFACT_COMPRESSION", "gzip").lower()
+
+MARKDOWN_MIMETYPE = "text/markdown"
+
+
+class Codec(NamedTuple):
+    encoding: str
+    suffix: str
+    compress: Callable[[bytes], bytes]
+    decompress: Callable[[bytes], bytes]
+
+
+CODECS: Dict[str, Codec] = {
+    # mtime=0 keeps the output byte-identical for identical text, so ETags are stable
+    "gzip": Codec("gzip", ".gz", lambda data: gzip.compress(data, compresslevel=6, mtime=0), gzip.decompress),
+}
+if zstandard is not None:
+    CODECS["zstd"] = Codec(
+        "zstd", ".zst",
+        lambda data: zstandard.ZstdCompressor(level=10).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+    )
+
+# Sidecars of a PDF, optionally with the suffix of an interrupted atomic write
+_SIDECAR_RE = re.compile(r"\.md(\.gz|\.zst)?(\.\d+-\d+\.partial)?$", re.IGNORECASE)
+
+# Translated Markdown of a PDF: "<name>.translation.<language>.md", plus the codec suffix
+TRANSLATION_INFIX = ".translation."
+_TRANSLATION_RE = re.compile(r"^\.translation\.([a-z0-9-]+)\.md(\.gz|\.zst)?$")
+
+
+def _codec_for(path: str) -> Optional[Codec]:
+    for codec in CODECS.values():
+        if path.endswith(".md" + codec.suffix):
+            return codec
+    return None
+
+
+def _preferred_codec() -> Optional[Codec]:
+    return CODECS.get(ARTIFACT_COMPRESSION)
+
+
+def is_sidecar(filename: str) -> bool:
+    """Whether a workspace entry is a generated Markdown sidecar rather than a user file"""
+    return bool(_SIDECAR_RE.search(filename))
+
+
+def markdown_path(pdf_path: str) -> str:
+    """Path a new Markdown sidecar for the PDF is written to"""
+    codec = _preferred_codec()
+    return os.path.splitext(pdf_path)[0] + ".md" + (codec.suffix if codec else "")
+
+
+def markdown_paths(pdf_path: str) -> List[str]:
+    """Existing Markdown sidecars of the PDF, preferred format first"""
+    base = os.path.splitext(pdf_path)[0] + ".md"
+    preferred = markdown_path(pdf_path)
+    candidates = [preferred] + [base + codec.suffix for codec in CODECS.values()] + [base]
+    return [path for path in dict.fromkeys(candidates) if os.path.exists(path)]
+
+
+def language_slug(language: str) -> str:
+    """File-name form of a target language, such as brazilian-portuguese"""
+    return re.sub(r"[^a-z0-9]+", "-", language.strip().lower()).strip("-") or "unknown"
+
+
+def translation_path(pdf_path: str, language: str) -> str:
+    """Path the translated Markdown of the PDF is written to"""
+    codec = _preferred_codec()
+    base = os.path.splitext(pdf_path)[0]
+    return f"{base}{TRANSLATION_INFIX}{language_slug(language)}.md" + (codec.suffix if codec else "")
+
+
+def translation_paths(pdf_path: str) -> Dict[str, str]:
+    """Existing translated Markdown artifacts of the PDF by language slug"""
+    base = os.path.splitext(pdf_path)[0]
+    directory, prefix = os.path.split(base)
+    found: Dict[str, str] = {}
+    try:
+        names = sorted(os.listdir(directory or "."))
+    except OSError:
+        return found
+    for name in names:
+        if not name.startswith(prefix):
+            continue
+        match = _TRANSLATION_RE.match(name[len(prefix):])
+        if match:
+            found.setdefault(match.group(1), os.path.join(directory, name))
+    return found
+
+
+def artifact_paths(pdf_path: str) -> List[str]:
+    """Every generated artifact of the PDF: Markdown sidecars and translations"""
+    return markdown_paths(pdf_path) + list(translation_paths(pdf_path).values())
+
+
+def find_markdown(pdf_path: str) -> Optional[str]:
+    """The sidecar to serve for the PDF, including plain .md files written by older versions"""
+    paths = markdown_paths(pdf_path)
+    return paths[0] if paths else None
+
+
+def content_encoding(path: str) -> Optional[str]:
+    """HTTP Content-Encoding of the artifact's bytes on disk, None when stored plain"""
+    codec = _codec_for(path)
+    return codec.encoding if codec else None
+
+
+def write_text(path: str, text: str) -> None:
+    """Compress text according to the path's suffix and write it atomically"""
+    data = text.encode("utf-8")
+    codec = _codec_for(path)
+    if codec:
+        data = codec.compress(data)
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.partial"
+    with shared_state.file_lock(path):
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def read_text(path: str) -> str:
+    """Read an artifact and return its decoded text"""
+    with open(path, "rb") as f:
+        data = f.read()
+    codec = _codec_for(path)
+    if codec:
+        data = codec.decompress(data)
+    return data.decode("utf-8")
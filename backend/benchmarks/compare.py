@@ -0,0 +1,53 @@
+"""Compare two benchmark result files and flag regressions.
+
+    python -m benchmarks.compare results/backend-abc1234.json results/backend-def5678.json
+
+Exits with status 1 when any benchmark's median slowed down by more than the
+threshold (10% by default).
+"""
+import sys
+import json
+import argparse
+from typing import Any, Dict, List
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float, metric: str = "median_ms") -> List[Dict[str, Any]]:
+    rows = []
+    base_benchmarks = baseline.get("benchmarks", {})
+    for name, stats in sorted(current.get("benchmarks", {}).items()):
+        base = base_benchmarks.get(name)
+        if not base or not base.get(metric):
+            rows.append({"name": name, "baseline": None, "current": stats.get(metric), "change": None, "status": "new"})
+            continue
+        change = (stats[metric] - base[metric]) / base[metric]
+        status = "regression" if change > threshold else "improvement" if change < -threshold else "unchanged"
+        rows.append({"name": name, "baseline": base[metric], "current": stats[metric], "change": change, "status": status})
+    return rows
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown reported as a regression")
+    parser.add_argument("--metric", default="median_ms")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    baseline, current = load(args.baseline), load(args.current)
+    print(f"Baseline {baseline.get('git_commit')} vs current {current.get('git_commit')} ({args.metric})")
+    rows = compare(baseline, current, args.threshold, args.metric)
+    for row in rows:
+        if row["change"] is None:
+            print(f"  {row['name']:48s} {'':>12s} {row['current']:>12.4f}  new")
+        else:
+            print(f"  {row['name']:48s} {row['baseline']:>12.4f} {row['current']:>12.4f} {row['change']:>+8.1%}  {row['status']}")
+    return 1 if any(row["status"] == "regression" for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
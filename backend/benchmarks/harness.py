@@ -0,0 +1,94 @@
+"""Timing and result-file helpers shared by the benchmark suite."""
+import os
+import json
+import time
+import platform
+import statistics
+import subprocess
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Target duration of a single timed sample, used to batch very fast calls
+MIN_SAMPLE_SECONDS = 0.002
+
+
+def _calibrate(func: Callable[[], Any]) -> int:
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        if time.perf_counter() - start >= MIN_SAMPLE_SECONDS or number >= 1_000_000:
+            return number
+        number *= 10
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def measure(func: Callable[[], Any], repeat: int = 15, number: Optional[int] = None, warmup: int = 1) -> Dict[str, Any]:
+    """Time func and return per-call statistics in milliseconds"""
+    for _ in range(warmup):
+        func()
+    number = number or _calibrate(func)
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - start) / number * 1000)
+    median = statistics.median(samples)
+    return {
+        "repeat": repeat,
+        "number": number,
+        "min_ms": round(min(samples), 6),
+        "median_ms": round(median, 6),
+        "p95_ms": round(_percentile(samples, 0.95), 6),
+        "mean_ms": round(statistics.fmean(samples), 6),
+        "stdev_ms": round(statistics.stdev(samples), 6) if len(samples) > 1 else 0.0,
+        "ops_per_sec": round(1000 / median, 3) if median else None,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def write_results(suite: str, benchmarks: Dict[str, Any], output: Optional[str] = None) -> str:
+    """Write benchmark results as JSON, by default under results/<suite>-<commit>.json"""
+    commit = git_commit()
+    document = {
+        "suite": suite,
+        "timestamp": datetime.now().isoformat(),
+        "git_commit": commit,
+        "environment": environment(),
+        "benchmarks": benchmarks,
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{suite}-{commit}.json")
+    with open(output, "w") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+    return output
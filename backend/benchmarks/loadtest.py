@@ -0,0 +1,323 @@
+"""End-to-end load generator for a running NotyPDF stack.
+
+Replays a synthetic traffic mix or a recorded trace against the API (normally
+through nginx) at increasing concurrency and reports throughput, per-route
+latency percentiles and error rates:
+
+    python -m benchmarks.loadtest --target http://localhost:5026/api \\
+        --concurrency 1,8,32,64 --duration 30 --output loadtest.json
+
+A trace is a JSON-lines file with one request per line, either a named
+operation (``{"op": "markdown"}``) or a raw request
+(``{"method": "GET", "path": "/files?path=papers"}``). ``--record-from`` turns
+an nginx access log into such a trace. Upstreams should point at the stubs in
+benchmarks.stubs; see docker-compose-loadtest.yml.
+"""
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+from benchmarks import harness, pdfgen
+
+# Default synthetic mix, weights are relative
+DEFAULT_MIX = {
+    "list": 40,
+    "markdown": 25,
+    "config": 10,
+    "translate": 15,
+    "notion_save": 7,
+    "upload": 3,
+}
+
+SEED_DOCUMENTS = 8
+TRANSLATION_TEXT = "The results indicate a significant correlation between the variables studied."
+
+NOTION_CONFIG = {
+    "databaseId": "loadtest-db",
+    "identifierColumn": "ID",
+    "textColumn": "Text",
+    "annotationColumn": "Annotation",
+    "pageColumn": "Page",
+    "identifierPattern": "LT001_RF001",
+}
+
+
+class Recorder:
+    """Thread-safe collection of per-route latencies and failures"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, route: str, seconds: float, status: Optional[int]) -> None:
+        failed = status is None or status >= 400
+        with self._lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            key = str(status) if status is not None else "exception"
+            counts = self.statuses.setdefault(route, {})
+            counts[key] = counts.get(key, 0) + 1
+            if failed:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        routes = {}
+        total = 0
+        failures = 0
+        for route, values in sorted(self.latencies.items()):
+            values_ms = [v * 1000 for v in values]
+            errors = self.errors.get(route, 0)
+            total += len(values)
+            failures += errors
+            routes[route] = {
+                "requests": len(values),
+                "throughput_rps": round(len(values) / elapsed, 3),
+                "error_rate": round(errors / len(values), 4),
+                "statuses": self.statuses.get(route, {}),
+                "p50_ms": round(harness._percentile(values_ms, 0.50), 3),
+                "p90_ms": round(harness._percentile(values_ms, 0.90), 3),
+                "p95_ms": round(harness._percentile(values_ms, 0.95), 3),
+                "p99_ms": round(harness._percentile(values_ms, 0.99), 3),
+                "max_ms": round(max(values_ms), 3),
+            }
+        return {
+            "duration_s": round(elapsed, 3),
+            "requests": total,
+            "throughput_rps": round(total / elapsed, 3) if elapsed else 0.0,
+            "error_rate": round(failures / total, 4) if total else 0.0,
+            "routes": routes,
+        }
+
+
+class Client:
+    """Builds and sends the requests of each traffic operation"""
+
+    def __init__(self, target: str, documents: List[str], rng: random.Random, timeout: float):
+        self.target = target.rstrip("/")
+        self.documents = documents
+        self.rng = rng
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.upload_body = pdfgen.build_pdf(3, seed=rng.randint(0, 1_000_000))
+
+    def send(self, method: str, path: str, **kwargs: Any) -> requests.Response:
+        return self.session.request(method, self.target + path, timeout=self.timeout, **kwargs)
+
+    def op_list(self):
+        return "GET /files", self.send("GET", "/files")
+
+    def op_markdown(self):
+        document = self.rng.choice(self.documents)
+        return "GET /files/<path>/markdown", self.send("GET", f"/files/{requests.utils.quote(document)}/markdown")
+
+    def op_config(self):
+        return "GET /config", self.send("GET", "/config")
+
+    def op_translate(self):
+        payload = {
+            "text": TRANSLATION_TEXT,
+            "provider": self.rng.choice(["openai", "openrouter", "gemini", "deepseek"]),
+            "model": "stub-model",
+            "target_language": "Spanish",
+        }
+        return "POST /translation/translate", self.send("POST", "/translation/translate", json=payload)
+
+    def op_notion_save(self):
+        payload = {"text": TRANSLATION_TEXT, "config": dict(NOTION_CONFIG, pageNumber=self.rng.randint(1, 300))}
+        return "POST /notion/save-text-with-identifier", self.send("POST", "/notion/save-text-with-identifier", json=payload)
+
+    def op_upload(self):
+        name = f"loadtest_upload_{self.rng.randint(0, 10**9)}.pdf"
+        files = {"file": (name, self.upload_body, "application/pdf")}
+        return "POST /files/upload", self.send("POST", "/files/upload", files=files)
+
+    def raw(self, entry: Dict[str, Any]):
+        method = entry.get("method", "GET").upper()
+        path = entry["path"]
+        route = entry.get("route") or f"{method} {path.split('?', 1)[0]}"
+        kwargs = {"json": entry["json"]} if "json" in entry else {}
+        return route, self.send(method, path, **kwargs)
+
+    def run(self, entry: Dict[str, Any]):
+        if "op" in entry:
+            return getattr(self, f"op_{entry['op']}")()
+        return self.raw(entry)
+
+
+def synthetic_traffic(mix: Dict[str, float], rng: random.Random) -> Callable[[], Dict[str, Any]]:
+    ops = list(mix)
+    weights = [mix[op] for op in ops]
+    return lambda: {"op": rng.choices(ops, weights)[0]}
+
+
+def trace_traffic(entries: List[Dict[str, Any]], offset: int) -> Callable[[], Dict[str, Any]]:
+    position = [offset]
+
+    def next_entry():
+        entry = entries[position[0] % len(entries)]
+        position[0] += 1
+        return entry
+    return next_entry
+
+
+def load_trace(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+ACCESS_LOG = re.compile(r'"(?P<method>[A-Z]+) (?P<path>\S+) HTTP/[\d.]+" (?P<status>\d{3})')
+
+# Map recorded API paths back to operations whose request bodies can be synthesised
+RECORDED_OPS = [
+    (re.compile(r"^POST /api/files/upload"), "upload"),
+    (re.compile(r"^GET /api/files/.+/markdown$"), "markdown"),
+    (re.compile(r"^POST /api/translation/translate$"), "translate"),
+    (re.compile(r"^POST /api/notion/save-text-with-identifier$"), "notion_save"),
+]
+
+
+def record_from_access_log(log_path: str, trace_path: str) -> int:
+    """Convert an nginx access log into a replayable trace, returning its length"""
+    count = 0
+    with open(log_path, "r") as log, open(trace_path, "w") as trace:
+        for line in log:
+            match = ACCESS_LOG.search(line)
+            if not match or not match.group("path").startswith("/api/"):
+                continue
+            method, path = match.group("method"), match.group("path")
+            request_line = f"{method} {path.split('?', 1)[0]}"
+            entry = next(({"op": op} for pattern, op in RECORDED_OPS if pattern.match(request_line)), None)
+            if entry is None:
+                if method != "GET":
+                    continue
+                entry = {"method": method, "path": path[len("/api"):]}
+            trace.write(json.dumps(entry) + "\n")
+            count += 1
+    return count
+
+
+def seed_documents(target: str, timeout: float) -> List[str]:
+    """Upload the documents used by markdown fetches and return their names"""
+    session = requests.Session()
+    names = []
+    for index in range(SEED_DOCUMENTS):
+        body = pdfgen.build_pdf(5 + index * 5, seed=index)
+        files = {"file": (f"loadtest_seed_{index}.pdf", body, "application/pdf")}
+        response = session.post(f"{target.rstrip('/')}/files/upload", files=files, timeout=timeout)
+        response.raise_for_status()
+        names.append(response.json()["file"]["name"])
+    return names
+
+
+def run_step(target: str, concurrency: int, duration: float, documents: List[str], traffic: Callable[[int, random.Random], Callable[[], Dict[str, Any]]], seed: int, timeout: float) -> Dict[str, Any]:
+    recorder = Recorder()
+    deadline = time.monotonic() + duration
+
+    def worker(index: int) -> None:
+        rng = random.Random(seed * 1000 + index)
+        client = Client(target, documents, rng, timeout)
+        next_entry = traffic(index, rng)
+        while time.monotonic() < deadline:
+            entry = next_entry()
+            route = entry.get("op", entry.get("path", "unknown"))
+            start = time.perf_counter()
+            try:
+                route, response = client.run(entry)
+                status = response.status_code
+            except Exception:
+                status = None
+            recorder.record(route, time.perf_counter() - start, status)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report = recorder.report(time.monotonic() - started)
+    report["concurrency"] = concurrency
+    return report
+
+
+def print_step(report: Dict[str, Any]) -> None:
+    print(f"\nconcurrency {report['concurrency']}: {report['throughput_rps']:.1f} req/s, "
+          f"{report['requests']} requests, error rate {report['error_rate']:.2%}")
+    print(f"  {'route':44s} {'rps':>8s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'errors':>8s}")
+    for route, stats in report["routes"].items():
+        print(f"  {route:44s} {stats['throughput_rps']:>8.1f} {stats['p50_ms']:>9.1f} "
+              f"{stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f} {stats['error_rate']:>8.2%}")
+
+
+def wait_for_target(target: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if requests.get(f"{target.rstrip('/')}/files", timeout=5).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        if time.monotonic() > deadline:
+            raise SystemExit(f"Target {target} did not become ready within {timeout:.0f}s")
+        time.sleep(1)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay traffic against a running NotyPDF stack")
+    parser.add_argument("--target", default="http://localhost:5026/api", help="API base URL, normally through nginx")
+    parser.add_argument("--concurrency", default="1,4,16,32", help="Comma separated concurrency steps")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per concurrency step")
+    parser.add_argument("--mix", help="JSON object of operation weights for synthetic traffic")
+    parser.add_argument("--trace", help="JSON-lines trace to replay instead of the synthetic mix")
+    parser.add_argument("--record-from", help="Convert this nginx access log into --trace and exit")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--wait", type=float, default=120.0, help="Seconds to wait for the target to come up")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    if args.record_from:
+        if not args.trace:
+            parser.error("--record-from requires --trace")
+        count = record_from_access_log(args.record_from, args.trace)
+        print(f"Recorded {count} requests to {args.trace}")
+        return 0
+
+    if args.trace:
+        entries = load_trace(args.trace)
+        traffic = lambda index, rng: trace_traffic(entries, index * max(1, len(entries) // 7))
+    else:
+        mix = json.loads(args.mix) if args.mix else DEFAULT_MIX
+        traffic = lambda index, rng: synthetic_traffic(mix, rng)
+
+    wait_for_target(args.target, args.wait)
+    documents = seed_documents(args.target, args.timeout)
+    steps = []
+    for concurrency in (int(c) for c in args.concurrency.split(",")):
+        report = run_step(args.target, concurrency, args.duration, documents, traffic, args.seed, args.timeout)
+        print_step(report)
+        steps.append(report)
+
+    if args.output:
+        document = {
+            "suite": "loadtest",
+            "git_commit": harness.git_commit(),
+            "target": args.target,
+            "traffic": args.trace or (json.loads(args.mix) if args.mix else DEFAULT_MIX),
+            "steps": steps,
+        }
+        with open(args.output, "w") as f:
+            json.dump(document, f, indent=2)
+        print(f"\nReport written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
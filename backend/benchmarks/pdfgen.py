@@ -0,0 +1,71 @@
+"""Generate synthetic text PDFs for conversion benchmarks without extra dependencies."""
+import os
+import random
+from typing import List
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+    "incididunt ut labore et dolore magna aliqua enim ad minim veniam quis nostrud "
+    "exercitation ullamco laboris nisi aliquip ex ea commodo consequat research "
+    "notion highlight reference annotation document chapter translation archive"
+).split()
+
+LINES_PER_PAGE = 40
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _page_stream(rng: random.Random, page_number: int) -> bytes:
+    lines = [f"Chapter {page_number}"]
+    for _ in range(LINES_PER_PAGE - 1):
+        lines.append(" ".join(rng.choice(WORDS) for _ in range(12)))
+    commands = ["BT", "/F1 10 Tf", "12 TL", "56 760 Td"]
+    for line in lines:
+        commands.append(f"({_escape(line)}) Tj T*")
+    commands.append("ET")
+    return "\n".join(commands).encode("latin-1")
+
+
+def build_pdf(pages: int, seed: int = 0) -> bytes:
+    """Return the bytes of a PDF with the given number of text pages"""
+    rng = random.Random(seed)
+    objects: List[bytes] = [b"", b"", b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page_number in range(1, pages + 1):
+        stream = _page_stream(rng, page_number)
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 3 0 R >> >> >>" % content_ref
+        )
+        kids.append(b"%d 0 R" % len(objects))
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = b"<< /Type /Pages /Kids [" + b" ".join(kids) + b"] /Count %d >>" % pages
+    objects.append(b"<< /Title (Synthetic benchmark document) /Producer (notypdf benchmarks) >>")
+    info_ref = len(objects)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, info_ref, xref)
+    return bytes(out)
+
+
+def write_corpus(directory: str, page_counts: List[int]) -> List[str]:
+    """Write one PDF per page count into directory and return their paths"""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for pages in page_counts:
+        path = os.path.join(directory, f"synthetic_{pages}p.pdf")
+        with open(path, "wb") as f:
+            f.write(build_pdf(pages, seed=pages))
+        paths.append(path)
+    return paths
@@ -0,0 +1,134 @@
+"""Minimal Redis-compatible server for trying out several backend replicas locally.
+
+Run ``python -m benchmarks.redis_stub --port 6379`` from the backend directory and
+start each replica with ``SHARED_STATE_URL=redis://127.0.0.1:6379/0``. It speaks
+RESP and implements only the commands the shared state layer uses: PING, AUTH,
+SELECT, GET, SET with PX/EX/NX, DEL and EVAL of the lock release and renew
+scripts. Everything lives in memory.
+"""
+import time
+import argparse
+import threading
+import socketserver
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class StubRedis:
+    """Key space with millisecond expiry, shared by every connection"""
+
+    def __init__(self):
+        self.values: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        self.lock = threading.Lock()
+        self.commands = 0
+
+    def _get(self, key: bytes) -> Optional[bytes]:
+        entry = self.values.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self.values[key]
+            return None
+        return entry[0]
+
+    def execute(self, args: List[bytes]) -> Any:
+        name = args[0].upper()
+        with self.lock:
+            self.commands += 1
+            if name == b"PING":
+                return "PONG"
+            if name in (b"AUTH", b"SELECT"):
+                return "OK"
+            if name == b"GET":
+                return self._get(args[1])
+            if name == b"DEL":
+                removed = sum(1 for key in args[1:] if self._get(key) is not None)
+                for key in args[1:]:
+                    self.values.pop(key, None)
+                return removed
+            if name == b"SET":
+                return self._set(args[1], args[2], [arg.upper() for arg in args[3:]])
+            if name == b"EVAL":
+                return self._eval(args[1], args[3], args[4:])
+        return Exception(f"ERR unknown command '{name.decode()}'")
+
+    def _set(self, key: bytes, value: bytes, options: List[bytes]) -> Any:
+        expires = None
+        if b"PX" in options:
+            expires = time.monotonic() + int(options[options.index(b"PX") + 1]) / 1000
+        elif b"EX" in options:
+            expires = time.monotonic() + int(options[options.index(b"EX") + 1])
+        if b"NX" in options and self._get(key) is not None:
+            return None
+        self.values[key] = (value, expires)
+        return "OK"
+
+    def _eval(self, script: bytes, key: bytes, argv: List[bytes]) -> Any:
+        # Only the compare-and-delete and compare-and-expire scripts of shared_state
+        if self._get(key) != argv[0]:
+            return 0
+        if b"'del'" in script:
+            del self.values[key]
+            return 1
+        if b"'pexpire'" in script:
+            self.values[key] = (argv[0], time.monotonic() + int(argv[1]) / 1000)
+            return 1
+        return Exception("ERR script not supported by the stub")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if not line.startswith(b"*"):
+                continue
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            self.wfile.write(_encode(self.server.redis.execute(args)))
+
+
+def _encode(value: Any) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, Exception):
+        return b"-" + str(value).encode() + b"\r\n"
+    if isinstance(value, str):
+        return b"+" + value.encode() + b"\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+class StubRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: Tuple[str, int] = ("127.0.0.1", 0)):
+        super().__init__(address, _Handler)
+        self.redis = StubRedis()
+        threading.Thread(target=self.serve_forever, name="redis-stub", daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    server = StubRedisServer((args.host, args.port))
+    print(f"SHARED_STATE_URL={server.url}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""Backend microbenchmarks.
+
+Run from the backend directory:
+
+    python -m benchmarks.run            # full suite, results/backend-<commit>.json
+    python -m benchmarks.run --quick    # smaller workspaces and corpus
+    python -m benchmarks.run --only list_files
+
+Upstream calls go to the local stubs in benchmarks.stubs, so no API keys or
+network access are needed.
+"""
+import os
+import sys
+import shutil
+import logging
+import argparse
+import subprocess
+import hashlib
+import tempfile
+import importlib
+from typing import Any, Callable, Dict, List
+
+import artifacts
+from benchmarks import harness, pdfgen, stubs
+
+FILENAMES = {
+    "ascii": "Annual report 2024.pdf",
+    "unicode": "Über die Grundlagen der Mathematik — 第二版.pdf",
+    "dangerous": 'con:fig/../..\\secret<>|?*"\x00\x1f.pdf',
+    "long": ("very long filename " * 20) + ".pdf",
+}
+
+
+class Context:
+    """Shared state for a benchmark run"""
+
+    def __init__(self, args: argparse.Namespace, workdir: str):
+        self.args = args
+        self.workdir = workdir
+        self.backend = None
+        self.client = None
+
+    def measure(self, func: Callable[[], Any], repeat: int = None, number: int = None) -> Dict[str, Any]:
+        return harness.measure(func, repeat=repeat or self.args.repeat, number=number)
+
+
+def bench_safe_filename(ctx: Context) -> Dict[str, Any]:
+    results = {}
+    for label, name in FILENAMES.items():
+        results[f"safe_filename[{label}]"] = ctx.measure(lambda: ctx.backend.safe_filename(name))
+    return results
+
+
+def bench_generate_next_identifier(ctx: Context) -> Dict[str, Any]:
+    results = {}
+    for count in (100, 1000, 10000):
+        existing = [f"LV{i % 50:03d}_RF{i:04d}" for i in range(count)]
+        results[f"generate_next_identifier[{count}]"] = ctx.measure(
+            lambda: ctx.backend.generate_next_identifier("LV007_RF0001", existing)
+        )
+    return results
+
+
+def bench_config(ctx: Context) -> Dict[str, Any]:
+    backend = ctx.backend
+    config = backend.load_config()
+    return {
+        "load_config": ctx.measure(backend.load_config),
+        "save_config": ctx.measure(lambda: backend.save_config(config)),
+    }
+
+
+def bench_document_state(ctx: Context) -> Dict[str, Any]:
+    # Bookmarks are stored per document, so their cost should not grow with the number of documents
+    document_state = importlib.import_module("document_state")
+    results = {}
+    digest = hashlib.sha256(b"bench").hexdigest()
+    for documents in (0, 1000):
+        document_state.clear()
+        for i in range(documents):
+            document_state.patch(hashlib.sha256(f"document_{i}".encode()).hexdigest(), {"bookmark": i % 300 + 1})
+        pages = iter(range(1, 10 ** 9))
+        results[f"document_state_patch[{documents}_documents]"] = ctx.measure(
+            lambda: document_state.patch(digest, {"bookmark": next(pages)})
+        )
+        results[f"document_state_get[{documents}_documents]"] = ctx.measure(lambda: document_state.get(digest))
+    document_state.clear()
+    return results
+
+
+def _build_workspace(root: str, count: int) -> None:
+    os.makedirs(root, exist_ok=True)
+    for i in range(count // 1000):
+        os.makedirs(os.path.join(root, f"folder_{i:03d}"), exist_ok=True)
+    for i in range(count):
+        name = f"document_{i:06d}"
+        open(os.path.join(root, f"{name}.pdf"), "wb").close()
+        if i % 4 == 0:
+            open(artifacts.markdown_path(os.path.join(root, f"{name}.pdf")), "wb").close()
+
+
+def bench_list_files(ctx: Context) -> Dict[str, Any]:
+    results = {}
+    backend = ctx.backend
+    for count in ctx.args.workspace_sizes:
+        folder = f"bench_{count}"
+        _build_workspace(os.path.join(backend.WORKSPACE_PATH, folder), count)
+
+        def list_folder():
+            response = ctx.client.get(f"/files?path={folder}")
+            assert response.status_code == 200, response.data
+
+        results[f"list_files[{count}]"] = ctx.measure(list_folder, repeat=ctx.args.slow_repeat, number=1)
+        shutil.rmtree(os.path.join(backend.WORKSPACE_PATH, folder), ignore_errors=True)
+    return results
+
+
+def bench_pdf_to_markdown(ctx: Context) -> Dict[str, Any]:
+    results = {}
+    corpus = pdfgen.write_corpus(os.path.join(ctx.workdir, "corpus"), ctx.args.pdf_pages)
+    for pages, path in zip(ctx.args.pdf_pages, corpus):
+        md_path = artifacts.markdown_path(path)
+        results[f"pdf_to_markdown[{pages}_pages]"] = ctx.measure(
+            lambda: ctx.backend.pdf_to_markdown(path, md_path), repeat=ctx.args.slow_repeat, number=1
+        )
+    return results
+
+
+# Fresh interpreter that imports the backend and serves one listing
+COLD_START_SCRIPT = "import app; app.app.test_client().get('/files')"
+
+
+def bench_cold_start(ctx: Context) -> Dict[str, Any]:
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, WARMUP_ENABLED="false")
+
+    def start() -> None:
+        subprocess.run([sys.executable, "-c", COLD_START_SCRIPT], cwd=backend_dir, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    stats = ctx.measure(start, repeat=ctx.args.slow_repeat, number=1)
+    stats["budget_ms"] = ctx.args.import_budget_ms
+    return {"cold_start[first_listing]": stats}
+
+
+def bench_translate(ctx: Context) -> Dict[str, Any]:
+    results = {}
+    service = importlib.import_module("translation").translation_service
+    text = "The quick brown fox jumps over the lazy dog. " * 10
+    for provider in ("openai", "openrouter", "gemini", "deepseek"):
+        def translate():
+            # Past the first call the same text would come from the translation memory
+            result = service.translate(text, provider, "stub-model", "Spanish", use_memory=False)
+            assert result.get("success"), result
+        results[f"translate[{provider}]"] = ctx.measure(translate, repeat=ctx.args.slow_repeat)
+    return results
+
+
+def bench_translation_memory(ctx: Context) -> Dict[str, Any]:
+    service = importlib.import_module("translation").translation_service
+    text = "\n\n".join(f"Paragraph {i} of an earlier edition, translated once and then reused." for i in range(20))
+    assert service.translate(text, "openai", "stub-model", "Spanish").get("success")
+
+    def translate():
+        result = service.translate(text, "openai", "stub-model", "Spanish")
+        assert result.get("success"), result
+
+    return {"translate[memory_hit]": ctx.measure(translate, repeat=ctx.args.slow_repeat)}
+
+
+def bench_notion_save(ctx: Context) -> Dict[str, Any]:
+    payload = {
+        "text": "A highlighted passage from the document.",
+        "config": {
+            "databaseId": "bench-db",
+            "identifierColumn": "ID",
+            "textColumn": "Text",
+            "annotationColumn": "Annotation",
+            "pageColumn": "Page",
+            "identifierPattern": "LV001_RF001",
+            "annotation": "note",
+            "pageNumber": 3,
+        },
+    }
+
+    def save():
+        response = ctx.client.post("/notion/save-text-with-identifier", json=payload)
+        assert response.status_code == 200, response.data
+
+    return {"notion_save_text_with_identifier": ctx.measure(save, repeat=ctx.args.slow_repeat, number=1)}
+
+
+BENCHMARKS: Dict[str, Callable[[Context], Dict[str, Any]]] = {
+    "cold_start": bench_cold_start,
+    "safe_filename": bench_safe_filename,
+    "generate_next_identifier": bench_generate_next_identifier,
+    "config": bench_config,
+    "document_state": bench_document_state,
+    "list_files": bench_list_files,
+    "pdf_to_markdown": bench_pdf_to_markdown,
+    "translate": bench_translate,
+    "translation_memory": bench_translation_memory,
+    "notion_save": bench_notion_save,
+}
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the backend microbenchmarks")
+    parser.add_argument("--only", action="append", default=[], help="Run only benchmarks whose name contains this")
+    parser.add_argument("--quick", action="store_true", help="Use small workspaces and corpus")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/backend-<commit>.json)")
+    parser.add_argument("--repeat", type=int, default=15)
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0)
+    parser.add_argument("--import-budget-ms", type=float, default=500.0,
+                        help="Fail when process start to first /files response exceeds this median")
+    args = parser.parse_args(argv)
+    args.workspace_sizes = [1000] if args.quick else [10000, 100000]
+    args.pdf_pages = [1, 10] if args.quick else [1, 10, 50, 200]
+    args.slow_repeat = 3 if args.quick else 5
+    return args
+
+
+def prepare_environment(workdir: str, servers: Dict[str, stubs.StubServer]) -> None:
+    """Point the backend at temporary storage and the local stubs before it is imported"""
+    os.environ.update(stubs.stub_environment(servers))
+    os.environ["WORKSPACE_PATH"] = os.path.join(workdir, "workspace")
+    os.environ["CONFIG_FILE_PATH"] = os.path.join(workdir, "data", "config.json")
+    os.environ["PROFILE_DIR"] = os.path.join(workdir, "data", "profiles")
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+
+
+def main(argv: List[str] = None) -> int:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    workdir = tempfile.mkdtemp(prefix="notypdf-bench-")
+    servers = stubs.start_all(stubs.StubConfig(latency_ms=args.stub_latency_ms))
+    try:
+        prepare_environment(workdir, servers)
+        ctx = Context(args, workdir)
+        ctx.backend = importlib.import_module("app")
+        logging.getLogger().setLevel(logging.WARNING)
+        ctx.client = ctx.backend.app.test_client()
+
+        results: Dict[str, Any] = {}
+        for name, bench in BENCHMARKS.items():
+            if args.only and not any(pattern in name for pattern in args.only):
+                continue
+            print(f"Running {name}...", flush=True)
+            for key, stats in bench(ctx).items():
+                results[key] = stats
+                print(f"  {key:48s} median {stats['median_ms']:>12.4f} ms  p95 {stats['p95_ms']:>12.4f} ms", flush=True)
+
+        output = harness.write_results("backend", results, args.output)
+        print(f"Results written to {output}")
+
+        over_budget = [key for key, stats in results.items() if "budget_ms" in stats and stats["median_ms"] > stats["budget_ms"]]
+        for key in over_budget:
+            print(f"{key} exceeds its budget: median {results[key]['median_ms']:.1f} ms > {results[key]['budget_ms']:.0f} ms")
+        return 1 if over_budget else 0
+    finally:
+        for server in servers.values():
+            server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+"""Minimal S3-compatible server for trying out the s3 storage backend locally.
+
+Run ``python -m benchmarks.s3_stub --port 9000`` from the backend directory and
+start the backend with ``STORAGE_BACKEND=s3 S3_ENDPOINT_URL=http://127.0.0.1:9000
+S3_BUCKET=notypdf``. It serves path-style requests for the calls the storage
+layer makes: PUT, GET with Range, HEAD and DELETE of objects, CopyObject,
+ListObjectsV2 with a delimiter, and multipart uploads. Signatures are not
+checked and every bucket exists; objects live in memory.
+"""
+import re
+import time
+import uuid
+import hashlib
+import argparse
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+from xml.sax.saxutils import escape
+
+_NS = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+
+class StubObject:
+    __slots__ = ("data", "mtime", "etag")
+
+    def __init__(self, data: bytes, etag: str = ""):
+        self.data = data
+        self.mtime = time.time()
+        self.etag = etag or hashlib.md5(data).hexdigest()
+
+
+class StubBucketStore:
+    """Objects and in-progress multipart uploads of every bucket"""
+
+    def __init__(self):
+        self.objects: Dict[Tuple[str, str], StubObject] = {}
+        self.uploads: Dict[str, Dict[int, bytes]] = {}
+        self.lock = threading.Lock()
+        self.requests: Dict[str, int] = {}
+
+    def count(self, operation: str) -> None:
+        with self.lock:
+            self.requests[operation] = self.requests.get(operation, 0) + 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    @property
+    def store(self) -> StubBucketStore:
+        return self.server.store
+
+    def _target(self) -> Tuple[str, str, Dict[str, List[str]]]:
+        url = urlparse(self.path)
+        bucket, _, key = url.path.lstrip("/").partition("/")
+        return unquote(bucket), unquote(key), parse_qs(url.query, keep_blank_values=True)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _send(self, status: int, body: bytes = b"", headers: Dict[str, str] = None) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if "Content-Length" not in (headers or {}):
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _xml(self, body: str, status: int = 200) -> None:
+        self._send(status, f'<?xml version="1.0" encoding="UTF-8"?>{body}'.encode("utf-8"), {"Content-Type": "application/xml"})
+
+    def _not_found(self) -> None:
+        self._xml("<Error><Code>NoSuchKey</Code><Message>The specified key does not exist.</Message></Error>", 404)
+
+    def do_PUT(self) -> None:
+        bucket, key, query = self._target()
+        body = self._body()
+        if "uploadId" in query:
+            self.store.count("upload_part")
+            upload_id, number = query["uploadId"][0], int(query["partNumber"][0])
+            with self.store.lock:
+                parts = self.store.uploads.get(upload_id)
+                if parts is None:
+                    return self._not_found()
+                parts[number] = body
+            return self._send(200, headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+        source = self.headers.get("x-amz-copy-source")
+        if source:
+            self.store.count("copy")
+            src_bucket, _, src_key = unquote(source).lstrip("/").partition("/")
+            with self.store.lock:
+                original = self.store.objects.get((src_bucket, src_key))
+                if original is None:
+                    return self._not_found()
+                copy = self.store.objects[(bucket, key)] = StubObject(original.data, original.etag)
+            return self._xml(f'<CopyObjectResult xmlns="{_NS}"><ETag>"{copy.etag}"</ETag></CopyObjectResult>')
+        self.store.count("put")
+        with self.store.lock:
+            obj = self.store.objects[(bucket, key)] = StubObject(body)
+        self._send(200, headers={"ETag": f'"{obj.etag}"'})
+
+    def do_POST(self) -> None:
+        bucket, key, query = self._target()
+        body = self._body()
+        if "uploads" in query:
+            self.store.count("create_multipart")
+            upload_id = uuid.uuid4().hex
+            with self.store.lock:
+                self.store.uploads[upload_id] = {}
+            return self._xml(
+                f'<InitiateMultipartUploadResult xmlns="{_NS}"><Bucket>{escape(bucket)}</Bucket>'
+                f"<Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+            )
+        if "uploadId" in query:
+            self.store.count("complete_multipart")
+            numbers = [int(n) for n in re.findall(rb"<PartNumber>(\d+)</PartNumber>", body)]
+            with self.store.lock:
+                parts = self.store.uploads.pop(query["uploadId"][0], None)
+                if parts is None or any(n not in parts for n in numbers):
+                    return self._xml("<Error><Code>InvalidPart</Code></Error>", 400)
+                digest = hashlib.md5(b"".join(hashlib.md5(parts[n]).digest() for n in numbers)).hexdigest()
+                obj = self.store.objects[(bucket, key)] = StubObject(b"".join(parts[n] for n in numbers), f"{digest}-{len(numbers)}")
+            return self._xml(
+                f'<CompleteMultipartUploadResult xmlns="{_NS}"><Key>{escape(key)}</Key>'
+                f'<ETag>"{obj.etag}"</ETag></CompleteMultipartUploadResult>'
+            )
+        self._send(400)
+
+    def do_DELETE(self) -> None:
+        bucket, key, query = self._target()
+        self.store.count("delete")
+        with self.store.lock:
+            if "uploadId" in query:
+                self.store.uploads.pop(query["uploadId"][0], None)
+            else:
+                self.store.objects.pop((bucket, key), None)
+        self._send(204)
+
+    def do_HEAD(self) -> None:
+        self.do_GET()
+
+    def do_GET(self) -> None:
+        bucket, key, query = self._target()
+        if not key:
+            return self._list(bucket, query)
+        self.store.count(self.command.lower())
+        with self.store.lock:
+            obj = self.store.objects.get((bucket, key))
+        if obj is None:
+            return self._not_found()
+        headers = {
+            "ETag": f'"{obj.etag}"',
+            "Last-Modified": formatdate(obj.mtime, usegmt=True),
+            "Accept-Ranges": "bytes",
+            "Content-Type": "application/octet-stream",
+        }
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range") or "")
+        if match and self.command == "GET":
+            size = len(obj.data)
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start, end = max(0, size - int(match.group(2))), size - 1
+            if start >= size:
+                return self._send(416, headers={"Content-Range": f"bytes */{size}"})
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            return self._send(206, obj.data[start:end + 1], headers)
+        headers["Content-Length"] = str(len(obj.data))
+        self._send(200, obj.data, headers)
+
+    def _list(self, bucket: str, query: Dict[str, List[str]]) -> None:
+        self.store.count("list")
+        prefix = query.get("prefix", [""])[0]
+        delimiter = query.get("delimiter", [""])[0]
+        limit = int(query.get("max-keys", ["1000"])[0])
+        after = query.get("continuation-token", [""])[0]
+        with self.store.lock:
+            keys = sorted((key, obj) for (name, key), obj in self.store.objects.items() if name == bucket and key.startswith(prefix))
+        contents, prefixes = [], []
+        for key, obj in keys:
+            if after and key <= after:
+                continue
+            rest = key[len(prefix):]
+            if delimiter and delimiter in rest:
+                common = prefix + rest.split(delimiter, 1)[0] + delimiter
+                if common not in prefixes:
+                    prefixes.append(common)
+            else:
+                contents.append((key, obj))
+        items = [("c", key, obj) for key, obj in contents] + [("p", key, None) for key in prefixes]
+        items.sort(key=lambda item: item[1])
+        page, rest = items[:limit], items[limit:]
+        body = [f'<ListBucketResult xmlns="{_NS}"><Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix>']
+        body.append(f"<KeyCount>{len(page)}</KeyCount><IsTruncated>{'true' if rest else 'false'}</IsTruncated>")
+        if rest:
+            body.append(f"<NextContinuationToken>{escape(page[-1][1])}</NextContinuationToken>")
+        for kind, key, obj in page:
+            if kind == "c":
+                modified = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(obj.mtime))
+                body.append(
+                    f"<Contents><Key>{escape(key)}</Key><LastModified>{modified}</LastModified>"
+                    f'<ETag>"{obj.etag}"</ETag><Size>{len(obj.data)}</Size></Contents>'
+                )
+            else:
+                body.append(f"<CommonPrefixes><Prefix>{escape(key)}</Prefix></CommonPrefixes>")
+        body.append("</ListBucketResult>")
+        self._xml("".join(body))
+
+
+class StubS3Server(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: Tuple[str, int] = ("127.0.0.1", 0)):
+        super().__init__(address, _Handler)
+        self.store = StubBucketStore()
+        threading.Thread(target=self.serve_forever, name="s3-stub", daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    args = parser.parse_args()
+    server = StubS3Server((args.host, args.port))
+    print(f"S3_ENDPOINT_URL={server.url}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""Local stand-ins for the LLM providers and Notion used by benchmarks and load tests.
+
+Run ``python -m benchmarks.stubs`` from the backend directory to start every stub
+on consecutive ports and print the environment variables that point the backend
+at them.
+"""
+import re
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+PROVIDERS = ("openai", "openrouter", "gemini", "deepseek", "notion")
+
+# Environment variable used by the backend to reach each provider
+BASE_URL_ENV = {
+    "openai": ("OPENAI_BASE_URL", "/v1"),
+    "openrouter": ("OPENROUTER_BASE_URL", "/api/v1"),
+    "gemini": ("GEMINI_BASE_URL", "/v1beta"),
+    "deepseek": ("DEEPSEEK_BASE_URL", ""),
+    "notion": ("NOTION_BASE_URL", ""),
+}
+
+# Schema of the database served by the Notion stub
+NOTION_SCHEMA = {
+    "ID": {"id": "id", "name": "ID", "type": "title", "title": {}},
+    "Text": {"id": "text", "name": "Text", "type": "rich_text", "rich_text": {}},
+    "Annotation": {"id": "annotation", "name": "Annotation", "type": "rich_text", "rich_text": {}},
+    "Page": {"id": "page", "name": "Page", "type": "rich_text", "rich_text": {}},
+    "Document": {"id": "document", "name": "Document", "type": "multi_select", "multi_select": {"options": []}},
+}
+
+
+class StubConfig:
+    """Latency and failure behaviour of a stub server"""
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, rpm: int = 0, retry_after: float = 1.0, seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rpm = rpm
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+
+
+class _RateCeiling:
+    """Sliding one-minute window enforcing a requests-per-minute ceiling"""
+
+    def __init__(self, rpm: int):
+        self.rpm = rpm
+        self._times: List[float] = []
+        self._lock = threading.Lock()
+
+    def admit(self) -> Tuple[bool, float]:
+        now = time.monotonic()
+        with self._lock:
+            self._times = [t for t in self._times if now - t < 60.0]
+            if len(self._times) >= self.rpm:
+                return False, 60.0 - (now - self._times[0])
+            self._times.append(now)
+            return True, 0.0
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, provider: str, config: StubConfig, address: Tuple[str, int]):
+        super().__init__(address, _StubHandler)
+        self.provider = provider
+        self.config = config
+        self.ceiling = _RateCeiling(config.rpm) if config.rpm else None
+        self.stats = {"requests": 0, "errors": 0, "rate_limited": 0}
+        self.stats_lock = threading.Lock()
+        self.pages: Dict[str, List[Dict[str, Any]]] = {}
+        self.pages_lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{BASE_URL_ENV[self.provider][1]}"
+
+    def count(self, key: str) -> None:
+        with self.stats_lock:
+            self.stats[key] += 1
+
+
+_BATCH_MARKER_RE = re.compile(r"^<<<(\d+)>>>$", re.MULTILINE)
+
+
+def _completion_text(prompt: str) -> str:
+    # Multi-segment prompts from the micro-batcher are answered segment by segment
+    pieces = _BATCH_MARKER_RE.split(prompt)
+    if len(pieces) > 1:
+        return "\n".join(
+            f"<<<{pieces[i]}>>>\n[stub translation] {pieces[i + 1].strip()}" for i in range(1, len(pieces), 2)
+        )
+    return f"[stub translation] {prompt.strip()}"
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    server: StubServer
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return {}
+
+    def _simulate(self) -> bool:
+        """Apply latency and injected failures; return False if a failure was sent"""
+        server = self.server
+        config = server.config
+        server.count("requests")
+        if server.ceiling is not None:
+            admitted, wait = server.ceiling.admit()
+            if not admitted:
+                server.count("rate_limited")
+                self._send_json(429, {"error": {"message": "Rate limit exceeded"}}, {"Retry-After": f"{max(wait, 0.001):.3f}"})
+                return False
+        if config.rate_limit_rate and config.random.random() < config.rate_limit_rate:
+            server.count("rate_limited")
+            self._send_json(429, {"error": {"message": "Rate limit exceeded"}}, {"Retry-After": str(config.retry_after)})
+            return False
+        delay = config.latency_ms + (config.random.uniform(-config.jitter_ms, config.jitter_ms) if config.jitter_ms else 0.0)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        if config.error_rate and config.random.random() < config.error_rate:
+            server.count("errors")
+            self._send_json(500, {"error": {"message": "Injected upstream failure"}})
+            return False
+        return True
+
+    def do_GET(self) -> None:
+        self._dispatch("GET")
+
+    def do_POST(self) -> None:
+        self._dispatch("POST")
+
+    def do_PATCH(self) -> None:
+        self._dispatch("PATCH")
+
+    def _dispatch(self, method: str) -> None:
+        body = self._read_json() if method != "GET" else {}
+        path = self.path.split("?", 1)[0]
+        if path == "/_stats":
+            self._send_json(200, dict(self.server.stats))
+            return
+        if not self._simulate():
+            return
+        provider = self.server.provider
+        if provider == "notion":
+            self._notion(method, path, body)
+        elif provider == "gemini":
+            self._gemini(path, body)
+        else:
+            self._chat_completion(path, body)
+
+    def _chat_completion(self, path: str, body: Dict[str, Any]) -> None:
+        if not path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {path}"}})
+            return
+        messages = body.get("messages") or []
+        prompt = messages[-1].get("content", "") if messages else ""
+        text = _completion_text(prompt)
+        prompt_tokens = sum(_estimate_tokens(m.get("content", "")) for m in messages)
+        self._send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": _estimate_tokens(text),
+                "total_tokens": prompt_tokens + _estimate_tokens(text),
+            },
+        })
+
+    def _gemini(self, path: str, body: Dict[str, Any]) -> None:
+        if not re.match(r"^/v1beta/models/[^/]+:generateContent$", path):
+            self._send_json(404, {"error": {"message": f"Unknown path {path}"}})
+            return
+        contents = body.get("contents") or []
+        parts = contents[-1].get("parts", []) if contents else []
+        prompt = parts[0].get("text", "") if parts else ""
+        text = _completion_text(prompt)
+        self._send_json(200, {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+            "usageMetadata": {
+                "promptTokenCount": _estimate_tokens(prompt),
+                "candidatesTokenCount": _estimate_tokens(text),
+            },
+        })
+
+    def _notion(self, method: str, path: str, body: Dict[str, Any]) -> None:
+        server = self.server
+        match = re.match(r"^/v1/databases/([^/]+)(/query)?$", path)
+        if match:
+            database_id = match.group(1)
+            if match.group(2) and method == "POST":
+                with server.pages_lock:
+                    pages = list(server.pages.get(database_id, []))
+                start = int(body.get("start_cursor") or 0)
+                size = int(body.get("page_size") or 100)
+                chunk = pages[start:start + size]
+                more = start + size < len(pages)
+                self._send_json(200, {
+                    "object": "list",
+                    "results": chunk,
+                    "has_more": more,
+                    "next_cursor": str(start + size) if more else None,
+                })
+            else:
+                self._send_json(200, {"object": "database", "id": database_id, "title": [], "properties": NOTION_SCHEMA})
+            return
+        if path == "/v1/pages" and method == "POST":
+            database_id = (body.get("parent") or {}).get("database_id", "default")
+            page = {
+                "object": "page",
+                "id": str(uuid.uuid4()),
+                "created_time": datetime.utcnow().isoformat() + "Z",
+                "parent": {"type": "database_id", "database_id": database_id},
+                "properties": _expand_properties(body.get("properties") or {}),
+            }
+            with server.pages_lock:
+                server.pages.setdefault(database_id, []).append(page)
+            self._send_json(200, page)
+            return
+        match = re.match(r"^/v1/pages/([^/]+)$", path)
+        if match and method == "PATCH":
+            page_id = match.group(1)
+            with server.pages_lock:
+                for pages in server.pages.values():
+                    for page in pages:
+                        if page["id"] == page_id:
+                            page["properties"].update(_expand_properties(body.get("properties") or {}))
+                            self._send_json(200, page)
+                            return
+            self._send_json(404, {"object": "error", "status": 404, "code": "object_not_found", "message": "Page not found"})
+            return
+        if path == "/v1/users" and method == "GET":
+            self._send_json(200, {"object": "list", "results": [{"object": "user", "id": "stub-user", "type": "bot"}], "has_more": False})
+            return
+        self._send_json(404, {"object": "error", "status": 404, "code": "invalid_request_url", "message": f"Unknown path {path}"})
+
+
+def _expand_properties(properties: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn create/update property payloads into the shape Notion returns"""
+    expanded = {}
+    for name, value in properties.items():
+        schema = NOTION_SCHEMA.get(name, {"type": next(iter(value), "rich_text")})
+        prop_type = schema["type"]
+        if prop_type in ("title", "rich_text"):
+            items = value.get(prop_type, [])
+            expanded[name] = {
+                "type": prop_type,
+                prop_type: [{"type": "text", "text": item.get("text", {}), "plain_text": item.get("text", {}).get("content", "")} for item in items],
+            }
+        else:
+            expanded[name] = dict(value, type=prop_type)
+    return expanded
+
+
+def start_stub(provider: str, config: Optional[StubConfig] = None, host: str = "127.0.0.1", port: int = 0) -> StubServer:
+    """Start a stub server for one provider in a background thread"""
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unsupported provider: {provider}")
+    server = StubServer(provider, config or StubConfig(), (host, port))
+    thread = threading.Thread(target=server.serve_forever, name=f"stub-{provider}", daemon=True)
+    thread.start()
+    return server
+
+
+def start_all(config: Optional[StubConfig] = None, host: str = "127.0.0.1", base_port: int = 0) -> Dict[str, StubServer]:
+    """Start one stub per provider, on consecutive ports when base_port is given"""
+    servers = {}
+    for offset, provider in enumerate(PROVIDERS):
+        servers[provider] = start_stub(provider, config, host, base_port + offset if base_port else 0)
+    return servers
+
+
+def stub_environment(servers: Dict[str, StubServer]) -> Dict[str, str]:
+    """Environment variables pointing the backend at the given stubs"""
+    env = {BASE_URL_ENV[provider][0]: server.base_url for provider, server in servers.items()}
+    for key in ("NOTION_API_KEY", "OPENAI_API_KEY", "OPENROUTER_API_KEY", "GEMINI_API_KEY", "DEEPSEEK_API_KEY"):
+        env[key] = "stub-key"
+    return env
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run local stand-ins for the LLM providers and Notion")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--base-port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute before answering 429")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    args = parser.parse_args()
+
+    config = StubConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit_rate, args.rpm, args.retry_after)
+    servers = start_all(config, args.host, args.base_port)
+    for key, value in stub_environment(servers).items():
+        print(f"export {key}={value}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        for server in servers.values():
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
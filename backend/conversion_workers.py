@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import time
+import select
+import signal
+import atexit
+import logging
+import threading
+import subprocess
+from typing import Any, Dict, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Run conversions in worker processes instead of the web process
+ISOLATION_ENABLED = os.environ.get("CONVERSION_ISOLATION", "true").lower() in ("1", "true", "yes")
+
+# Worker processes, and jobs each one runs before it is replaced
+WORKERS = int(os.environ.get("CONVERSION_WORKERS", "2"))
+MAX_JOBS_PER_WORKER = int(os.environ.get("CONVERSION_MAX_JOBS_PER_WORKER", "50"))
+
+# Per-job limits: wall-clock seconds, CPU seconds, and memory on top of a worker's idle footprint
+TIMEOUT_SECONDS = float(os.environ.get("CONVERSION_TIMEOUT", "300"))
+CPU_LIMIT_SECONDS = int(os.environ.get("CONVERSION_CPU_LIMIT", "300"))
+MEMORY_LIMIT_MB = int(os.environ.get("CONVERSION_MEMORY_LIMIT_MB", "2048"))
+
+CONVERSION_WORKER_FAILURES = metrics.registry.counter(
+    "notypdf_conversion_worker_failures_total",
+    "Isolated conversions that failed, by kind of failure",
+    ["kind"],
+)
+CONVERSION_WORKERS_STARTED = metrics.registry.counter(
+    "notypdf_conversion_workers_started_total",
+    "Conversion worker processes started, including replacements",
+)
+
+
+class ConversionError(Exception):
+    """A conversion that did not produce output, with the kind of failure.
+
+    Kinds: "failed" (the converter raised), "timeout", "cpu_limit", "memory"
+    and "crashed" (the worker died).
+    """
+
+    STATUS_CODES = {"failed": 422, "memory": 422, "cpu_limit": 422, "timeout": 504, "crashed": 500}
+
+    def __init__(self, kind: str, message: str, **details: Any):
+        super().__init__(message)
+        self.kind = kind
+        self.details = details
+
+    @property
+    def status_code(self) -> int:
+        return self.STATUS_CODES.get(self.kind, 500)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"kind": self.kind, "message": str(self), **self.details}
+
+
+def _vm_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def _limit_memory(budget_mb: int) -> None:
+    import resource
+    if budget_mb <= 0:
+        return
+    # The converter's libraries reserve a lot of address space up front, so the cap sits on top of it
+    limit = _vm_bytes() + budget_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _limit_cpu(seconds: int) -> None:
+    import resource
+    if seconds <= 0:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = int(usage.ru_utime + usage.ru_stime)
+    # Only the soft limit moves, so it can be raised again for the next job
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    resource.setrlimit(resource.RLIMIT_CPU, (used + seconds, hard))
+
+
+def _worker_main() -> None:
+    """Entry point of a worker process: convert the jobs read from stdin, one JSON line each"""
+    # Keep stdout for replies only; anything the libraries print goes to stderr
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), "w", buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    from markitdown import MarkItDown
+    import artifacts
+
+    converter = MarkItDown()
+    _limit_memory(MEMORY_LIMIT_MB)
+    for line in sys.stdin:
+        job = json.loads(line)
+        _limit_cpu(CPU_LIMIT_SECONDS)
+        try:
+            result = converter.convert(job["pdf_path"])
+            artifacts.write_text(job["md_path"], result.text_content)
+            reply = {"ok": True, "chars": len(result.text_content)}
+        except MemoryError:
+            reply = {"ok": False, "kind": "memory", "message": f"Conversion exceeded the {MEMORY_LIMIT_MB} MB memory limit"}
+        except Exception as e:
+            reply = {"ok": False, "kind": "failed", "message": f"{type(e).__name__}: {str(e)}"}
+        replies.write(json.dumps(reply) + "\n")
+
+
+class _Worker:
+    def __init__(self):
+        # A fresh interpreter rather than a fork, so no state or threads of the web process leak in
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        self.jobs = 0
+        CONVERSION_WORKERS_STARTED.labels().inc()
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def run(self, job: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        self.jobs += 1
+        try:
+            self.process.stdin.write(json.dumps(job).encode("utf-8") + b"\n")
+            self.process.stdin.flush()
+            ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+            if not ready:
+                raise ConversionError("timeout", f"Conversion did not finish within {timeout:g} seconds", timeout_seconds=timeout)
+            line = self.process.stdout.readline()
+        except (BrokenPipeError, OSError):
+            line = b""
+        if line:
+            return json.loads(line)
+
+        exitcode = self.process.wait(5)
+        if exitcode == -signal.SIGXCPU:
+            raise ConversionError("cpu_limit", f"Conversion exceeded the {CPU_LIMIT_SECONDS} second CPU limit")
+        raise ConversionError("crashed", "Conversion worker exited unexpectedly", exitcode=exitcode)
+
+    def stop(self) -> None:
+        try:
+            self.process.stdin.close()
+            self.process.wait(1)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        self.kill()
+
+    def kill(self) -> None:
+        if self.alive():
+            self.process.kill()
+            self.process.wait(5)
+        for stream in (self.process.stdin, self.process.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+
+class ConversionPool:
+    """Fixed-size pool of conversion processes, each running one job at a time.
+
+    A job that times out kills its worker; a worker that crashed, hit its
+    memory limit or ran MAX_JOBS_PER_WORKER jobs is replaced by a fresh one.
+    """
+
+    def __init__(self, size: int = WORKERS):
+        self.size = max(1, size)
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle: List[_Worker] = []
+        self._lock = threading.Lock()
+        atexit.register(self.shutdown)
+
+    def _checkout(self) -> _Worker:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive():
+                    return worker
+                worker.kill()
+        return _Worker()
+
+    def _checkin(self, worker: _Worker) -> None:
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(worker)
+                return
+        worker.stop()
+
+    def warm(self) -> None:
+        """Start every worker ahead of the first conversion"""
+        with self._lock:
+            missing = self.size - len(self._idle)
+        workers = [_Worker() for _ in range(missing)]
+        for worker in workers:
+            self._checkin(worker)
+
+    def convert(self, pdf_path: str, md_path: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Convert pdf_path into the Markdown artifact md_path in a worker, raising ConversionError on failure"""
+        timeout = timeout or TIMEOUT_SECONDS
+        with self._slots:
+            worker = self._checkout()
+            start = time.perf_counter()
+            try:
+                reply = worker.run({"pdf_path": pdf_path, "md_path": md_path}, timeout)
+            except ConversionError as e:
+                worker.kill()
+                CONVERSION_WORKER_FAILURES.labels(e.kind).inc()
+                logger.error(f"Conversion of {pdf_path} failed ({e.kind}): {str(e)}")
+                raise
+            except BaseException:
+                worker.kill()
+                raise
+
+            # A worker that ran out of memory or its job quota is recycled to release whatever it leaked
+            healthy = reply.get("ok") or reply.get("kind") == "failed"
+            if healthy and worker.jobs < MAX_JOBS_PER_WORKER:
+                self._checkin(worker)
+            else:
+                worker.stop()
+
+            if not reply.get("ok"):
+                CONVERSION_WORKER_FAILURES.labels(reply["kind"]).inc()
+                logger.error(f"Conversion of {pdf_path} failed ({reply['kind']}): {reply['message']}")
+                raise ConversionError(reply["kind"], reply["message"])
+            return {"chars": reply["chars"], "seconds": round(time.perf_counter() - start, 3)}
+
+    def shutdown(self) -> None:
+        with self._lock:
+            workers, self._idle = self._idle, []
+        for worker in workers:
+            worker.stop()
+
+
+# Global pool instance
+conversion_pool = ConversionPool()
+
+
+if __name__ == "__main__":
+    _worker_main()
@@ -0,0 +1,146 @@
+import os
+import re
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterator, Tuple
+
+import shared_state
+
+logger = logging.getLogger(__name__)
+
+# Where bookmarks and other per-document state are stored, one JSON file per content hash
+STATE_DIR = os.environ.get(
+    "DOCUMENT_STATE_DIR",
+    os.path.join(os.path.dirname(os.environ.get("CONFIG_FILE_PATH", "/app/data/config.json")), "documents"),
+)
+
+# Largest state accepted for one document
+MAX_STATE_BYTES = int(os.environ.get("DOCUMENT_STATE_MAX_BYTES", str(256 * 1024)))
+
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _store_path(digest: str) -> str:
+    if not _HASH_RE.match(digest or ""):
+        raise ValueError("Invalid document hash")
+    return os.path.join(STATE_DIR, f"{digest}.json")
+
+
+def _read(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable document state {os.path.basename(path)}: {str(e)}")
+        return {}
+    return state if isinstance(state, dict) else {}
+
+
+def _write(path: str, state: Dict[str, Any]) -> None:
+    os.makedirs(STATE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.partial"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _validate(state: Dict[str, Any]) -> None:
+    bookmark = state.get("bookmark")
+    if bookmark is not None and (isinstance(bookmark, bool) or not isinstance(bookmark, int) or bookmark < 1):
+        raise ValueError("bookmark must be a page number")
+    if len(json.dumps(state)) > MAX_STATE_BYTES:
+        raise ValueError(f"Document state is limited to {MAX_STATE_BYTES} bytes")
+
+
+def get(digest: str) -> Dict[str, Any]:
+    """State of the document with this content hash, empty if nothing was stored"""
+    return _read(_store_path(digest))
+
+
+def patch(digest: str, changes: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge changes into a document's state; a null value removes the key.
+
+    Only this document's file is read and rewritten, so the cost does not
+    depend on how many documents have state.
+    """
+    if not isinstance(changes, dict):
+        raise ValueError("Changes must be a JSON object")
+    path = _store_path(digest)
+    with shared_state.file_lock(path):
+        state = _read(path)
+        state.pop("updated", None)
+        for key, value in changes.items():
+            if key == "updated":
+                continue
+            if value is None:
+                state.pop(key, None)
+            else:
+                state[key] = value
+        _validate(state)
+        if not state:
+            if os.path.exists(path):
+                os.remove(path)
+            return state
+        state["updated"] = datetime.now().isoformat()
+        _write(path, state)
+    return state
+
+
+def items() -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Content hash and state of every document with stored state"""
+    try:
+        names = sorted(os.listdir(STATE_DIR))
+    except FileNotFoundError:
+        return
+    for name in names:
+        digest, ext = os.path.splitext(name)
+        if ext == ".json" and _HASH_RE.match(digest):
+            state = _read(os.path.join(STATE_DIR, name))
+            if state:
+                yield digest, state
+
+
+def export() -> Dict[str, Dict[str, Any]]:
+    """Every stored state, for configuration backups"""
+    return dict(items())
+
+
+def import_states(states: Dict[str, Any]) -> int:
+    """Store states from a backup, replacing those of the same documents; invalid ones are skipped"""
+    if not isinstance(states, dict):
+        raise ValueError("Document states must be a JSON object")
+    imported = 0
+    for digest, state in states.items():
+        if not isinstance(state, dict):
+            continue
+        state = dict(state)
+        try:
+            _validate(state)
+            path = _store_path(digest)
+        except ValueError as e:
+            logger.warning(f"Skipping the state of document {digest}: {str(e)}")
+            continue
+        with shared_state.file_lock(path):
+            _write(path, dict(state, updated=state.get("updated") or datetime.now().isoformat()))
+        imported += 1
+    return imported
+
+
+def clear() -> int:
+    """Remove the state of every document"""
+    removed = 0
+    for digest, _ in list(items()):
+        try:
+            os.remove(_store_path(digest))
+            removed += 1
+        except OSError:
+            pass
+    return removed
@@ -0,0 +1,271 @@
+import os
+import errno
+import shutil
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import artifacts
+import fingerprints
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS = ("move", "copy", "archive", "unarchive", "delete")
+
+# Threads executing the steps of one batch, and the largest batch accepted
+BATCH_WORKERS = int(os.environ.get("FILE_BATCH_WORKERS", "8"))
+MAX_BATCH_OPERATIONS = int(os.environ.get("FILE_BATCH_MAX_OPERATIONS", "10000"))
+
+# Deleted entries are parked here until an atomic batch commits
+TRASH_PREFIX = ".batch-trash-"
+
+
+class Step:
+    """One planned operation with every path it touches, sidecars included"""
+
+    __slots__ = ("index", "op", "path", "src", "dst", "pairs", "error")
+
+    def __init__(self, index: int, op: str, path: str):
+        self.index = index
+        self.op = op
+        self.path = path
+        self.src: Optional[str] = None
+        self.dst: Optional[str] = None
+        self.pairs: List[Tuple[str, Optional[str]]] = []
+        self.error: Optional[str] = None
+
+    def event(self, status: str, error: Optional[str] = None) -> Dict[str, Any]:
+        event = {"index": self.index, "op": self.op, "path": self.path, "status": status}
+        if error:
+            event["error"] = error
+        return event
+
+
+def is_trash(name: str) -> bool:
+    return name.startswith(TRASH_PREFIX)
+
+
+def _sidecar_pairs(src: str, dst: Optional[str]) -> List[Tuple[str, Optional[str]]]:
+    """Markdown sidecars and translations of a PDF paired with where they go"""
+    if not src.lower().endswith(".pdf") or not os.path.isfile(src):
+        return []
+    src_base = os.path.splitext(src)[0]
+    pairs = []
+    for sidecar in artifacts.artifact_paths(src):
+        target = os.path.splitext(dst)[0] + sidecar[len(src_base):] if dst else None
+        pairs.append((sidecar, target))
+    return pairs
+
+
+def _overlaps(a: str, b: str) -> bool:
+    """Whether two paths are the same or one is inside the other"""
+    return a == b or a.startswith(b + os.sep) or b.startswith(a + os.sep)
+
+
+def plan(operations: List[Dict[str, Any]], workspace: str, archive: str, join: Callable[..., str]) -> List[Step]:
+    """Resolve and validate every operation before anything is touched.
+
+    Operations run in parallel, so one that touches a path inside a folder
+    another operation changes (deleting folder A and moving A/x.pdf) is
+    refused rather than left to whichever runs first.
+    """
+    steps = []
+    sources = set()
+    destinations = set()
+    # Absolute paths of planned operations and whether they are changed, as copies only read their source
+    claimed: List[Tuple[str, bool]] = []
+    for index, item in enumerate(operations):
+        item = item if isinstance(item, dict) else {}
+        op = item.get("op")
+        path = str(item.get("path") or "")
+        step = Step(index, op, path)
+        steps.append(step)
+        try:
+            if op not in OPERATIONS:
+                raise ValueError(f"Unsupported operation: {op}")
+            if not path:
+                raise ValueError("Missing path")
+
+            root = archive if op == "unarchive" or (op == "delete" and item.get("archived")) else workspace
+            step.src = join(root, path)
+            if os.path.abspath(step.src) in (os.path.abspath(workspace), os.path.abspath(archive)):
+                raise ValueError("Workspace and archive folders cannot be changed")
+            if not os.path.exists(step.src):
+                raise ValueError("File not found")
+
+            name = os.path.basename(item.get("name") or path)
+            if op in ("move", "copy", "unarchive"):
+                destination = item.get("destination") or ""
+                dest_dir = join(workspace, destination) if destination else workspace
+                if not os.path.isdir(dest_dir):
+                    raise ValueError("Destination folder not found")
+                step.dst = join(dest_dir, name)
+            elif op == "archive":
+                step.dst = join(archive, name)
+
+            if step.dst:
+                if os.path.exists(step.dst):
+                    raise ValueError("Destination already exists")
+                if os.path.abspath(step.dst).startswith(os.path.abspath(step.src) + os.sep):
+                    raise ValueError("A folder cannot be placed inside itself")
+                if step.dst in destinations:
+                    raise ValueError("Another operation in this batch targets the same destination")
+                destinations.add(step.dst)
+            if step.src in sources:
+                raise ValueError("Another operation in this batch uses the same file")
+            paths = [(os.path.abspath(step.src), op != "copy")] + ([(os.path.abspath(step.dst), True)] if step.dst else [])
+            if any(
+                (changed or other_changed) and _overlaps(path, other)
+                for path, changed in paths for other, other_changed in claimed
+            ):
+                raise ValueError("Another operation in this batch changes this path or a folder around or inside it")
+            claimed.extend(paths)
+            if op != "copy":
+                sources.add(step.src)
+            step.pairs = [(step.src, step.dst)] + _sidecar_pairs(step.src, step.dst)
+        except ValueError as e:
+            step.error = str(e)
+    return steps
+
+
+def _copy(src: str, dst: str) -> None:
+    """Copy a file or folder, publishing it under dst only once complete"""
+    tmp = f"{dst}.{uuid.uuid4().hex}.partial"
+    try:
+        if os.path.isdir(src):
+            shutil.copytree(src, tmp)
+        else:
+            shutil.copy2(src, tmp)
+        os.rename(tmp, dst)
+    finally:
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp, ignore_errors=True)
+        elif os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _remove(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def transfer(src: str, dst: str) -> None:
+    """Rename src to dst, copying and removing the source across filesystems"""
+    if os.path.exists(dst):
+        raise FileExistsError(f"Destination already exists: {os.path.basename(dst)}")
+    try:
+        os.rename(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        _copy(src, dst)
+        _remove(src)
+    fingerprints.moved(src, dst)
+
+
+def move_with_sidecars(src: str, dst: str) -> None:
+    """Move a file and its Markdown sidecars"""
+    for pair_src, pair_dst in [(src, dst)] + _sidecar_pairs(src, dst):
+        transfer(pair_src, pair_dst)
+
+
+class Batch:
+    """Executes planned steps in parallel, journaling each change so it can be undone"""
+
+    def __init__(self, steps: List[Step], workspace: str, atomic: bool = True):
+        self.steps = steps
+        self.atomic = atomic
+        self.trash = os.path.join(workspace, f"{TRASH_PREFIX}{uuid.uuid4().hex}") if atomic else None
+        self._journal: List[Tuple[str, str, str]] = []
+        self._lock = threading.Lock()
+        self._failed = threading.Event()
+        self._keep_trash = False
+
+    def _record(self, action: str, src: str, dst: str) -> None:
+        with self._lock:
+            self._journal.append((action, src, dst))
+
+    def _run_step(self, step: Step) -> None:
+        for src, dst in step.pairs:
+            if step.op == "copy":
+                _copy(src, dst)
+                self._record("copied", src, dst)
+            elif step.op == "delete":
+                if self.trash:
+                    os.makedirs(self.trash, exist_ok=True)
+                    parked = os.path.join(self.trash, uuid.uuid4().hex)
+                    transfer(src, parked)
+                    self._record("moved", src, parked)
+                else:
+                    _remove(src)
+            else:
+                transfer(src, dst)
+                self._record("moved", src, dst)
+
+    def _execute(self, step: Step) -> Dict[str, Any]:
+        if self.atomic and self._failed.is_set():
+            return step.event("skipped")
+        try:
+            self._run_step(step)
+            return step.event("done")
+        except Exception as e:
+            self._failed.set()
+            logger.error(f"Batch {step.op} of {step.path} failed: {str(e)}")
+            return step.event("error", str(e))
+
+    def _rollback(self) -> List[str]:
+        errors = []
+        for action, src, dst in reversed(self._journal):
+            try:
+                if action == "copied":
+                    _remove(dst)
+                else:
+                    transfer(dst, src)
+            except Exception as e:
+                errors.append(f"{os.path.basename(src)}: {str(e)}")
+                logger.error(f"Could not roll back {action} {src} -> {dst}: {str(e)}")
+        return errors
+
+    def _finish(self, counts: Dict[str, int]) -> Dict[str, Any]:
+        """Roll back a failed atomic batch, then empty the trash unless something could not be restored"""
+        summary: Dict[str, Any] = {"finished": True, "total": len(self.steps), **counts}
+        try:
+            if self.atomic and self._failed.is_set():
+                rollback_errors = self._rollback()
+                summary["rolled_back"] = True
+                if rollback_errors:
+                    # Entries that could not be restored stay in the trash folder for manual recovery
+                    self._keep_trash = True
+                    summary["rollback_errors"] = rollback_errors
+            summary["success"] = counts["error"] == 0
+        finally:
+            if self.trash and not self._keep_trash and os.path.isdir(self.trash):
+                shutil.rmtree(self.trash, ignore_errors=True)
+        return summary
+
+    def run(self) -> Iterator[Dict[str, Any]]:
+        """Yield one event per step as it finishes, then a summary.
+
+        The batch is settled even if the consumer stops early: leaving the
+        executor waits for the submitted steps, and a failed atomic batch is
+        still rolled back before the trash is removed.
+        """
+        counts = {"done": 0, "error": 0, "skipped": 0}
+        summary: Optional[Dict[str, Any]] = None
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, min(BATCH_WORKERS, len(self.steps)))) as executor:
+                futures = [executor.submit(self._execute, step) for step in self.steps]
+                for future in as_completed(futures):
+                    event = future.result()
+                    counts[event["status"]] += 1
+                    yield event
+            summary = self._finish(counts)
+        finally:
+            if summary is None:
+                logger.warning(f"Batch of {len(self.steps)} steps abandoned by its client; settling it anyway")
+                self._finish(counts)
+        yield summary
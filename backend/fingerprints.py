@@ -0,0 +1,113 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Files whose hash is remembered by (path, size, mtime) so unchanged files are not re-read
+INDEX_SIZE = int(os.environ.get("CONTENT_HASH_INDEX_SIZE", "100000"))
+
+# Where the index is saved, so the first full scan after a restart does not read every file again
+INDEX_PATH = os.environ.get(
+    "CONTENT_HASH_INDEX_PATH",
+    os.path.join(os.path.dirname(os.environ.get("CONFIG_FILE_PATH", "/app/data/config.json")), "fingerprints.json"),
+)
+
+_CHUNK_SIZE = 1024 * 1024
+
+_index: "OrderedDict[str, Tuple[int, int, str]]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def content_hash(path: str) -> str:
+    """SHA-256 of a file's content, memoised until its size or mtime changes"""
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    with _lock:
+        entry = _index.get(key)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            _index.move_to_end(key)
+            return entry[2]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    value = digest.hexdigest()
+
+    with _lock:
+        _index[key] = (stat.st_size, stat.st_mtime_ns, value)
+        _index.move_to_end(key)
+        while len(_index) > INDEX_SIZE:
+            _index.popitem(last=False)
+    return value
+
+
+def cached_hash(path: str, stat: Optional[os.stat_result] = None) -> str:
+    """Hash of the file if it is already known for its current size and mtime, else an empty string"""
+    if stat is None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return ""
+    with _lock:
+        entry = _index.get(os.path.abspath(path))
+    if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+        return entry[2]
+    return ""
+
+
+def moved(src: str, dst: str) -> None:
+    """Carry a known hash over to a file's new path after a rename"""
+    with _lock:
+        entry = _index.pop(os.path.abspath(src), None)
+        if entry is not None:
+            _index[os.path.abspath(dst)] = entry
+
+
+def load_index(path: str = INDEX_PATH) -> int:
+    """Add hashes saved by an earlier process, returning how many were added; entries known here win"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable content hash index: {str(e)}")
+        return 0
+    added = 0
+    with _lock:
+        # Newest first, each put in front of the last, so the saved order is kept behind entries used here
+        for entry in reversed(entries[-INDEX_SIZE:] if isinstance(entries, list) else []):
+            try:
+                key, size, mtime_ns, value = entry
+            except (TypeError, ValueError):
+                continue
+            if key not in _index:
+                _index[key] = (size, mtime_ns, value)
+                _index.move_to_end(key, last=False)
+                added += 1
+        while len(_index) > INDEX_SIZE:
+            _index.popitem(last=False)
+    return added
+
+
+def save_index(path: str = INDEX_PATH) -> None:
+    """Save the index, least recently used first; an entry stays valid only while size and mtime match"""
+    with _lock:
+        entries = [[key, size, mtime_ns, value] for key, (size, mtime_ns, value) in _index.items()]
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.partial"
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not save content hash index: {str(e)}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
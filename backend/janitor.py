@@ -0,0 +1,312 @@
+import os
+import re
+import json
+import time
+import shutil
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+
+import file_operations
+import fingerprints
+import metrics
+import pdf_metadata
+import pdf_optimize
+import shared_state
+from translation_memory import MEMORY_ENABLED, translation_memory
+
+logger = logging.getLogger(__name__)
+
+# Set to "false" to keep every derived file until its document is deleted
+JANITOR_ENABLED = os.environ.get("JANITOR_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Seconds between janitor runs; only the leader replica runs them
+INTERVAL_SECONDS = float(os.environ.get("JANITOR_INTERVAL_SECONDS", "3600"))
+
+# Files younger than this are never collected, so uploads, moves and writes in flight are left alone
+GRACE_SECONDS = float(os.environ.get("JANITOR_GRACE_SECONDS", str(6 * 3600)))
+
+# Disk quotas for regenerable artifacts, least recently used evicted first; 0 disables a quota
+MARKDOWN_QUOTA_BYTES = int(os.environ.get("JANITOR_MARKDOWN_QUOTA_BYTES", str(2 * 1024 ** 3)))
+CACHE_QUOTA_BYTES = int(os.environ.get("JANITOR_CACHE_QUOTA_BYTES", str(10 * 1024 ** 3)))
+
+# Report of the last run, readable by every replica
+REPORT_PATH = os.environ.get(
+    "JANITOR_REPORT_PATH",
+    os.path.join(os.path.dirname(os.environ.get("CONFIG_FILE_PATH", "/app/data/config.json")), "janitor.json"),
+)
+
+# Suffix of Markdown and translation sidecars, leaving the document's name without extension
+_ARTIFACT_SUFFIX_RE = re.compile(r"(\.translation\.[a-z0-9-]+)?\.md(\.gz|\.zst)?$", re.IGNORECASE)
+_HASH_FILE_RE = re.compile(r"^([0-9a-f]{64})\.(json|pdf|skip)$")
+
+RECLAIMED_BYTES = metrics.registry.counter(
+    "notypdf_janitor_reclaimed_bytes_total",
+    "Bytes freed by the janitor, by reason: orphan, stale or quota",
+    ["reason"],
+)
+REMOVED_FILES = metrics.registry.counter(
+    "notypdf_janitor_removed_files_total",
+    "Files removed by the janitor, by kind of artifact",
+    ["kind"],
+)
+ARTIFACT_BYTES = metrics.registry.gauge(
+    "notypdf_janitor_artifact_bytes",
+    "Bytes of derived files by kind, as of the last janitor run",
+    ["kind"],
+)
+
+
+class _Candidate:
+    __slots__ = ("path", "kind", "size", "used")
+
+    def __init__(self, path: str, kind: str, stat: os.stat_result):
+        self.path = path
+        self.kind = kind
+        self.size = stat.st_size
+        # Reads refresh atime where the filesystem records it; writes always refresh mtime
+        self.used = max(stat.st_atime, stat.st_mtime)
+
+
+class Janitor:
+    """Reconciles derived files with the documents that are still stored.
+
+    Markdown sidecars and translations whose document is gone, metadata and
+    optimised copies of content no document has any more, interrupted writes
+    and leftover batch trash are removed. Markdown sidecars, metadata and
+    optimised copies can all be regenerated, so when they outgrow their quota
+    the least recently used are evicted; translations are only removed as
+    orphans. The translation memory is pruned to its segment limit.
+    Per-document state (bookmarks) is user data and never touched.
+    """
+
+    def __init__(self):
+        self.storage: Any = None
+        self._lock = threading.Lock()
+
+    def configure(self, storage: Any) -> None:
+        self.storage = storage
+
+    def run(self, dry_run: bool = False) -> Optional[Dict[str, Any]]:
+        """Run once, returning the report, or None when a run is already going on any replica"""
+        run_lock = shared_state.lock("janitor", kind="janitor")
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            if not run_lock.acquire(blocking=False):
+                return None
+            try:
+                return self._run(dry_run)
+            finally:
+                run_lock.release()
+        finally:
+            self._lock.release()
+
+    def _run(self, dry_run: bool) -> Dict[str, Any]:
+        start = time.perf_counter()
+        self._now = time.time()
+        self._dry_run = dry_run
+        self._removed: Dict[str, Dict[str, int]] = {reason: {"files": 0, "bytes": 0} for reason in ("orphan", "stale", "quota")}
+        usage = {"markdown": 0, "translations": 0, "metadata": 0, "optimized": 0}
+
+        documents = list(self.storage.walk())
+        bases = {os.path.splitext(entry.key)[0].lower() for entry in documents}
+        markdown: List[_Candidate] = []
+        for candidate in self._scan_artifacts(self.storage.local_root, bases):
+            usage[candidate.kind] += candidate.size
+            if candidate.kind == "markdown":
+                markdown.append(candidate)
+
+        # Without local documents their hashes are unknown, so hash-keyed files are only held to their quota
+        hashes = self._document_hashes(documents) if self.storage.is_local else None
+        caches: List[_Candidate] = []
+        for kind, directory in (("metadata", pdf_metadata.METADATA_DIR), ("optimized", pdf_optimize.OPTIMIZED_DIR)):
+            for candidate in self._scan_hashed(directory, kind, hashes):
+                usage[kind] += candidate.size
+                caches.append(candidate)
+
+        memory_pruned = translation_memory.prune() if MEMORY_ENABLED and not dry_run else 0
+        try:
+            usage["translation_memory"] = os.path.getsize(translation_memory.path)
+        except OSError:
+            usage["translation_memory"] = 0
+
+        usage["markdown"] -= self._enforce_quota(markdown, MARKDOWN_QUOTA_BYTES)
+        evicted = self._enforce_quota(caches, CACHE_QUOTA_BYTES)
+        for candidate in caches:
+            if not os.path.exists(candidate.path):
+                usage[candidate.kind] -= candidate.size
+        for kind, size in usage.items():
+            ARTIFACT_BYTES.labels(kind).set(size)
+
+        report = {
+            "finished": datetime.now().isoformat(),
+            "seconds": round(time.perf_counter() - start, 3),
+            "dry_run": dry_run,
+            "documents": len(documents),
+            "removed": self._removed,
+            "reclaimed_bytes": sum(item["bytes"] for item in self._removed.values()),
+            "translation_memory_segments_pruned": memory_pruned,
+            "usage": usage,
+            "quotas": {"markdown": MARKDOWN_QUOTA_BYTES, "caches": CACHE_QUOTA_BYTES},
+        }
+        logger.info(
+            f"Janitor {'would reclaim' if dry_run else 'reclaimed'} {report['reclaimed_bytes']} bytes: "
+            f"{self._removed['orphan']['files']} orphaned, {self._removed['stale']['files']} stale, "
+            f"{self._removed['quota']['files']} evicted over quota ({evicted} bytes of caches)"
+        )
+        if not dry_run:
+            self._save_report(report)
+        return report
+
+    def _old(self, mtime: float) -> bool:
+        return self._now - mtime > GRACE_SECONDS
+
+    def _remove(self, path: str, kind: str, reason: str, size: int) -> None:
+        if not self._dry_run:
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except FileNotFoundError:
+                return
+            except OSError as e:
+                logger.warning(f"Janitor could not remove {path}: {str(e)}")
+                return
+            RECLAIMED_BYTES.labels(reason).inc(size)
+            REMOVED_FILES.labels(kind).inc()
+        self._removed[reason]["files"] += 1
+        self._removed[reason]["bytes"] += size
+
+    def _scan_artifacts(self, root: str, bases: Set[str]) -> List[_Candidate]:
+        """Sidecars still in use, after removing orphans, interrupted writes and old batch trash"""
+        kept = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            for name in list(dirnames):
+                if file_operations.is_trash(name):
+                    dirnames.remove(name)
+                    path = os.path.join(dirpath, name)
+                    try:
+                        stale = self._old(os.stat(path).st_mtime)
+                    except OSError:
+                        continue
+                    if stale:
+                        self._remove(path, "trash", "stale", _tree_size(path))
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if filename.endswith(".partial"):
+                    if self._old(stat.st_mtime):
+                        self._remove(path, "partial", "stale", stat.st_size)
+                    continue
+                match = _ARTIFACT_SUFFIX_RE.search(filename)
+                if not match:
+                    continue
+                kind = "translations" if match.group(1) else "markdown"
+                base = os.path.relpath(os.path.join(dirpath, filename[:match.start()]), root).replace(os.sep, "/")
+                if base.lower() not in bases:
+                    if self._old(stat.st_mtime):
+                        self._remove(path, kind, "orphan", stat.st_size)
+                        continue
+                kept.append(_Candidate(path, kind, stat))
+        return kept
+
+    def _document_hashes(self, documents: List[Any]) -> Set[str]:
+        """Content hashes of the stored PDFs, reading only files changed since they were last hashed"""
+        # Hashes known before a restart are kept on disk, so the first run after one does not read the whole workspace
+        fingerprints.load_index()
+        hashes = set()
+        hashed = 0
+        for entry in documents:
+            if not entry.key.lower().endswith(".pdf"):
+                continue
+            path = self.storage.local_path(entry.key)
+            try:
+                digest = fingerprints.cached_hash(path)
+                if not digest:
+                    digest = fingerprints.content_hash(path)
+                    hashed += 1
+            except OSError:
+                continue
+            hashes.add(digest)
+        if hashed:
+            fingerprints.save_index()
+        return hashes
+
+    def _scan_hashed(self, directory: str, kind: str, hashes: Optional[Set[str]]) -> List[_Candidate]:
+        """Files named by content hash, after removing those of content no document has"""
+        kept = []
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return kept
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if name.endswith(".partial"):
+                if self._old(stat.st_mtime):
+                    self._remove(path, "partial", "stale", stat.st_size)
+                continue
+            match = _HASH_FILE_RE.match(name)
+            if not match:
+                continue
+            if hashes is not None and match.group(1) not in hashes and self._old(stat.st_mtime):
+                self._remove(path, kind, "orphan", stat.st_size)
+                continue
+            kept.append(_Candidate(path, kind, stat))
+        return kept
+
+    def _enforce_quota(self, candidates: List[_Candidate], quota: int) -> int:
+        """Evict the least recently used candidates until they fit the quota, returning the bytes evicted"""
+        total = sum(candidate.size for candidate in candidates)
+        evicted = 0
+        if quota <= 0 or total <= quota:
+            return evicted
+        for candidate in sorted(candidates, key=lambda candidate: candidate.used):
+            if total - evicted <= quota:
+                break
+            self._remove(candidate.path, candidate.kind, "quota", candidate.size)
+            evicted += candidate.size
+        return evicted
+
+    def _save_report(self, report: Dict[str, Any]) -> None:
+        tmp_path = f"{REPORT_PATH}.{os.getpid()}-{threading.get_ident()}.partial"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            os.replace(tmp_path, REPORT_PATH)
+        except OSError as e:
+            logger.warning(f"Could not save janitor report: {str(e)}")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def last_report(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(REPORT_PATH, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+# Global janitor instance
+janitor = Janitor()
@@ -0,0 +1,373 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from flask import g, request
+
+# Latency buckets in seconds, tuned for a mix of sub-millisecond listings and
+# multi-second LLM and conversion calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Page count buckets used to label conversion durations
+PAGE_BUCKETS = ((10, "1-10"), (50, "11-50"), (200, "51-200"), (1000, "201-1000"))
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str, **kwargs: str):
+        """Return the child series for the given label values"""
+        if kwargs:
+            values = tuple(str(kwargs.get(name, "")) for name in self.labelnames)
+        else:
+            values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._new_child()
+                    self._children[values] = child
+        return child
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def get(self) -> float:
+        return self._value
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}"
+            for values, child in list(self._children.items())
+        ]
+
+
+class _GaugeChild(_CounterChild):
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = value
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}"
+            for values, child in list(self._children.items())
+        ]
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Sequence[float]):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self._counts), self._sum
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for values, child in list(self._children.items()):
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+# Global registry instance
+registry = Registry()
+
+HTTP_REQUEST_DURATION = registry.histogram(
+    "notypdf_http_request_duration_seconds",
+    "Latency of HTTP requests by Flask route",
+    ["method", "route", "status"],
+)
+HTTP_REQUESTS_IN_FLIGHT = registry.gauge(
+    "notypdf_http_requests_in_flight",
+    "HTTP requests currently being served",
+    ["route"],
+)
+HTTP_REQUEST_ERRORS = registry.counter(
+    "notypdf_http_request_errors_total",
+    "HTTP requests answered with a 5xx status",
+    ["method", "route", "status"],
+)
+UPSTREAM_REQUEST_DURATION = registry.histogram(
+    "notypdf_upstream_request_duration_seconds",
+    "Latency of calls to LLM providers and Notion",
+    ["provider", "model", "operation"],
+)
+UPSTREAM_REQUESTS_IN_FLIGHT = registry.gauge(
+    "notypdf_upstream_requests_in_flight",
+    "Upstream calls currently waiting for a response",
+    ["provider"],
+)
+UPSTREAM_ERRORS = registry.counter(
+    "notypdf_upstream_errors_total",
+    "Failed calls to LLM providers and Notion",
+    ["provider", "model", "operation"],
+)
+CONVERSION_DURATION = registry.histogram(
+    "notypdf_conversion_duration_seconds",
+    "Duration of document to markdown conversions by page count",
+    ["pages"],
+)
+CONVERSION_PAGES = registry.counter(
+    "notypdf_conversion_pages_total",
+    "Pages converted to markdown",
+)
+CONVERSION_ERRORS = registry.counter(
+    "notypdf_conversion_errors_total",
+    "Failed document to markdown conversions",
+)
+TRANSLATION_HEDGES = registry.counter(
+    "notypdf_translation_hedges_total",
+    "Hedged duplicate translation requests sent to a secondary route",
+    ["provider"],
+)
+TRANSLATION_FAILOVERS = registry.counter(
+    "notypdf_translation_failovers_total",
+    "Translation requests retried on a fallback route after a failure",
+    ["provider"],
+)
+CIRCUIT_OPEN = registry.gauge(
+    "notypdf_circuit_breaker_open",
+    "Whether a provider's circuit breaker is open (1) or closed (0)",
+    ["provider"],
+)
+PROVIDER_CONCURRENCY_LIMIT = registry.gauge(
+    "notypdf_provider_concurrency_limit",
+    "Current adaptive concurrency limit towards a translation provider",
+    ["provider"],
+)
+PROVIDER_RATE_LIMITED = registry.counter(
+    "notypdf_provider_rate_limited_total",
+    "Translation requests answered with 429 Too Many Requests",
+    ["provider"],
+)
+PROVIDER_QUEUE_WAIT = registry.histogram(
+    "notypdf_provider_queue_wait_seconds",
+    "Time translation requests waited for a provider slot or rate budget",
+    ["provider"],
+)
+SINGLEFLIGHT_COALESCED = registry.counter(
+    "notypdf_singleflight_coalesced_total",
+    "Calls that joined an identical computation already in flight",
+    ["operation"],
+)
+CACHE_REQUESTS = registry.counter(
+    "notypdf_cache_requests_total",
+    "Cache lookups by cache name and result",
+    ["cache", "result"],
+)
+
+
+def page_bucket(pages: Optional[int]) -> str:
+    """Map a page count to its conversion histogram label"""
+    if not pages:
+        return "unknown"
+    for limit, label in PAGE_BUCKETS:
+        if pages <= limit:
+            return label
+    return f"{PAGE_BUCKETS[-1][0] + 1}+"
+
+
+class _Outcome:
+    """Handle yielded by the tracking helpers so callers can flag soft failures"""
+
+    __slots__ = ("failed",)
+
+    def __init__(self):
+        self.failed = False
+
+    def fail(self) -> None:
+        self.failed = True
+
+
+@contextmanager
+def track_upstream(provider: str, model: str, operation: str):
+    """Time an upstream call and count it as an error if it raises or is flagged"""
+    in_flight = UPSTREAM_REQUESTS_IN_FLIGHT.labels(provider)
+    outcome = _Outcome()
+    in_flight.inc()
+    start = time.perf_counter()
+    try:
+        yield outcome
+    except Exception:
+        outcome.fail()
+        raise
+    finally:
+        UPSTREAM_REQUEST_DURATION.labels(provider, model or "", operation).observe(time.perf_counter() - start)
+        in_flight.dec()
+        if outcome.failed:
+            UPSTREAM_ERRORS.labels(provider, model or "", operation).inc()
+
+
+@contextmanager
+def track_conversion(pages: Optional[int]):
+    """Time a markdown conversion, labelled by the document's page count"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        CONVERSION_ERRORS.labels().inc()
+        raise
+    CONVERSION_DURATION.labels(page_bucket(pages)).observe(time.perf_counter() - start)
+    if pages:
+        CONVERSION_PAGES.labels().inc(pages)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def _route_label() -> str:
+    rule = request.url_rule
+    return rule.rule if rule is not None else "unmatched"
+
+
+def instrument_app(app) -> None:
+    """Register request hooks recording per-route latency and in-flight counts"""
+
+    @app.before_request
+    def _start_request_timer():
+        route = _route_label()
+        g._metrics_route = route
+        g._metrics_start = time.perf_counter()
+        HTTP_REQUESTS_IN_FLIGHT.labels(route).inc()
+
+    @app.after_request
+    def _observe_request(response):
+        start = g.pop("_metrics_start", None)
+        if start is not None:
+            route = g._metrics_route
+            status = str(response.status_code)
+            HTTP_REQUEST_DURATION.labels(request.method, route, status).observe(time.perf_counter() - start)
+            if response.status_code >= 500:
+                HTTP_REQUEST_ERRORS.labels(request.method, route, status).inc()
+        return response
+
+    @app.teardown_request
+    def _finish_request(exc):
+        route = g.pop("_metrics_route", None)
+        if route is not None:
+            HTTP_REQUESTS_IN_FLIGHT.labels(route).dec()
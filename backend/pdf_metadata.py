@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import metrics
+from fingerprints import cached_hash, content_hash
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Where extracted metadata is stored, one JSON file per content hash
+METADATA_DIR = os.environ.get(
+    "PDF_METADATA_DIR",
+    os.path.join(os.path.dirname(os.environ.get("CONFIG_FILE_PATH", "/app/data/config.json")), "metadata"),
+)
+
+# Background threads extracting metadata for files seen in listings, and how many may queue
+WORKERS = int(os.environ.get("PDF_METADATA_WORKERS", "2"))
+MAX_PENDING = 1000
+
+# Pages inspected for fonts when deciding whether a PDF has a text layer
+TEXT_LAYER_SAMPLE_PAGES = 50
+
+# Outline entries kept per document
+OUTLINE_LIMIT = 500
+
+# Entries kept in memory, in front of the JSON files
+MEMORY_SIZE = 10000
+
+# Seconds a failed extraction is served before it is tried again, as the failure may have been passing
+ERROR_TTL_SECONDS = float(os.environ.get("PDF_METADATA_ERROR_TTL_SECONDS", "3600"))
+
+# Bumped whenever extraction changes, so stale cached entries are recomputed
+SCHEMA_VERSION = 1
+
+INFO_FIELDS = {
+    "Title": "title",
+    "Author": "author",
+    "Subject": "subject",
+    "Creator": "creator",
+    "Producer": "producer",
+    "CreationDate": "created",
+    "ModDate": "modified",
+}
+
+_memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_memory_lock = threading.Lock()
+_extractions = SingleFlight("pdf_metadata")
+_executor: Optional[ThreadPoolExecutor] = None
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def _text(value: Any) -> Optional[str]:
+    from pdfminer.pdftypes import resolve1
+    from pdfminer.psparser import PSLiteral
+    from pdfminer.utils import decode_text
+    value = resolve1(value)
+    if isinstance(value, bytes):
+        return decode_text(value).strip("\x00").strip() or None
+    if isinstance(value, PSLiteral):
+        return str(value.name)
+    if isinstance(value, str):
+        return value.strip() or None
+    return None
+
+
+def _has_fonts(resources: Any, depth: int = 0) -> bool:
+    """Whether a resource dictionary, or a form XObject it uses, declares fonts"""
+    from pdfminer.pdftypes import resolve1
+    resources = resolve1(resources)
+    if not isinstance(resources, dict):
+        return False
+    if resolve1(resources.get("Font")):
+        return True
+    if depth >= 2:
+        return False
+    xobjects = resolve1(resources.get("XObject")) or {}
+    for xobject in xobjects.values():
+        xobject = resolve1(xobject)
+        attrs = getattr(xobject, "attrs", {})
+        if _text(attrs.get("Subtype")) == "Form" and _has_fonts(attrs.get("Resources"), depth + 1):
+            return True
+    return False
+
+
+def extract(path: str) -> Dict[str, Any]:
+    """Read page count, info dictionary, outline and text layer presence.
+
+    Only the cross-reference table, trailer, catalog and page dictionaries are
+    parsed; page content streams are never decoded.
+    """
+    from pdfminer.pdfdocument import PDFDocument, PDFNoOutlines
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.pdfparser import PDFParser
+    from pdfminer.pdftypes import resolve1
+
+    meta: Dict[str, Any] = {"schema": SCHEMA_VERSION}
+    with open(path, "rb") as f:
+        document = PDFDocument(PDFParser(f))
+        meta["encrypted"] = document.encryption is not None
+        try:
+            meta["pages"] = int(resolve1(resolve1(document.catalog["Pages"])["Count"]))
+        except Exception:
+            meta["pages"] = None
+
+        for info in document.info:
+            for key, name in INFO_FIELDS.items():
+                if key in info and name not in meta:
+                    meta[name] = _text(info[key])
+
+        outline: List[Dict[str, Any]] = []
+        try:
+            for level, title, *_ in document.get_outlines():
+                if len(outline) >= OUTLINE_LIMIT:
+                    break
+                outline.append({"level": level, "title": _text(title) or ""})
+        except PDFNoOutlines:
+            pass
+        except Exception as e:
+            logger.warning(f"Could not read outline of {path}: {str(e)}")
+        meta["outline"] = outline
+
+        sampled = 0
+        has_text = False
+        for page in PDFPage.create_pages(document):
+            sampled += 1
+            if _has_fonts(page.resources):
+                has_text = True
+                break
+            if sampled >= TEXT_LAYER_SAMPLE_PAGES:
+                break
+        meta["has_text_layer"] = has_text
+        # Without fonts on every page, the answer is only certain if all pages were inspected
+        meta["text_layer_certain"] = has_text or (meta["pages"] is not None and sampled >= meta["pages"])
+    return meta
+
+
+def _store_path(digest: str) -> str:
+    return os.path.join(METADATA_DIR, f"{digest}.json")
+
+
+def _remember(digest: str, meta: Dict[str, Any]) -> None:
+    with _memory_lock:
+        _memory[digest] = meta
+        _memory.move_to_end(digest)
+        while len(_memory) > MEMORY_SIZE:
+            _memory.popitem(last=False)
+
+
+def _expired(meta: Dict[str, Any]) -> bool:
+    # Errors stored before they had a timestamp are retried once
+    return "error" in meta and time.time() - meta.get("failed", 0) > ERROR_TTL_SECONDS
+
+
+def _load(digest: str) -> Optional[Dict[str, Any]]:
+    with _memory_lock:
+        meta = _memory.get(digest)
+    if meta is not None:
+        return None if _expired(meta) else meta
+    try:
+        with open(_store_path(digest), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("schema") != SCHEMA_VERSION or _expired(meta):
+        return None
+    _remember(digest, meta)
+    return meta
+
+
+def _save(digest: str, meta: Dict[str, Any]) -> None:
+    os.makedirs(METADATA_DIR, exist_ok=True)
+    tmp_path = f"{_store_path(digest)}.{os.getpid()}-{threading.get_ident()}.partial"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, _store_path(digest))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def get(path: str) -> Dict[str, Any]:
+    """Metadata of a PDF, extracted once per distinct content"""
+    digest = content_hash(path)
+    meta = _load(digest)
+    metrics.record_cache("pdf_metadata", meta is not None)
+    if meta is not None:
+        return dict(meta, hash=digest)
+
+    def compute() -> Dict[str, Any]:
+        existing = _load(digest)
+        if existing is not None:
+            return existing
+        try:
+            result = extract(path)
+        except Exception as e:
+            logger.warning(f"Could not extract metadata from {path}: {str(e)}")
+            result = {"schema": SCHEMA_VERSION, "error": str(e) or type(e).__name__, "failed": time.time()}
+        _remember(digest, result)
+        try:
+            _save(digest, result)
+        except OSError as e:
+            logger.warning(f"Could not store metadata for {path}: {str(e)}")
+        return result
+
+    return dict(_extractions.do(digest, compute), hash=digest)
+
+
+def cached(path: str, stat: Optional[os.stat_result] = None) -> Optional[Dict[str, Any]]:
+    """Metadata if it is known without reading the PDF, else None"""
+    digest = cached_hash(path, stat)
+    if not digest:
+        return None
+    meta = _load(digest)
+    return dict(meta, hash=digest) if meta is not None else None
+
+
+def summary(meta: Dict[str, Any]) -> Dict[str, Any]:
+    """Metadata without the outline, for embedding in listings"""
+    result = {key: value for key, value in meta.items() if key not in ("outline", "schema")}
+    result["outline_entries"] = len(meta.get("outline") or [])
+    return result
+
+
+def prefetch(path: str) -> None:
+    """Extract metadata in the background so a later listing can include it"""
+    global _executor
+    key = os.path.abspath(path)
+    with _pending_lock:
+        if key in _pending or len(_pending) >= MAX_PENDING:
+            return
+        _pending.add(key)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="pdf-metadata")
+
+    def run() -> None:
+        try:
+            get(path)
+        except Exception as e:
+            logger.warning(f"Background metadata extraction failed for {path}: {str(e)}")
+        finally:
+            with _pending_lock:
+                _pending.discard(key)
+
+    _executor.submit(run)
@@ -0,0 +1,183 @@
+import os
+import time
+import shutil
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+import metrics
+from fingerprints import content_hash
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Set to "false" to serve PDFs exactly as uploaded
+PDF_OPTIMIZE = os.environ.get("PDF_OPTIMIZE", "true").lower() in ("1", "true", "yes")
+
+# qpdf executable that writes the linearised copies
+QPDF_PATH = os.environ.get("QPDF_PATH", "qpdf")
+
+# Where optimised copies are stored, one PDF per content hash of the original
+OPTIMIZED_DIR = os.environ.get(
+    "PDF_OPTIMIZED_DIR",
+    os.path.join(os.path.dirname(os.environ.get("CONFIG_FILE_PATH", "/app/data/config.json")), "optimized"),
+)
+
+# Smaller PDFs arrive quickly enough as they are
+MIN_BYTES = int(os.environ.get("PDF_OPTIMIZE_MIN_BYTES", str(1024 * 1024)))
+
+# Also pack objects into compressed object streams; needs a PDF 1.5 reader, which every current viewer is
+OBJECT_STREAMS = os.environ.get("PDF_OPTIMIZE_OBJECT_STREAMS", "true").lower() in ("1", "true", "yes")
+
+# Background threads optimising uploads, how many may queue, and how long one run may take
+WORKERS = int(os.environ.get("PDF_OPTIMIZE_WORKERS", "1"))
+MAX_PENDING = 1000
+TIMEOUT_SECONDS = float(os.environ.get("PDF_OPTIMIZE_TIMEOUT_SECONDS", "600"))
+
+# Seconds before content whose run timed out or could not start is tried again
+RETRY_SECONDS = float(os.environ.get("PDF_OPTIMIZE_RETRY_SECONDS", "3600"))
+
+# qpdf exits with 3 when it fixed recoverable problems; the output is still usable
+_QPDF_OK = (0, 3)
+
+OPTIMIZATIONS = metrics.registry.counter(
+    "notypdf_pdf_optimizations_total",
+    "PDF optimisation runs by outcome: optimized, skipped or failed",
+    ["outcome"],
+)
+OPTIMIZATION_SECONDS = metrics.registry.histogram(
+    "notypdf_pdf_optimization_seconds",
+    "Time taken to write a linearised copy of a PDF",
+)
+OPTIMIZED_BYTES = metrics.registry.counter(
+    "notypdf_pdf_optimized_bytes_total",
+    "Size of PDFs before and after optimisation",
+    ["stage"],
+)
+
+_runs = SingleFlight("pdf_optimize")
+_executor: Optional[ThreadPoolExecutor] = None
+_pending = set()
+_pending_lock = threading.Lock()
+_qpdf: Optional[str] = None
+# Content hash to the monotonic time after which a run that did not finish may be tried again
+_retry_after: Dict[str, float] = {}
+
+
+def enabled() -> bool:
+    """Whether optimisation is switched on and qpdf can be found"""
+    global _qpdf
+    if not PDF_OPTIMIZE:
+        return False
+    if _qpdf is None:
+        _qpdf = shutil.which(QPDF_PATH) or ""
+        if not _qpdf:
+            logger.warning(f"qpdf not found at {QPDF_PATH}; PDFs are served as uploaded")
+    return bool(_qpdf)
+
+
+def wanted(document: str) -> bool:
+    """Whether a stored document will be optimised"""
+    return document.lower().endswith(".pdf") and enabled()
+
+
+def _store_path(digest: str) -> str:
+    return os.path.join(OPTIMIZED_DIR, f"{digest}.pdf")
+
+
+def _skip_path(digest: str) -> str:
+    # Left for PDFs that are too small or that qpdf rejected, so they are not retried
+    return os.path.join(OPTIMIZED_DIR, f"{digest}.skip")
+
+
+def optimized(path: str) -> Optional[str]:
+    """Path of the optimised copy of a PDF if one has been written, else None"""
+    try:
+        candidate = _store_path(content_hash(path))
+    except OSError:
+        return None
+    return candidate if os.path.isfile(candidate) else None
+
+
+def optimize(path: str) -> Optional[str]:
+    """Write a linearised copy of a PDF, once per content, returning its path or None if it was skipped"""
+    digest = content_hash(path)
+    target = _store_path(digest)
+
+    def run() -> Optional[str]:
+        if os.path.isfile(target):
+            return target
+        if os.path.exists(_skip_path(digest)) or time.monotonic() < _retry_after.get(digest, 0.0):
+            return None
+        os.makedirs(OPTIMIZED_DIR, exist_ok=True)
+        size = os.path.getsize(path)
+        if size < MIN_BYTES:
+            OPTIMIZATIONS.labels("skipped").inc()
+            open(_skip_path(digest), "w").close()
+            return None
+
+        tmp_path = f"{target}.{os.getpid()}-{threading.get_ident()}.partial"
+        command = [_qpdf or QPDF_PATH, "--linearize", "--compress-streams=y"]
+        if OBJECT_STREAMS:
+            command.append("--object-streams=generate")
+        command += ["--", path, tmp_path]
+        start = time.perf_counter()
+        try:
+            result = subprocess.run(command, capture_output=True, timeout=TIMEOUT_SECONDS)
+            if result.returncode not in _QPDF_OK or not os.path.isfile(tmp_path):
+                OPTIMIZATIONS.labels("failed").inc()
+                error = result.stderr.decode("utf-8", "replace").strip() or f"qpdf exited with {result.returncode}"
+                logger.warning(f"Could not optimise {path}: {error}")
+                # qpdf itself rejected this content, so running it again would fail the same way
+                open(_skip_path(digest), "w").close()
+                return None
+            os.replace(tmp_path, target)
+            _retry_after.pop(digest, None)
+        except Exception as e:
+            # A timeout on a busy machine or a failure to start qpdf says nothing about the PDF
+            OPTIMIZATIONS.labels("failed").inc()
+            logger.warning(f"Could not optimise {path}, retrying in {RETRY_SECONDS:.0f}s: {str(e) or type(e).__name__}")
+            _retry_after[digest] = time.monotonic() + RETRY_SECONDS
+            return None
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        OPTIMIZATION_SECONDS.labels().observe(time.perf_counter() - start)
+        OPTIMIZATIONS.labels("optimized").inc()
+        OPTIMIZED_BYTES.labels("original").inc(size)
+        OPTIMIZED_BYTES.labels("optimized").inc(os.path.getsize(target))
+        logger.info(f"Optimised {os.path.basename(path)}: {size} -> {os.path.getsize(target)} bytes")
+        return target
+
+    return _runs.do(digest, run)
+
+
+def schedule(document: str, resolve: Callable[[str], str], size: Optional[int] = None) -> None:
+    """Optimise a PDF in the background; resolve returns its local path, fetching it if needed.
+
+    Pass the stored size when it is known, so a PDF too small to optimise
+    is never fetched from remote storage just to find that out.
+    """
+    global _executor
+    if not wanted(document) or (size is not None and size < MIN_BYTES):
+        return
+    with _pending_lock:
+        if document in _pending or len(_pending) >= MAX_PENDING:
+            return
+        _pending.add(document)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="pdf-optimize")
+
+    def run() -> None:
+        try:
+            optimize(resolve(document))
+        except Exception as e:
+            logger.warning(f"Background optimisation failed for {document}: {str(e)}")
+        finally:
+            with _pending_lock:
+                _pending.discard(document)
+
+    _executor.submit(run)
@@ -0,0 +1,195 @@
+import os
+import io
+import json
+import time
+import uuid
+import random
+import logging
+import cProfile
+import pstats
+import threading
+import contextvars
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+# Directory holding captured profiles
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "/app/data/profiles")
+
+# Maximum number of profiles kept on disk, oldest are removed first
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", "50"))
+
+# Fraction of requests profiled without the header (0 disables sampling)
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+
+# Request header that turns profiling on for a single request
+PROFILE_HEADER = "X-NotyPDF-Profile"
+
+# Whether clients may opt in with the header; off by default, since any caller could otherwise make the server profile and write files
+PROFILE_HEADER_ENABLED = os.environ.get("PROFILE_HEADER_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# Number of functions kept in the JSON summary
+PROFILE_TOP_FUNCTIONS = 25
+
+_current: contextvars.ContextVar = contextvars.ContextVar("notypdf_profile", default=None)
+_null_span = nullcontext()
+_prune_lock = threading.Lock()
+
+
+class RequestProfile:
+    """CPU profile and wall-clock spans collected for one request"""
+
+    def __init__(self, method: str, path: str):
+        self.id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        self.method = method
+        self.path = path
+        self.spans: List[Dict[str, Any]] = []
+        self.started_at = datetime.now().isoformat()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.profiler = cProfile.Profile()
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            entry = {
+                "name": name,
+                "offset_ms": round((start - self._start) * 1000, 3),
+                "duration_ms": round((end - start) * 1000, 3),
+            }
+            if attributes:
+                entry["attributes"] = attributes
+            with self._lock:
+                self.spans.append(entry)
+
+    def summary(self, status: int) -> Dict[str, Any]:
+        totals: Dict[str, float] = {}
+        for entry in self.spans:
+            totals[entry["name"]] = round(totals.get(entry["name"], 0.0) + entry["duration_ms"], 3)
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "started_at": self.started_at,
+            "duration_ms": round((time.perf_counter() - self._start) * 1000, 3),
+            "span_totals_ms": totals,
+            "spans": self.spans,
+        }
+
+
+def span(name: str, **attributes: Any):
+    """Time a block as a named span of the current request's profile, if any"""
+    profile = _current.get()
+    if profile is None:
+        return _null_span
+    return profile.span(name, **attributes)
+
+
+def _should_profile() -> bool:
+    if PROFILE_HEADER_ENABLED and request.headers.get(PROFILE_HEADER):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _top_functions(stats: pstats.Stats) -> List[Dict[str, Any]]:
+    rows = []
+    for (filename, line, func), (cc, nc, tt, ct, _) in stats.stats.items():
+        rows.append({
+            "function": f"{os.path.basename(filename)}:{line}({func})",
+            "calls": nc,
+            "total_ms": round(tt * 1000, 3),
+            "cumulative_ms": round(ct * 1000, 3),
+        })
+    rows.sort(key=lambda row: row["cumulative_ms"], reverse=True)
+    return rows[:PROFILE_TOP_FUNCTIONS]
+
+
+def _prune() -> None:
+    with _prune_lock:
+        summaries = sorted(f for f in os.listdir(PROFILE_DIR) if f.endswith(".json"))
+        for filename in summaries[:max(0, len(summaries) - PROFILE_MAX_FILES)]:
+            profile_id = filename[:-len(".json")]
+            for suffix in (".json", ".prof"):
+                try:
+                    os.remove(os.path.join(PROFILE_DIR, profile_id + suffix))
+                except FileNotFoundError:
+                    pass
+
+
+def _write(profile: RequestProfile, status: int) -> None:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stats = pstats.Stats(profile.profiler, stream=io.StringIO())
+    stats.dump_stats(os.path.join(PROFILE_DIR, f"{profile.id}.prof"))
+    summary = profile.summary(status)
+    summary["top_functions"] = _top_functions(stats)
+    with open(os.path.join(PROFILE_DIR, f"{profile.id}.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    _prune()
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Return the stored profile summaries, newest first, without span details"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for filename in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, filename), "r") as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            continue
+        profiles.append({key: summary.get(key) for key in ("id", "method", "path", "status", "started_at", "duration_ms", "span_totals_ms")})
+    return profiles
+
+
+def profile_path(profile_id: str, suffix: str) -> Optional[str]:
+    """Return the on-disk path of a stored profile file, or None if unknown"""
+    if not profile_id.replace("_", "").isalnum():
+        return None
+    path = os.path.join(PROFILE_DIR, profile_id + suffix)
+    return path if os.path.exists(path) else None
+
+
+def instrument_app(app) -> None:
+    """Register request hooks that profile requests opted in by header or sampling"""
+
+    @app.before_request
+    def _start_profile():
+        if not _should_profile():
+            return
+        profile = RequestProfile(request.method, request.full_path.rstrip("?"))
+        g._profile = profile
+        g._profile_token = _current.set(profile)
+        profile.profiler.enable()
+
+    @app.after_request
+    def _finish_profile(response):
+        profile = g.pop("_profile", None)
+        if profile is None:
+            return response
+        profile.profiler.disable()
+        _current.reset(g.pop("_profile_token"))
+        try:
+            _write(profile, response.status_code)
+            response.headers["X-NotyPDF-Profile-Id"] = profile.id
+        except Exception as e:
+            logger.error(f"Error writing profile {profile.id}: {str(e)}")
+        return response
+
+    @app.teardown_request
+    def _abandon_profile(exc):
+        profile = g.pop("_profile", None)
+        if profile is not None:
+            profile.profiler.disable()
+            _current.reset(g.pop("_profile_token"))
@@ -0,0 +1,147 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import metrics
+from scheduler import Scheduler
+
+logger = logging.getLogger(__name__)
+
+# Retries of a request answered with 429 before it is reported as failed
+MAX_RATE_LIMIT_RETRIES = int(os.environ.get("TRANSLATION_MAX_RETRIES", "4"))
+
+# Base and cap of the jittered exponential backoff used when no Retry-After is given
+BACKOFF_BASE_SECONDS = float(os.environ.get("TRANSLATION_BACKOFF_BASE", "1"))
+BACKOFF_MAX_SECONDS = float(os.environ.get("TRANSLATION_BACKOFF_MAX", "60"))
+
+# Minimum spacing between two multiplicative decreases, so a burst of 429s halves the limit once
+DECREASE_INTERVAL_SECONDS = 1.0
+
+
+def rate_setting(name: str, provider: str) -> float:
+    """Per-provider rate ceiling, e.g. TRANSLATION_RPM_OPENAI=500 (0 means unlimited)"""
+    value = os.environ.get(f"{name}_{provider.upper()}") or os.environ.get(name)
+    return float(value) if value else 0.0
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Return the delay in seconds from a Retry-After header (seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff for the given retry attempt"""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+class TokenBucket:
+    """Per-minute budget refilled continuously; a rate of 0 disables it"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount can be taken"""
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60.0 / self.capacity
+
+    def take(self, amount: float) -> None:
+        if self.capacity:
+            self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount: float) -> None:
+        """Charge (positive) or refund (negative) the difference to an earlier estimate"""
+        if self.capacity:
+            self.level = min(self.capacity, self.level - amount)
+
+
+class AdaptiveLimiter:
+    """Client-side throttle for one (provider, API key) pair.
+
+    Concurrency follows AIMD: every success raises the limit by 1/limit, a 429
+    halves it. Requests and tokens per minute are metered by token buckets, and a
+    Retry-After pauses the whole queue. Requests first wait in ``queue`` for one
+    of the ``limit`` slots, so interactive work overtakes queued bulk work. Must
+    only be used from the engine's loop.
+    """
+
+    def __init__(self, provider: str, max_concurrency: int):
+        self.provider = provider
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.requests = TokenBucket(rate_setting("TRANSLATION_RPM", provider))
+        self.tokens = TokenBucket(rate_setting("TRANSLATION_TPM", provider))
+        self._condition = asyncio.Condition()
+        self.queue = Scheduler(f"translation:{provider}", lambda: int(self.limit))
+        metrics.PROVIDER_CONCURRENCY_LIMIT.labels(provider).set(self.limit)
+
+    async def acquire(self, tokens: float) -> None:
+        """Wait for a concurrency slot and rate budget, then take them"""
+        start = time.monotonic()
+        async with self._condition:
+            while True:
+                now = time.monotonic()
+                wait = self.blocked_until - now
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+                    if wait <= 0:
+                        self.requests.take(1)
+                        self.tokens.take(tokens)
+                        self.in_flight += 1
+                        break
+                if wait > 0:
+                    # Jitter so queued requests don't all wake up on the same tick
+                    wait += random.uniform(0, wait * 0.1 + 0.01)
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await self._condition.wait()
+        metrics.PROVIDER_QUEUE_WAIT.labels(self.provider).observe(time.monotonic() - start)
+
+    async def release(self, status_code: Optional[int], retry_after: Optional[float] = None, token_correction: float = 0.0, attempt: int = 0) -> None:
+        """Return a slot and adapt the limit to the response that came back"""
+        async with self._condition:
+            self.in_flight -= 1
+            self.tokens.adjust(token_correction)
+            now = time.monotonic()
+            if status_code == 429:
+                metrics.PROVIDER_RATE_LIMITED.labels(self.provider).inc()
+                if now - self.last_decrease >= DECREASE_INTERVAL_SECONDS:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.last_decrease = now
+                    logger.warning(f"{self.provider} rate limited, concurrency limit lowered to {int(self.limit)}")
+                delay = retry_after if retry_after is not None else backoff_delay(attempt)
+                self.blocked_until = max(self.blocked_until, now + delay)
+            elif status_code is not None and status_code < 400:
+                self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+            metrics.PROVIDER_CONCURRENCY_LIMIT.labels(self.provider).set(self.limit)
+            self._condition.notify_all()
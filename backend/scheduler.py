@@ -0,0 +1,301 @@
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, List, NamedTuple, Optional, Union
+
+from flask import g, request
+
+import metrics
+
+# Classes of work, most urgent first
+PRIORITIES = ("interactive", "normal", "bulk")
+
+# Class of work started by a request that does not ask for one; someone is waiting on it
+DEFAULT_REQUEST_PRIORITY = os.environ.get("SCHEDULER_DEFAULT_PRIORITY", "interactive")
+
+# Seconds a queued item waits before it moves up one class, so bulk work is never starved
+AGING_SECONDS = float(os.environ.get("SCHEDULER_AGING_SECONDS", "30"))
+
+PRIORITY_HEADER = "X-Priority"
+CLIENT_HEADER = "X-Client-ID"
+
+SCHEDULER_QUEUE_DEPTH = metrics.registry.gauge(
+    "notypdf_scheduler_queue_depth",
+    "Work items waiting for a slot, by scheduler and priority class",
+    ["scheduler", "priority"],
+)
+SCHEDULER_WAIT = metrics.registry.histogram(
+    "notypdf_scheduler_wait_seconds",
+    "Time work items waited for a slot, by scheduler and requested priority class",
+    ["scheduler", "priority"],
+)
+SCHEDULER_PROMOTIONS = metrics.registry.counter(
+    "notypdf_scheduler_promotions_total",
+    "Queued work items moved to a more urgent class, by reason",
+    ["scheduler", "reason"],
+)
+
+
+class Work(NamedTuple):
+    """Who a piece of work is for: its priority class, the requesting client and the document"""
+
+    priority: str
+    tenant: str
+    document: str
+
+
+# Work started outside a request, such as background jobs, is bulk unless it says otherwise
+work_var: contextvars.ContextVar = contextvars.ContextVar("work", default=Work("bulk", "", ""))
+
+
+def parse_priority(value: Optional[str], default: str) -> str:
+    value = (value or "").strip().lower()
+    return value if value in PRIORITIES else default
+
+
+def current() -> Work:
+    return work_var.get()
+
+
+@contextmanager
+def work(priority: Optional[str] = None, tenant: Optional[str] = None, document: Optional[str] = None) -> Iterator[Work]:
+    """Run the enclosed code as work of the given class, client and document"""
+    base = work_var.get()
+    value = Work(
+        parse_priority(priority, base.priority),
+        base.tenant if tenant is None else tenant,
+        base.document if document is None else document,
+    )
+    token = work_var.set(value)
+    try:
+        yield value
+    finally:
+        work_var.reset(token)
+
+
+class Ticket:
+    """A place in a scheduler's queue, and later the slot it was granted"""
+
+    __slots__ = ("priority", "rank", "tenant", "document", "enqueued", "since", "queued", "granted", "_event", "_loop", "_future")
+
+    def __init__(self, work: Work):
+        self.priority = work.priority
+        self.rank = PRIORITIES.index(work.priority)
+        self.tenant = work.tenant
+        self.document = work.document
+        self.enqueued = time.monotonic()
+        self.since = self.enqueued
+        self.queued = False
+        self.granted = False
+        self._event: Optional[threading.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._future: Optional[asyncio.Future] = None
+
+    def _wake(self) -> None:
+        if self._event is not None:
+            self._event.set()
+        elif self._future is not None:
+            future = self._future
+            self._loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+
+class Scheduler:
+    """Admits work into a limited number of slots, most urgent class first.
+
+    Waiting work is queued per class. Within a class, slots go round-robin to
+    clients and, per client, to documents, so one bulk re-index cannot starve
+    another user. Queued items move up a class after AGING_SECONDS, and
+    promote() lifts every queued item of a document when a more urgent request
+    needs it. Usable from threads and from coroutines on any event loop.
+    """
+
+    def __init__(self, name: str, capacity: Union[int, Callable[[], int]]):
+        self.name = name
+        self._capacity = capacity if callable(capacity) else (lambda: capacity)
+        self.active = 0
+        self._lock = threading.Lock()
+        # Per class: client -> document -> tickets in arrival order
+        self._queues: List["OrderedDict[str, OrderedDict[str, Deque[Ticket]]]"] = [OrderedDict() for _ in PRIORITIES]
+        # Per class, tickets in the order they entered it, for aging; entries that left are skipped lazily
+        self._arrivals: List[Deque[Ticket]] = [deque() for _ in PRIORITIES]
+        self._depth = [0] * len(PRIORITIES)
+
+    @property
+    def capacity(self) -> int:
+        return max(1, int(self._capacity()))
+
+    def _push(self, ticket: Ticket) -> None:
+        flows = self._queues[ticket.rank]
+        documents = flows.setdefault(ticket.tenant, OrderedDict())
+        documents.setdefault(ticket.document, deque()).append(ticket)
+        ticket.since = time.monotonic()
+        ticket.queued = True
+        self._arrivals[ticket.rank].append(ticket)
+        self._depth[ticket.rank] += 1
+        SCHEDULER_QUEUE_DEPTH.labels(self.name, PRIORITIES[ticket.rank]).inc()
+
+    def _remove(self, ticket: Ticket) -> None:
+        flows = self._queues[ticket.rank]
+        documents = flows[ticket.tenant]
+        tickets = documents[ticket.document]
+        tickets.remove(ticket)
+        if not tickets:
+            del documents[ticket.document]
+            if not documents:
+                del flows[ticket.tenant]
+        ticket.queued = False
+        self._depth[ticket.rank] -= 1
+        SCHEDULER_QUEUE_DEPTH.labels(self.name, PRIORITIES[ticket.rank]).dec()
+
+    def _move(self, ticket: Ticket, rank: int, reason: str) -> None:
+        self._remove(ticket)
+        ticket.rank = rank
+        self._push(ticket)
+        SCHEDULER_PROMOTIONS.labels(self.name, reason).inc()
+
+    def _age(self, now: float) -> None:
+        for rank in range(1, len(PRIORITIES)):
+            arrivals = self._arrivals[rank]
+            while arrivals:
+                ticket = arrivals[0]
+                if not ticket.queued or ticket.rank != rank:
+                    arrivals.popleft()
+                    continue
+                if now - ticket.since < AGING_SECONDS:
+                    break
+                arrivals.popleft()
+                self._move(ticket, rank - 1, "aging")
+
+    def _next(self) -> Optional[Ticket]:
+        for flows in self._queues:
+            if not flows:
+                continue
+            tenant, documents = next(iter(flows.items()))
+            document, tickets = next(iter(documents.items()))
+            ticket = tickets[0]
+            self._remove(ticket)
+            # The client and document just served go to the back of their rounds
+            if tenant in flows:
+                flows.move_to_end(tenant)
+                if document in documents:
+                    documents.move_to_end(document)
+            return ticket
+        return None
+
+    def _dispatch(self) -> None:
+        if not any(self._depth):
+            return
+        self._age(time.monotonic())
+        while self.active < self.capacity:
+            ticket = self._next()
+            if ticket is None:
+                break
+            self._grant(ticket)
+
+    def _grant(self, ticket: Ticket) -> None:
+        self.active += 1
+        ticket.granted = True
+        SCHEDULER_WAIT.labels(self.name, ticket.priority).observe(time.monotonic() - ticket.enqueued)
+        ticket._wake()
+
+    def _enqueue(self, ticket: Ticket) -> None:
+        with self._lock:
+            if not any(self._depth) and self.active < self.capacity:
+                self._grant(ticket)
+            else:
+                self._push(ticket)
+                self._dispatch()
+
+    def acquire(self, work: Optional[Work] = None) -> Ticket:
+        """Block the calling thread until a slot is granted"""
+        ticket = Ticket(work or current())
+        ticket._event = threading.Event()
+        self._enqueue(ticket)
+        ticket._event.wait()
+        return ticket
+
+    async def acquire_async(self, work: Optional[Work] = None) -> Ticket:
+        """Wait without blocking the event loop until a slot is granted"""
+        ticket = Ticket(work or current())
+        ticket._loop = asyncio.get_running_loop()
+        ticket._future = ticket._loop.create_future()
+        self._enqueue(ticket)
+        try:
+            await ticket._future
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = ticket.granted
+                if not granted:
+                    self._remove(ticket)
+            if granted:
+                self.release(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        with self._lock:
+            self.active -= 1
+            self._dispatch()
+
+    def wake(self) -> None:
+        """Grant queued work after the capacity grew outside of a release"""
+        with self._lock:
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, **overrides: Any) -> Iterator[Ticket]:
+        work = current()._replace(**overrides) if overrides else None
+        ticket = self.acquire(work)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @asynccontextmanager
+    async def slot_async(self, **overrides: Any) -> AsyncIterator[Ticket]:
+        work = current()._replace(**overrides) if overrides else None
+        ticket = await self.acquire_async(work)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def promote(self, document: str, priority: str) -> int:
+        """Move queued work for a document up to at least the given class, returning how many items moved"""
+        rank = PRIORITIES.index(parse_priority(priority, "bulk"))
+        moved = 0
+        with self._lock:
+            for lower in range(rank + 1, len(PRIORITIES)):
+                for documents in list(self._queues[lower].values()):
+                    for ticket in list(documents.get(document, ())):
+                        self._move(ticket, rank, "promoted")
+                        moved += 1
+        return moved
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "active": self.active,
+                "capacity": self.capacity,
+                "queued": dict(zip(PRIORITIES, self._depth)),
+            }
+
+
+def instrument_app(app) -> None:
+    """Take the priority class and client of each request from its headers"""
+
+    @app.before_request
+    def _start_work():
+        priority = parse_priority(request.headers.get(PRIORITY_HEADER) or request.args.get("priority"), DEFAULT_REQUEST_PRIORITY)
+        tenant = request.headers.get(CLIENT_HEADER) or request.remote_addr or ""
+        g._work_token = work_var.set(Work(priority, tenant[:128], ""))
+
+    @app.teardown_request
+    def _end_work(exc):
+        token = g.pop("_work_token", None)
+        if token is not None:
+            work_var.reset(token)
@@ -0,0 +1,434 @@
+import os
+import time
+import uuid
+import socket
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+try:
+    import fcntl
+except ImportError:  # file locks fall back to in-process locks where fcntl is missing
+    fcntl = None
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Where state shared by backend replicas lives: empty for this process only, or redis://[:password@]host:port/db
+SHARED_STATE_URL = os.environ.get("SHARED_STATE_URL", "")
+
+# Prefix of every key, so several installations can share one server
+KEY_PREFIX = os.environ.get("SHARED_STATE_PREFIX", "notypdf:")
+
+# Directory of the lock files guarding config and artifact writes; must be on the volume the replicas share
+LOCK_DIR = os.environ.get(
+    "LOCK_DIR",
+    os.path.join(os.path.dirname(os.environ.get("CONFIG_FILE_PATH", "/app/data/config.json")), "locks"),
+)
+
+# Seconds a lock or the leadership survives a replica that stopped renewing it
+LOCK_TTL_SECONDS = float(os.environ.get("SHARED_LOCK_TTL_SECONDS", "30"))
+LEADER_TTL_SECONDS = float(os.environ.get("LEADER_TTL_SECONDS", "15"))
+
+# Identifies this process in lock and leader values
+NODE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+SHARED_LOCK_WAIT = metrics.registry.histogram(
+    "notypdf_shared_lock_wait_seconds",
+    "Time spent acquiring shared locks, by lock kind",
+    ["kind"],
+)
+LEADER = metrics.registry.gauge(
+    "notypdf_leader",
+    "1 while this replica holds the leadership and runs background sweeps",
+)
+
+# Compare-and-delete and compare-and-expire, so a replica never frees or extends a lock that expired and was taken over
+_RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+_RENEW_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+
+
+class LocalState:
+    """Keys with expiry in this process; the default for a single replica"""
+
+    name = "local"
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key: str) -> Optional[str]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self._values[key]
+            return None
+        return entry[0]
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._live(key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None, only_new: bool = False) -> bool:
+        with self._lock:
+            if only_new and self._live(key) is not None:
+                return False
+            self._values[key] = (value, time.monotonic() + ttl if ttl else None)
+            return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._values.pop(key, None)
+
+    def release(self, key: str, value: str) -> bool:
+        with self._lock:
+            if self._live(key) != value:
+                return False
+            del self._values[key]
+            return True
+
+    def renew(self, key: str, value: str, ttl: float) -> bool:
+        with self._lock:
+            if self._live(key) != value:
+                return False
+            self._values[key] = (value, time.monotonic() + ttl)
+            return True
+
+    def ping(self) -> bool:
+        return True
+
+
+class RedisError(Exception):
+    pass
+
+
+class _RedisConnection:
+    """One RESP connection; only the handful of commands used here"""
+
+    def __init__(self, host: str, port: int, password: Optional[str], db: int, timeout: float):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+        if password:
+            self.command("AUTH", password)
+        if db:
+            self.command("SELECT", str(db))
+
+    def command(self, *args: str) -> Any:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg.encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self.sock.sendall(b"".join(parts))
+        return self._reply()
+
+    def _reply(self) -> Any:
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by the shared state server")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise RedisError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)[:-2]
+            return data.decode("utf-8")
+        if kind == b"*":
+            length = int(body)
+            return None if length < 0 else [self._reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply from the shared state server: {line!r}")
+
+    def close(self) -> None:
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisState:
+    """Keys with expiry on a Redis-compatible server shared by every replica"""
+
+    name = "redis"
+
+    def __init__(self, url: str, timeout: float = 5.0, pool_size: int = 8):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._idle: List[_RedisConnection] = []
+        self._lock = threading.Lock()
+
+    def _command(self, *args: str) -> Any:
+        with self._lock:
+            connection = self._idle.pop() if self._idle else None
+        if connection is None:
+            connection = _RedisConnection(self.host, self.port, self.password, self.db, self.timeout)
+        error: Optional[RedisError] = None
+        try:
+            result = connection.command(*args)
+        except RedisError as e:
+            # An error reply leaves the connection usable
+            result, error = None, e
+        except (OSError, ConnectionError):
+            # A broken connection is dropped rather than returned to the pool
+            connection.close()
+            raise
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(connection)
+                connection = None
+        if connection is not None:
+            connection.close()
+        if error is not None:
+            raise error
+        return result
+
+    def get(self, key: str) -> Optional[str]:
+        return self._command("GET", key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None, only_new: bool = False) -> bool:
+        args = ["SET", key, value]
+        if ttl:
+            args += ["PX", str(max(1, int(ttl * 1000)))]
+        if only_new:
+            args.append("NX")
+        return self._command(*args) == "OK"
+
+    def delete(self, key: str) -> None:
+        self._command("DEL", key)
+
+    def release(self, key: str, value: str) -> bool:
+        return self._command("EVAL", _RELEASE_SCRIPT, "1", key, value) == 1
+
+    def renew(self, key: str, value: str, ttl: float) -> bool:
+        return self._command("EVAL", _RENEW_SCRIPT, "1", key, value, str(max(1, int(ttl * 1000)))) == 1
+
+    def ping(self) -> bool:
+        return self._command("PING") == "PONG"
+
+
+def create_state(url: str = SHARED_STATE_URL) -> Any:
+    if not url:
+        return LocalState()
+    scheme = urlparse(url).scheme
+    if scheme in ("redis", "valkey"):
+        return RedisState(url)
+    raise ValueError(f"Unsupported shared state URL scheme: {scheme}")
+
+
+# Global shared state instance
+state = create_state()
+
+
+def key(*parts: str) -> str:
+    return KEY_PREFIX + ":".join(parts)
+
+
+class SharedLock:
+    """Mutual exclusion across replicas, held for a time to live that is renewed while it is held.
+
+    A replica that dies without releasing the lock loses it once the time to
+    live runs out, so its work can be taken over. Not reentrant.
+    """
+
+    def __init__(self, name: str, ttl: float = LOCK_TTL_SECONDS, kind: str = "lock"):
+        self.key = key("lock", name)
+        self.ttl = ttl
+        self.kind = kind
+        self.token = f"{NODE_ID}:{uuid.uuid4().hex}"
+        self._stop: Optional[threading.Event] = None
+
+    def acquire(self, blocking: bool = True, timeout: Optional[float] = None) -> bool:
+        start = time.monotonic()
+        delay = 0.02
+        while not state.set(self.key, self.token, self.ttl, only_new=True):
+            if not blocking or (timeout is not None and time.monotonic() - start >= timeout):
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        SHARED_LOCK_WAIT.labels(self.kind).observe(time.monotonic() - start)
+        self._stop = threading.Event()
+        threading.Thread(target=self._keep_alive, args=(self._stop,), name=f"lock-renewal:{self.key}", daemon=True).start()
+        return True
+
+    def _keep_alive(self, stop: threading.Event) -> None:
+        while not stop.wait(self.ttl / 3):
+            try:
+                if not state.renew(self.key, self.token, self.ttl):
+                    logger.warning(f"Lost shared lock {self.key}")
+                    return
+            except Exception as e:
+                logger.warning(f"Could not renew shared lock {self.key}: {str(e)}")
+
+    def release(self) -> None:
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+        try:
+            state.release(self.key, self.token)
+        except Exception as e:
+            # It expires on its own
+            logger.warning(f"Could not release shared lock {self.key}: {str(e)}")
+
+    def __enter__(self) -> "SharedLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.release()
+
+
+def lock(name: str, ttl: float = LOCK_TTL_SECONDS, kind: str = "lock") -> SharedLock:
+    return SharedLock(name, ttl, kind)
+
+
+def locked(name: str) -> bool:
+    """Whether some replica holds the lock right now"""
+    return state.get(key("lock", name)) is not None
+
+
+_file_locks = threading.local()
+_local_file_locks: Dict[str, threading.RLock] = {}
+_local_file_locks_guard = threading.Lock()
+
+
+def _lock_file(path: str) -> str:
+    digest = hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()[:32]
+    return os.path.join(LOCK_DIR, f"{digest}.lock")
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """Exclusive lock on a file for every process on the shared volume; reentrant within a thread"""
+    lock_path = _lock_file(path)
+    held: Dict[str, int] = _file_locks.__dict__.setdefault("held", {})
+    if held.get(lock_path):
+        held[lock_path] += 1
+        try:
+            yield
+        finally:
+            held[lock_path] -= 1
+        return
+
+    start = time.monotonic()
+    if fcntl is None:
+        with _local_file_locks_guard:
+            local = _local_file_locks.setdefault(lock_path, threading.RLock())
+        with local:
+            SHARED_LOCK_WAIT.labels("file").observe(time.monotonic() - start)
+            held[lock_path] = 1
+            try:
+                yield
+            finally:
+                del held[lock_path]
+        return
+
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    with open(lock_path, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        SHARED_LOCK_WAIT.labels("file").observe(time.monotonic() - start)
+        held[lock_path] = 1
+        try:
+            yield
+        finally:
+            del held[lock_path]
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class Sweeper:
+    """Runs periodic background sweeps on exactly one replica, the leader.
+
+    Replicas compete for a leader key with a short time to live; the holder
+    renews it on every tick and runs the sweeps that are due. When the leader
+    stops, another replica takes over within LEADER_TTL_SECONDS.
+    """
+
+    def __init__(self):
+        self._sweeps: List[Dict[str, Any]] = []
+        self._key = key("leader")
+        self._leader = False
+        self._elected = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def leader(self) -> bool:
+        return self._leader
+
+    def register(self, name: str, interval: float, func: Callable[[], Any]) -> None:
+        """Run func every interval seconds on the leader; the first run comes as soon as leadership is won"""
+        self._sweeps.append({"name": name, "interval": interval, "func": func, "next": 0.0, "last": None, "error": None})
+
+    def start(self) -> None:
+        # Leadership is renewed on its own thread so a long sweep cannot let it lapse
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._elect_loop, name="leader-election", daemon=True)
+            self._thread.start()
+            threading.Thread(target=self._sweep_loop, name="sweeper", daemon=True).start()
+
+    def _elect(self) -> bool:
+        try:
+            if self._leader and state.renew(self._key, NODE_ID, LEADER_TTL_SECONDS):
+                return True
+            won = state.set(self._key, NODE_ID, LEADER_TTL_SECONDS, only_new=True)
+        except Exception as e:
+            logger.warning(f"Leader election failed: {str(e)}")
+            won = False
+        if won != self._leader:
+            logger.info(f"{'Became' if won else 'No longer'} the leader for background sweeps ({NODE_ID})")
+            LEADER.labels().set(1 if won else 0)
+        return won
+
+    def _elect_loop(self) -> None:
+        while True:
+            self._leader = self._elect()
+            self._elected.set()
+            time.sleep(LEADER_TTL_SECONDS / 3)
+
+    def _sweep_loop(self) -> None:
+        self._elected.wait()
+        while True:
+            for sweep in self._sweeps:
+                if not self._leader or time.monotonic() < sweep["next"]:
+                    continue
+                try:
+                    sweep["func"]()
+                    sweep["error"] = None
+                except Exception as e:
+                    sweep["error"] = str(e)
+                    logger.error(f"Sweep {sweep['name']} failed: {str(e)}")
+                sweep["last"] = time.time()
+                sweep["next"] = time.monotonic() + sweep["interval"]
+            time.sleep(1.0)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "node": NODE_ID,
+            "leader": self._leader,
+            "sweeps": {sweep["name"]: {"interval_seconds": sweep["interval"], "last_run": sweep["last"], "error": sweep["error"]} for sweep in self._sweeps},
+        }
+
+
+# Global sweeper instance
+sweeper = Sweeper()
+
+
+def status() -> Dict[str, Any]:
+    try:
+        reachable = state.ping()
+    except Exception:
+        reachable = False
+    return {"backend": state.name, "reachable": reachable, **sweeper.status()}
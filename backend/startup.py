@@ -0,0 +1,95 @@
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Whether converters and upstream clients are preloaded in the background after start
+WARMUP_ENABLED = os.environ.get("WARMUP_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+class Lazy:
+    """Value built on first use, so importing the app does not pay for it.
+
+    Attribute access is forwarded to the value, which lets a Lazy stand in for
+    a module-level client (``notion.pages.create(...)``) without changing callers.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self._name = name
+        self._factory = factory
+        self._value: Any = None
+        self._ready = False
+        self._lock = threading.Lock()
+
+    @property
+    def initialized(self) -> bool:
+        return self._ready
+
+    def get(self) -> Any:
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    start = time.perf_counter()
+                    self._value = self._factory()
+                    self._ready = True
+                    logger.info(f"Initialized {self._name} in {time.perf_counter() - start:.2f}s")
+        return self._value
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get(), name)
+
+
+class WarmUp:
+    """Runs warm-up steps on a background thread and reports readiness"""
+
+    def __init__(self):
+        self._steps: List[Tuple[str, Callable[[], Any]]] = []
+        self._status: Dict[str, Any] = {}
+        self._started_at: Optional[float] = None
+        self._finished = threading.Event()
+
+    def step(self, name: str, func: Callable[[], Any]) -> None:
+        self._steps.append((name, func))
+
+    def start(self) -> None:
+        """Start warming up, once; with warm-up disabled the app is ready immediately"""
+        if self._started_at is not None:
+            return
+        self._started_at = time.time()
+        if not WARMUP_ENABLED:
+            self._finished.set()
+            return
+        threading.Thread(target=self._run, name="warm-up", daemon=True).start()
+
+    def _run(self) -> None:
+        try:
+            for name, func in self._steps:
+                start = time.perf_counter()
+                try:
+                    func()
+                    self._status[name] = {"ok": True, "seconds": round(time.perf_counter() - start, 3)}
+                except Exception as e:
+                    # A failed step only means that work happens lazily on first use instead
+                    logger.warning(f"Warm-up step {name} failed: {str(e)}")
+                    self._status[name] = {"ok": False, "error": str(e)}
+        finally:
+            self._finished.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._finished.is_set()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "warmup_enabled": WARMUP_ENABLED,
+            "uptime_seconds": round(time.time() - self._started_at, 3) if self._started_at else 0,
+            "steps": dict(self._status),
+        }
+
+
+# Global warm-up instance
+warmup = WarmUp()
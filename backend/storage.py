@@ -0,0 +1,690 @@
+import os
+import hmac
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import IO, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from urllib.parse import quote, urlparse
+from xml.etree import ElementTree
+
+import requests
+
+import artifacts
+import file_operations
+import metrics
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Where documents are kept: "local" (the workspace folder) or "s3" (an S3-compatible bucket)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local").lower()
+
+# S3-compatible endpoint, bucket and credentials; S3_PREFIX places the workspace under a key prefix
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL", "https://s3.amazonaws.com")
+S3_BUCKET = os.environ.get("S3_BUCKET", "")
+S3_REGION = os.environ.get("S3_REGION", "us-east-1")
+S3_ACCESS_KEY_ID = os.environ.get("S3_ACCESS_KEY_ID", "")
+S3_SECRET_ACCESS_KEY = os.environ.get("S3_SECRET_ACCESS_KEY", "")
+S3_PREFIX = os.environ.get("S3_PREFIX", "").strip("/")
+
+# Uploads larger than one part are sent as multipart uploads, this many parts at a time
+S3_PART_SIZE = max(5 * 1024 * 1024, int(os.environ.get("S3_MULTIPART_PART_SIZE", str(8 * 1024 * 1024))))
+S3_UPLOAD_CONCURRENCY = int(os.environ.get("S3_UPLOAD_CONCURRENCY", "4"))
+
+# Local copies of hot documents, with their Markdown and translations next to them
+STORAGE_CACHE_DIR = os.environ.get(
+    "STORAGE_CACHE_DIR",
+    os.path.join(os.path.dirname(os.environ.get("CONFIG_FILE_PATH", "/app/data/config.json")), "storage_cache"),
+)
+
+# Bytes of cached documents kept before the least recently used are dropped; artifacts are not counted
+STORAGE_CACHE_MAX_BYTES = int(os.environ.get("STORAGE_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+# Ranged reads of a document before it is copied into the cache in the background
+STORAGE_CACHE_HOT_READS = int(os.environ.get("STORAGE_CACHE_HOT_READS", "2"))
+
+# Seconds a cached copy is trusted before it is checked against the bucket again
+STORAGE_CACHE_REVALIDATE_SECONDS = float(os.environ.get("STORAGE_CACHE_REVALIDATE_SECONDS", "60"))
+
+_CHUNK_SIZE = 1024 * 1024
+_S3_NS = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+_EMPTY_SHA256 = hashlib.sha256(b"").hexdigest()
+
+STORAGE_REQUESTS = metrics.registry.histogram(
+    "notypdf_storage_request_seconds",
+    "Latency of requests to the storage backend, by operation",
+    ["operation"],
+)
+STORAGE_CACHE_READS = metrics.registry.counter(
+    "notypdf_storage_cache_reads_total",
+    "Document reads by whether they were served from the local cache",
+    ["outcome"],
+)
+STORAGE_CACHE_BYTES = metrics.registry.gauge(
+    "notypdf_storage_cache_bytes",
+    "Bytes of documents held in the local read-through cache",
+)
+
+
+class StorageError(Exception):
+    pass
+
+
+class Entry(NamedTuple):
+    """A document or folder; key is its path relative to the workspace, with / separators"""
+
+    key: str
+    size: int
+    mtime: float
+    is_dir: bool = False
+
+    @property
+    def name(self) -> str:
+        return self.key.rstrip("/").rsplit("/", 1)[-1]
+
+
+def _check_key(key: str) -> str:
+    key = key.strip("/")
+    if any(part in (".", "..") for part in key.split("/")) or "\\" in key or "\0" in key:
+        raise ValueError("Invalid path")
+    return key
+
+
+class _Tee:
+    """Readable stream that also writes everything read from it to a file"""
+
+    def __init__(self, source: IO[bytes], copy: IO[bytes]):
+        self.source = source
+        self.copy = copy
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.source.read(size)
+        if data:
+            self.copy.write(data)
+        return data
+
+
+def _read_full(stream: IO[bytes], size: int) -> bytes:
+    """Up to size bytes, reading until the stream ends; request streams return short reads"""
+    parts = []
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        parts.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(parts)
+
+
+def _move_artifacts(src: str, dst: str) -> None:
+    """Move the Markdown and translations of a PDF path to another PDF path"""
+    src_base = os.path.splitext(src)[0]
+    for path in artifacts.artifact_paths(src):
+        target = os.path.splitext(dst)[0] + path[len(src_base):]
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        file_operations.transfer(path, target)
+
+
+def _remove_artifacts(pdf_path: str) -> None:
+    for path in artifacts.artifact_paths(pdf_path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.error(f"Error deleting artifact {os.path.basename(path)}: {e}")
+
+
+class LocalStorage:
+    """Documents in a folder of the local filesystem, the workspace itself"""
+
+    name = "local"
+    is_local = True
+
+    def __init__(self, root: str):
+        # Folder holding documents and, next to each PDF, its artifacts
+        self.local_root = root
+
+    def path(self, key: str) -> str:
+        """Local path of a document and, next to it, its artifacts"""
+        key = _check_key(key)
+        return os.path.join(self.local_root, *key.split("/")) if key else self.local_root
+
+    def _entry(self, key: str, stat: os.stat_result, is_dir: bool) -> Entry:
+        return Entry(key, 0 if is_dir else stat.st_size, stat.st_mtime, is_dir)
+
+    def list(self, prefix: str = "") -> List[Entry]:
+        """Documents and folders directly inside a folder"""
+        prefix = _check_key(prefix)
+        directory = self.path(prefix)
+        entries = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append(self._entry(f"{prefix}/{name}".lstrip("/"), stat, os.path.isdir(path)))
+        return entries
+
+    def folders(self, exclude: str = "") -> List[str]:
+        """Every folder below the root, except those under exclude and batch trash"""
+        found = []
+        excluded = self.path(exclude) if exclude else None
+        for dirpath, dirnames, _ in os.walk(self.local_root):
+            if excluded and (dirpath == excluded or dirpath.startswith(excluded + os.sep)):
+                continue
+            dirnames[:] = [name for name in dirnames if not file_operations.is_trash(name)]
+            rel_dir = os.path.relpath(dirpath, self.local_root)
+            if rel_dir != ".":
+                found.append(rel_dir.replace(os.sep, "/"))
+        return found
+
+    def walk(self) -> Iterator[Entry]:
+        """Every document below the root, without artifacts, batch trash or in-flight writes"""
+        for dirpath, dirnames, filenames in os.walk(self.local_root):
+            dirnames[:] = [name for name in dirnames if not file_operations.is_trash(name)]
+            for filename in filenames:
+                if artifacts.is_sidecar(filename) or filename.endswith(".partial"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                key = os.path.relpath(path, self.local_root).replace(os.sep, "/")
+                yield self._entry(key, stat, False)
+
+    def stat(self, key: str) -> Optional[Entry]:
+        path = self.path(key)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return self._entry(_check_key(key), stat, os.path.isdir(path))
+
+    def open_range(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Bytes start..end of a document, end inclusive"""
+        with open(self.path(key), "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(_CHUNK_SIZE if remaining is None else min(_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def put_stream(self, key: str, stream: IO[bytes], keep_copy: bool = False) -> Entry:
+        """Store a document from a stream, publishing it only once complete; it is always local, so keep_copy changes nothing"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.partial"
+        try:
+            with open(tmp_path, "wb") as f:
+                shutil.copyfileobj(stream, f, _CHUNK_SIZE)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return self.stat(key)
+
+    def make_folder(self, key: str) -> None:
+        os.makedirs(self.path(key), exist_ok=True)
+
+    def move(self, src: str, dst: str) -> None:
+        """Move a document with its artifacts"""
+        target = self.path(dst)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        file_operations.move_with_sidecars(self.path(src), target)
+
+    def delete(self, key: str) -> None:
+        """Delete a folder with everything in it, or a document with its artifacts"""
+        path = self.path(key)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+            return
+        os.remove(path)
+        if path.lower().endswith(".pdf"):
+            _remove_artifacts(path)
+
+    def local_path(self, key: str) -> str:
+        """Path of the document on the local filesystem"""
+        return self.path(key)
+
+    def cached_path(self, key: str) -> Optional[str]:
+        """Local path of the document if it can be read without fetching it"""
+        path = self.path(key)
+        return path if os.path.isfile(path) else None
+
+    def status(self) -> Dict[str, object]:
+        return {"backend": self.name, "root": self.local_root}
+
+
+class S3Storage:
+    """Documents as objects in an S3-compatible bucket, signed with AWS Signature Version 4.
+
+    Converters and the Markdown and translation artifacts need files, so
+    local_path() copies a document into a local cache that mirrors the key
+    layout; artifacts are written next to the copy and kept when the copy is
+    evicted. Ranged reads of a document that is not cached go to the bucket,
+    and a document read often enough is copied into the cache in the
+    background. The cache keeps at most STORAGE_CACHE_MAX_BYTES of documents,
+    dropping the least recently used.
+    """
+
+    name = "s3"
+    is_local = False
+
+    def __init__(self, endpoint: str, bucket: str, access_key: str, secret_key: str, region: str = "us-east-1", prefix: str = "", cache_dir: str = STORAGE_CACHE_DIR, cache_max_bytes: int = STORAGE_CACHE_MAX_BYTES):
+        if not bucket:
+            raise StorageError("S3_BUCKET is required for the s3 storage backend")
+        parsed = urlparse(endpoint)
+        self.endpoint = f"{parsed.scheme}://{parsed.netloc}"
+        self.host = parsed.netloc
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = f"{prefix.strip('/')}/" if prefix.strip("/") else ""
+        self.local_root = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        self.session = requests.Session()
+        self._cached: "OrderedDict[str, int]" = OrderedDict()
+        self._validated: Dict[str, float] = {}
+        self._reads: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._downloads = SingleFlight("storage_download")
+        self._background = ThreadPoolExecutor(max_workers=2, thread_name_prefix="storage-cache")
+        self._scan_cache()
+
+    # Requests
+
+    def _signed_headers(self, method: str, path: str, query: str, headers: Dict[str, str], payload_hash: str) -> Dict[str, str]:
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date = amz_date[:8]
+        headers = {key.lower(): str(value).strip() for key, value in headers.items()}
+        headers.update({"host": self.host, "x-amz-date": amz_date, "x-amz-content-sha256": payload_hash})
+        signed = sorted(headers)
+        canonical = "\n".join([
+            method, path, query,
+            "".join(f"{name}:{headers[name]}\n" for name in signed),
+            ";".join(signed), payload_hash,
+        ])
+        scope = f"{date}/{self.region}/s3/aws4_request"
+        to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical.encode("utf-8")).hexdigest()])
+        key = f"AWS4{self.secret_key}".encode("utf-8")
+        for part in (date, self.region, "s3", "aws4_request"):
+            key = hmac.new(key, part.encode("utf-8"), hashlib.sha256).digest()
+        signature = hmac.new(key, to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+        headers["authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, SignedHeaders={';'.join(signed)}, Signature={signature}"
+        )
+        del headers["host"]
+        return headers
+
+    def _request(self, operation: str, method: str, key: Optional[str] = None, params: Optional[Dict[str, str]] = None,
+                 headers: Optional[Dict[str, str]] = None, data: bytes = b"", stream: bool = False, ok: Tuple[int, ...] = (200,)) -> requests.Response:
+        path = f"/{self.bucket}"
+        if key is not None:
+            path += "/" + quote(self.prefix + key, safe="/-_.~")
+        query = "&".join(f"{quote(name, safe='-_.~')}={quote(value, safe='-_.~')}" for name, value in sorted((params or {}).items()))
+        payload_hash = hashlib.sha256(data).hexdigest() if data else _EMPTY_SHA256
+        signed = self._signed_headers(method, path, query, headers or {}, payload_hash)
+        url = f"{self.endpoint}{path}" + (f"?{query}" if query else "")
+        start = time.perf_counter()
+        response = self.session.request(method, url, headers=signed, data=data or None, stream=stream, timeout=(10, 300))
+        STORAGE_REQUESTS.labels(operation).observe(time.perf_counter() - start)
+        if response.status_code not in ok:
+            message = response.text[:300] if not stream else ""
+            response.close()
+            raise StorageError(f"S3 {operation} of {key or self.bucket} failed with {response.status_code}: {message}")
+        return response
+
+    def _object_entry(self, key: str, headers: Dict[str, str]) -> Entry:
+        modified = headers.get("Last-Modified")
+        mtime = parsedate_to_datetime(modified).timestamp() if modified else time.time()
+        return Entry(key, int(headers.get("Content-Length", 0)), mtime)
+
+    # Listing
+
+    def _list_objects(self, prefix: str, delimiter: Optional[str]) -> Iterator[Tuple[str, object]]:
+        """("file", Entry) and ("folder", key) items below a key prefix"""
+        params = {"list-type": "2", "prefix": self.prefix + prefix}
+        if delimiter:
+            params["delimiter"] = delimiter
+        while True:
+            root = ElementTree.fromstring(self._request("list", "GET", params=params).content)
+            for item in root.findall(f"{_S3_NS}Contents"):
+                key = item.findtext(f"{_S3_NS}Key")[len(self.prefix):]
+                modified = datetime.fromisoformat(item.findtext(f"{_S3_NS}LastModified").replace("Z", "+00:00")).timestamp()
+                yield "file", Entry(key, int(item.findtext(f"{_S3_NS}Size") or 0), modified)
+            for item in root.findall(f"{_S3_NS}CommonPrefixes"):
+                yield "folder", item.findtext(f"{_S3_NS}Prefix")[len(self.prefix):]
+            token = root.findtext(f"{_S3_NS}NextContinuationToken")
+            if root.findtext(f"{_S3_NS}IsTruncated") != "true" or not token:
+                return
+            params["continuation-token"] = token
+
+    def list(self, prefix: str = "") -> List[Entry]:
+        prefix = _check_key(prefix)
+        folder = f"{prefix}/" if prefix else ""
+        entries = []
+        for kind, item in self._list_objects(folder, "/"):
+            if kind == "folder":
+                entries.append(Entry(item.rstrip("/"), 0, time.time(), True))
+            elif item.key != folder and not item.key.endswith("/"):
+                entries.append(item)
+        if prefix and not entries and self.stat(prefix) is None:
+            raise FileNotFoundError(prefix)
+        return entries
+
+    def folders(self, exclude: str = "") -> List[str]:
+        found = set()
+        excluded = f"{exclude}/" if exclude else None
+        for _, entry in self._list_objects("", None):
+            key = entry.key
+            if excluded and (key.startswith(excluded) or key == excluded):
+                continue
+            parts = key.rstrip("/").split("/")
+            depth = len(parts) if key.endswith("/") else len(parts) - 1
+            for index in range(1, depth + 1):
+                found.add("/".join(parts[:index]))
+        return sorted(found)
+
+    def walk(self) -> Iterator[Entry]:
+        """Every document in the bucket below the prefix"""
+        for kind, entry in self._list_objects("", None):
+            if kind == "file" and not entry.key.endswith("/"):
+                yield entry
+
+    def stat(self, key: str) -> Optional[Entry]:
+        key = _check_key(key)
+        if not key:
+            return Entry("", 0, time.time(), True)
+        response = self._request("stat", "HEAD", key, ok=(200, 404))
+        if response.status_code == 200:
+            return self._object_entry(key, response.headers)
+        # A folder is a marker object or a prefix with objects under it
+        for _ in self._list_objects(f"{key}/", "/"):
+            return Entry(key, 0, time.time(), True)
+        return None
+
+    # Reading
+
+    def path(self, key: str) -> str:
+        """Where the cached copy of a document and its artifacts live, whether or not it is cached"""
+        return os.path.join(self.local_root, *_check_key(key).split("/"))
+
+    def _fresh_copy(self, key: str) -> Optional[str]:
+        """The cached copy of a document if it is still current, revalidating it now and then"""
+        path = self.path(key)
+        if not os.path.isfile(path):
+            return None
+        with self._lock:
+            validated = self._validated.get(key, 0.0)
+        if time.monotonic() - validated > STORAGE_CACHE_REVALIDATE_SECONDS:
+            entry = self.stat(key)
+            stat = os.stat(path)
+            if entry is None or entry.size != stat.st_size or int(entry.mtime) != int(stat.st_mtime):
+                self._drop(key)
+                return None
+            with self._lock:
+                self._validated[key] = time.monotonic()
+        with self._lock:
+            if key in self._cached:
+                self._cached.move_to_end(key)
+        return path
+
+    def open_range(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        key = _check_key(key)
+        path = self._fresh_copy(key)
+        if path is not None:
+            STORAGE_CACHE_READS.labels("hit").inc()
+            return LocalStorage(self.local_root).open_range(key, start, end)
+        STORAGE_CACHE_READS.labels("miss").inc()
+        with self._lock:
+            reads = self._reads[key] = self._reads.get(key, 0) + 1
+        if reads >= STORAGE_CACHE_HOT_READS:
+            self._background.submit(self._fetch_quietly, key)
+        byte_range = f"bytes={start}-" + ("" if end is None else str(end))
+        response = self._request("get", "GET", key, headers={"Range": byte_range}, stream=True, ok=(200, 206))
+        return self._iterate(response)
+
+    @staticmethod
+    def _iterate(response: requests.Response) -> Iterator[bytes]:
+        try:
+            yield from response.iter_content(_CHUNK_SIZE)
+        finally:
+            response.close()
+
+    def _fetch_quietly(self, key: str) -> None:
+        try:
+            self.local_path(key)
+        except Exception as e:
+            logger.warning(f"Could not cache {key}: {str(e)}")
+
+    def local_path(self, key: str) -> str:
+        """Path of a local copy of the document, downloading it on a miss"""
+        key = _check_key(key)
+        path = self._fresh_copy(key)
+        if path is None:
+            self._downloads.do(key, lambda: self._download(key))
+            path = self.path(key)
+        return path
+
+    def cached_path(self, key: str) -> Optional[str]:
+        """Path of the cached copy of the document if there is a current one"""
+        return self._fresh_copy(_check_key(key))
+
+    def _download(self, key: str) -> None:
+        if self._fresh_copy(key) is not None:
+            return
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.partial"
+        response = self._request("download", "GET", key, stream=True)
+        try:
+            entry = self._object_entry(key, response.headers)
+            with open(tmp_path, "wb") as f:
+                for chunk in response.iter_content(_CHUNK_SIZE):
+                    f.write(chunk)
+            os.utime(tmp_path, (entry.mtime, entry.mtime))
+            os.replace(tmp_path, path)
+        finally:
+            response.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        with self._lock:
+            self._cached[key] = entry.size
+            self._cached.move_to_end(key)
+            self._validated[key] = time.monotonic()
+            self._reads.pop(key, None)
+        self._evict()
+
+    def _scan_cache(self) -> None:
+        """Index copies left by an earlier run, oldest first; they are revalidated before use"""
+        found = []
+        for dirpath, _, filenames in os.walk(self.local_root):
+            for filename in filenames:
+                if artifacts.is_sidecar(filename) or filename.endswith(".partial"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                stat = os.stat(path)
+                key = os.path.relpath(path, self.local_root).replace(os.sep, "/")
+                found.append((stat.st_atime, key, stat.st_size))
+        for _, key, size in sorted(found):
+            self._cached[key] = size
+        STORAGE_CACHE_BYTES.labels().set(sum(self._cached.values()))
+
+    def _evict(self) -> None:
+        with self._lock:
+            victims = []
+            total = sum(self._cached.values())
+            while total > self.cache_max_bytes and len(self._cached) > 1:
+                key, size = self._cached.popitem(last=False)
+                self._validated.pop(key, None)
+                victims.append(key)
+                total -= size
+            STORAGE_CACHE_BYTES.labels().set(total)
+        for key in victims:
+            # Only the copy goes; its Markdown and translations stay
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+            logger.debug(f"Evicted {key} from the storage cache")
+
+    def _drop(self, key: str) -> None:
+        with self._lock:
+            self._cached.pop(key, None)
+            self._validated.pop(key, None)
+            STORAGE_CACHE_BYTES.labels().set(sum(self._cached.values()))
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    # Writing
+
+    def put_stream(self, key: str, stream: IO[bytes], keep_copy: bool = False) -> Entry:
+        """Upload a document from a stream; anything larger than one part goes up as a multipart upload.
+
+        With keep_copy the bytes are also written to the cache on their way
+        up, so work that starts on the upload right away does not download it.
+        """
+        key = _check_key(key)
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.partial"
+        copy = None
+        if keep_copy:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            copy = open(tmp_path, "wb")
+            stream = _Tee(stream, copy)
+        try:
+            first = _read_full(stream, S3_PART_SIZE)
+            if len(first) < S3_PART_SIZE:
+                self._request("put", "PUT", key, data=first)
+            else:
+                self._multipart_upload(key, first, stream)
+            self._drop(key)
+            entry = self.stat(key)
+            if copy is not None and entry is not None:
+                copy.close()
+                # Same mtime as the object, so the copy passes revalidation
+                os.utime(tmp_path, (entry.mtime, entry.mtime))
+                os.replace(tmp_path, path)
+                with self._lock:
+                    self._cached[key] = entry.size
+                    self._cached.move_to_end(key)
+                    self._validated[key] = time.monotonic()
+                self._evict()
+            return entry
+        finally:
+            if copy is not None:
+                copy.close()
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def _multipart_upload(self, key: str, first: bytes, stream: IO[bytes]) -> None:
+        root = ElementTree.fromstring(self._request("multipart_create", "POST", key, params={"uploads": ""}).content)
+        upload_id = root.findtext(f"{_S3_NS}UploadId") or root.findtext("UploadId")
+
+        def upload(number: int, data: bytes) -> Tuple[int, str]:
+            response = self._request("multipart_part", "PUT", key, params={"partNumber": str(number), "uploadId": upload_id}, data=data)
+            return number, response.headers["ETag"]
+
+        parts: List[Tuple[int, str]] = []
+        try:
+            # At most S3_UPLOAD_CONCURRENCY parts are read ahead and in flight, which bounds memory use
+            with ThreadPoolExecutor(max_workers=max(1, S3_UPLOAD_CONCURRENCY)) as pool:
+                pending = []
+                number, data = 1, first
+                while data:
+                    pending.append(pool.submit(upload, number, data))
+                    if len(pending) >= S3_UPLOAD_CONCURRENCY:
+                        parts.append(pending.pop(0).result())
+                    number += 1
+                    data = _read_full(stream, S3_PART_SIZE)
+                parts.extend(future.result() for future in pending)
+            body = "<CompleteMultipartUpload>" + "".join(
+                f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>" for number, etag in sorted(parts)
+            ) + "</CompleteMultipartUpload>"
+            response = self._request("multipart_complete", "POST", key, params={"uploadId": upload_id}, data=body.encode("utf-8"))
+            # Completion can fail after the 200 status has been sent
+            if b"<Error>" in response.content:
+                raise StorageError(f"S3 multipart upload of {key} failed: {response.text[:300]}")
+        except BaseException:
+            try:
+                self._request("multipart_abort", "DELETE", key, params={"uploadId": upload_id}, ok=(200, 204, 404))
+            except Exception as e:
+                logger.warning(f"Could not abort multipart upload of {key}: {str(e)}")
+            raise
+        logger.info(f"Uploaded {key} to S3 in {len(parts)} parts")
+
+    def make_folder(self, key: str) -> None:
+        self._request("put", "PUT", f"{_check_key(key)}/")
+
+    def move(self, src: str, dst: str) -> None:
+        """Copy then delete, since S3 cannot rename; the cached copy and artifacts move along"""
+        src, dst = _check_key(src), _check_key(dst)
+        source = quote(f"/{self.bucket}/{self.prefix}{src}", safe="/-_.~")
+        self._request("copy", "PUT", dst, headers={"x-amz-copy-source": source})
+        self._request("delete", "DELETE", src, ok=(200, 204))
+        with self._lock:
+            size = self._cached.pop(src, None)
+            self._validated.pop(src, None)
+        src_path, dst_path = self.path(src), self.path(dst)
+        if src_path.lower().endswith(".pdf"):
+            _move_artifacts(src_path, dst_path)
+        if size is not None and os.path.isfile(src_path):
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            os.replace(src_path, dst_path)
+            with self._lock:
+                self._cached[dst] = size
+                self._validated[dst] = time.monotonic()
+
+    def delete(self, key: str) -> None:
+        """Delete a folder with everything under it, or a document with its cached copy and artifacts"""
+        key = _check_key(key)
+        response = self._request("stat", "HEAD", key, ok=(200, 404))
+        if response.status_code == 404:
+            keys = [entry.key for _, entry in self._list_objects(f"{key}/", None)]
+            if not keys:
+                raise FileNotFoundError(key)
+            for child in keys:
+                self._request("delete", "DELETE", child, ok=(200, 204))
+                self._drop(child)
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            return
+        self._request("delete", "DELETE", key, ok=(200, 204))
+        self._drop(key)
+        if key.lower().endswith(".pdf"):
+            _remove_artifacts(self.path(key))
+
+    def status(self) -> Dict[str, object]:
+        with self._lock:
+            cached = len(self._cached)
+            cached_bytes = sum(self._cached.values())
+        return {
+            "backend": self.name,
+            "endpoint": self.endpoint,
+            "bucket": self.bucket,
+            "prefix": self.prefix,
+            "cache": {"documents": cached, "bytes": cached_bytes, "max_bytes": self.cache_max_bytes},
+        }
+
+
+def create_storage(workspace: str) -> object:
+    if STORAGE_BACKEND == "local":
+        return LocalStorage(workspace)
+    if STORAGE_BACKEND == "s3":
+        return S3Storage(S3_ENDPOINT_URL, S3_BUCKET, S3_ACCESS_KEY_ID, S3_SECRET_ACCESS_KEY, S3_REGION, S3_PREFIX)
+    raise StorageError(f"Unknown storage backend: {STORAGE_BACKEND}")
@@ -0,0 +1,242 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import queue
+import atexit
+import random
+import logging
+import traceback
+import contextvars
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+from flask import g, request
+
+import metrics
+
+# "json" for one JSON object per line, "text" for the classic human-readable format
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+# Messages and fields longer than this are cut, so one huge payload cannot flood the log
+LOG_MAX_FIELD_LENGTH = int(os.environ.get("LOG_MAX_FIELD_LENGTH", "1000"))
+
+# Records buffered between the request threads and the writer thread; extra records are dropped
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+
+# Share of requests whose info/debug records and access line are kept, e.g. "/files=0.1,/metrics=0".
+# Warnings, errors and failed requests are always kept.
+LOG_SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "/metrics=0,/health/live=0,/health/ready=0")
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+request_id_var: contextvars.ContextVar = contextvars.ContextVar("request_id", default="")
+_sampled_var: contextvars.ContextVar = contextvars.ContextVar("log_sampled", default=True)
+
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+# Secrets that must never reach the log, whatever message they appear in
+REDACTIONS = [
+    (re.compile(r"(Bearer\s+)[A-Za-z0-9._~+/=-]+", re.IGNORECASE), r"\1[REDACTED]"),
+    (re.compile(r"\b(sk-|secret_|ntn_)[A-Za-z0-9_-]{8,}"), r"\1[REDACTED]"),
+    (re.compile(r"\bAIza[A-Za-z0-9_-]{20,}"), "[REDACTED]"),
+    (re.compile(r"([?&](?:key|api_key|token)=)[^&\s\"']+", re.IGNORECASE), r"\1[REDACTED]"),
+    (re.compile(r"(\"(?:api_?key|apiKey|token|password|secret|authorization)\"\s*:\s*\")[^\"]*", re.IGNORECASE), r"\1[REDACTED]"),
+]
+
+LOG_RECORDS_DROPPED = metrics.registry.counter(
+    "notypdf_log_records_dropped_total",
+    "Log records dropped because the logging queue was full",
+)
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+
+def redact(text: str) -> str:
+    for pattern, replacement in REDACTIONS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def truncate(text: str, limit: int = LOG_MAX_FIELD_LENGTH) -> str:
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more chars]"
+
+
+def clean(value: Any) -> Any:
+    """Truncated, redacted copy of a message or field value"""
+    if isinstance(value, str):
+        return redact(truncate(value))
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    return redact(truncate(json.dumps(value, default=str)))
+
+
+def _parse_sample_rates(value: str) -> Dict[str, float]:
+    rates = {}
+    for item in value.split(","):
+        route, _, rate = item.strip().partition("=")
+        if route and rate:
+            rates[route] = float(rate)
+    return rates
+
+
+SAMPLE_RATES = _parse_sample_rates(LOG_SAMPLE_RATES)
+
+
+class ContextFilter(logging.Filter):
+    """Tag records with the current request id and drop unsampled info/debug records"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING and not _sampled_var.get():
+            return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": clean(record.getMessage()),
+        }
+        if getattr(record, "request_id", ""):
+            entry["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = clean(value)
+        if record.exc_text:
+            entry["exception"] = redact(record.exc_text)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(levelname)s:%(name)s:%(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = clean(record.getMessage())
+        if getattr(record, "request_id", ""):
+            text = f"[{record.request_id}] {text}"
+        line = f"{record.levelname}:{record.name}:{text}"
+        if record.exc_text:
+            line += "\n" + redact(record.exc_text)
+        return line
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks the caller, dropping records when the queue is full.
+
+    Only the message is rendered on the calling thread; formatting and writing
+    happen on the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info))
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels().inc()
+
+
+_listener: Optional[QueueListener] = None
+
+
+def configure() -> None:
+    """Route all logging through a bounded queue to a single writer thread"""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+    handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    # One line per upstream HTTP call is noise next to the access log
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def _sample_rate(route: str) -> float:
+    return SAMPLE_RATES.get(route, 1.0)
+
+
+def add_request_id(http_request) -> None:
+    """httpx request hook forwarding the current request id to upstream services"""
+    request_id = request_id_var.get()
+    if request_id:
+        http_request.headers[REQUEST_ID_HEADER] = request_id
+
+
+async def add_request_id_async(http_request) -> None:
+    add_request_id(http_request)
+
+
+def instrument_app(app) -> None:
+    """Assign request ids, decide per-route sampling and write one access line per request"""
+    access_logger = logging.getLogger("access")
+
+    @app.before_request
+    def _start_request_log():
+        incoming = request.headers.get(REQUEST_ID_HEADER, "")
+        request_id = incoming if _REQUEST_ID_RE.match(incoming) else uuid.uuid4().hex
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        g._log_tokens = (request_id_var.set(request_id), _sampled_var.set(random.random() < _sample_rate(route)))
+        g._log_start = time.perf_counter()
+        g._log_route = route
+
+    @app.after_request
+    def _write_access_log(response):
+        request_id = request_id_var.get()
+        if request_id:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        start = g.pop("_log_start", None)
+        if start is not None:
+            if response.status_code >= 400:
+                # Failed requests are always logged, with the records they produced from here on
+                _sampled_var.set(True)
+            if _sampled_var.get():
+                access_logger.log(
+                    logging.WARNING if response.status_code >= 500 else logging.INFO,
+                    f"{request.method} {request.path} {response.status_code}",
+                    extra={
+                        "method": request.method,
+                        "route": g.get("_log_route"),
+                        "status": response.status_code,
+                        "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+                    },
+                )
+        return response
+
+    @app.teardown_request
+    def _reset_request_log(exc):
+        tokens = g.pop("_log_tokens", None)
+        if tokens is not None:
+            request_id_var.reset(tokens[0])
+            _sampled_var.reset(tokens[1])
@@ -1,8 +1,16 @@
 import os
 import json
-import requests
-from typing import Dict, Any, Optional
+import asyncio
+from typing import Dict, Any, List, Optional, Tuple
 import logging
+import metrics
+import profiling
+from translation_engine import engine
+from singleflight import AsyncSingleFlight
+from provider_limits import MAX_RATE_LIMIT_RETRIES, parse_retry_after
+from translation_routing import TRANSLATION_FALLBACKS, parse_routes, routing_policy
+from translation_batching import MicroBatcher
+from translation_memory import MEMORY_ENABLED, Match, scope as memory_scope, split_segments, translation_memory
 
 logger = logging.getLogger(__name__)
 
@@ -13,12 +21,30 @@ DEFAULT_TRANSLATION_PROMPT = (
     "and other formatting. Return only the translated text formatted as markdown.\n\n{{text}}"
 )
 
+# Provider API base URLs, overridable to point at local stand-ins
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1")
+OPENROUTER_BASE_URL = os.environ.get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+GEMINI_BASE_URL = os.environ.get("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+DEEPSEEK_BASE_URL = os.environ.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+
+# Display names used in provider error messages
+PROVIDER_LABELS = {
+    'openai': 'OpenAI',
+    'openrouter': 'OpenRouter',
+    'gemini': 'Gemini',
+    'deepseek': 'DeepSeek'
+}
+
+SYSTEM_PROMPT = "You are a translation assistant. Always format your translations as markdown to preserve structure, paragraph breaks, and titles."
+
 class TranslationService:
     def __init__(self):
         self.openai_api_key = os.environ.get("OPENAI_API_KEY")
         self.openrouter_api_key = os.environ.get("OPENROUTER_API_KEY")
         self.gemini_api_key = os.environ.get("GEMINI_API_KEY")
         self.deepseek_api_key = os.environ.get("DEEPSEEK_API_KEY")
+        self._in_flight = AsyncSingleFlight("translate")
+        self._micro_batcher = MicroBatcher(self._call_prompt, self._call_single)
     
     def get_api_key(self, provider: str) -> Optional[str]:
         """Get API key for the specified provider"""
@@ -30,6 +56,32 @@ class TranslationService:
         }
         return keys.get(provider)
 
+    def provider_status(self) -> Dict[str, Any]:
+        """Circuit breaker state and observed latency of each provider"""
+        return routing_policy.status()
+
+    def warm_up(self) -> None:
+        """Start the engine and open a pooled connection to every provider with a key"""
+        base_urls = {
+            'openai': OPENAI_BASE_URL,
+            'openrouter': OPENROUTER_BASE_URL,
+            'gemini': GEMINI_BASE_URL,
+            'deepseek': DEEPSEEK_BASE_URL
+        }
+
+        async def connect(url: str) -> None:
+            try:
+                await engine.client.head(url)
+            except Exception as e:
+                logger.warning(f"Could not pre-connect to {url}: {str(e) or type(e).__name__}")
+
+        urls = [url for provider, url in base_urls.items() if self.get_api_key(provider)]
+
+        async def connect_all() -> None:
+            await asyncio.gather(*(connect(url) for url in urls))
+
+        engine.run(connect_all())
+
     def _build_prompt(self, template: Optional[str], text: str, target_language: str) -> str:
         prompt_template = template or DEFAULT_TRANSLATION_PROMPT
         prompt = prompt_template.replace("{{text}}", text)
@@ -48,7 +100,8 @@ class TranslationService:
             
             # Test with a simple message
             test_text = "Hello"
-            result = self.translate(text=test_text, provider=provider, model=model, target_language="Spanish")
+            # The memory would answer without reaching the provider
+            result = self.translate(text=test_text, provider=provider, model=model, target_language="Spanish", use_memory=False)
             
             if result.get("success"):
                 return {
@@ -68,184 +121,259 @@ class TranslationService:
                 "message": f"❌ Connection test failed: {str(e)}"
             }
     
-    def translate(self, text: str, provider: str, model: str, target_language: str, prompt_template: Optional[str] = None) -> Dict[str, Any]:
-        """Translate text using the specified provider"""
+    def translate(self, text: str, provider: str, model: str, target_language: str, prompt_template: Optional[str] = None, fallbacks: Any = None, use_memory: bool = True) -> Dict[str, Any]:
+        """Translate text using the specified provider, falling back to other routes if needed"""
+        try:
+            return engine.run(self.translate_async(text, provider, model, target_language, prompt_template, fallbacks, use_memory))
+        except Exception as e:
+            logger.error(f"Translation failed: {str(e)}")
+            return {
+                "success": False,
+                "message": f"Translation failed: {str(e)}"
+            }
+
+    def translate_batch(self, segments: List[str], provider: str, model: str, target_language: str, prompt_template: Optional[str] = None, fallbacks: Any = None) -> List[Dict[str, Any]]:
+        """Translate many segments concurrently, returning results in input order"""
+        return engine.run(self.translate_batch_async(segments, provider, model, target_language, prompt_template, fallbacks))
+
+    async def translate_batch_async(self, segments: List[str], provider: str, model: str, target_language: str, prompt_template: Optional[str] = None, fallbacks: Any = None) -> List[Dict[str, Any]]:
+        return list(await asyncio.gather(*[
+            self.translate_async(segment, provider, model, target_language, prompt_template, fallbacks)
+            for segment in segments
+        ]))
+
+    async def translate_async(self, text: str, provider: str, model: str, target_language: str, prompt_template: Optional[str] = None, fallbacks: Any = None, use_memory: bool = True) -> Dict[str, Any]:
+        """Translate text on the shared event loop, failing over and hedging across routes.
+
+        Identical requests already in flight share one upstream call. Paragraphs
+        found in the translation memory are reused, so only the changed ones of a
+        new edition go to the provider.
+        """
+        routes = tuple(dict.fromkeys([(provider, model)] + parse_routes(fallbacks) + parse_routes(TRANSLATION_FALLBACKS)))
+        if not (MEMORY_ENABLED and use_memory):
+            return await self._translate_segment(text, None, routes, target_language, prompt_template, None)
+
+        scope_key = memory_scope(target_language, prompt_template)
+        parts = split_segments(text)
+        segments = parts[::2]
+        matches = await asyncio.to_thread(translation_memory.lookup, scope_key, [text] + (segments if len(segments) > 1 else []))
+        whole, segment_matches = matches[0], matches[1:]
+        if (whole is not None and whole.reusable) or not any(m is not None and m.reusable for m in segment_matches):
+            return await self._translate_segment(text, whole, routes, target_language, prompt_template, scope_key)
+
+        # Some paragraphs were translated before: only the others go to the provider
+        results = await asyncio.gather(*[
+            self._translate_segment(segment, match, routes, target_language, prompt_template, scope_key)
+            for segment, match in zip(segments, segment_matches)
+        ])
+        failed = next((result for result in results if not result.get("success")), None)
+        if failed is not None:
+            return failed
+        parts[::2] = [result["translated_text"] for result in results]
+        translated_text = "".join(parts)
+        await asyncio.to_thread(translation_memory.store, scope_key, text, translated_text)
+        # Paragraphs reused from the memory have no route; the others name theirs when they all share one
+        used_routes = {(result["provider"], result["model"]) for result in results if result.get("provider")}
+        provider_used, model_used = used_routes.pop() if len(used_routes) == 1 else (None, None)
+        return {
+            "success": True,
+            "translated_text": translated_text,
+            "provider": provider_used,
+            "model": model_used,
+            "memory": {
+                "segments": len(segments),
+                "reused": sum(1 for result in results if result.get("memory", {}).get("reused")),
+            },
+        }
+
+    async def _translate_segment(self, text: str, match: Optional[Match], routes: Tuple[Tuple[str, str], ...], target_language: str, prompt_template: Optional[str], scope_key: Optional[str]) -> Dict[str, Any]:
+        """Reuse a memory match good enough to stand in for the translation, else ask the provider with the match as an example"""
+        if not text.strip():
+            return {"success": True, "translated_text": text}
+        if match is not None and match.reusable:
+            return {"success": True, "translated_text": match.target, "memory": {"reused": True, "score": match.score}}
+
+        examples = [match] if match is not None else []
+        key = (routes, target_language.strip().lower(), prompt_template or DEFAULT_TRANSLATION_PROMPT, text)
+
+        async def call(route_provider: str, route_model: str) -> Tuple[Dict[str, Any], bool]:
+            # Short texts may share one upstream request with others arriving at the same time
+            if not examples and self._micro_batcher.accepts(text, prompt_template, DEFAULT_TRANSLATION_PROMPT):
+                return await self._micro_batcher.translate(text, route_provider, route_model, target_language)
+            return await self._call_provider(text, route_provider, route_model, target_language, prompt_template, examples)
+
+        result = dict(await self._in_flight.do(key, lambda: routing_policy.execute(call, list(routes))))
+        if scope_key and result.get("success"):
+            await asyncio.to_thread(translation_memory.store, scope_key, text, result["translated_text"])
+        if examples:
+            result["memory"] = {"reused": False, "score": match.score}
+        return result
+
+    async def _call_prompt(self, prompt: str, provider: str, model: str) -> Tuple[Dict[str, Any], bool]:
+        """Send a prompt that is already complete, such as a micro-batch of segments"""
+        return await self._call_provider(prompt, provider, model, "", "{{text}}")
+
+    async def _call_single(self, text: str, provider: str, model: str, target_language: str) -> Tuple[Dict[str, Any], bool]:
+        return await self._call_provider(text, provider, model, target_language, None)
+
+    async def _call_provider(self, text: str, provider: str, model: str, target_language: str, prompt_template: Optional[str], examples: List[Match] = ()) -> Tuple[Dict[str, Any], bool]:
+        """Send one translation request through the provider's priority queue and adaptive limiter.
+
+        Requests answered with 429 are queued again after Retry-After (or a jittered
+        backoff). Returns the result and whether a failure reflects provider health
+        (5xx, 429, network errors) rather than a problem with the request itself.
+        """
         try:
             api_key = self.get_api_key(provider)
             if not api_key:
                 return {
                     "success": False,
                     "message": f"No API key configured for {provider}"
-                }
-            
-            if provider == 'openai':
-                return self._translate_openai(text, model, target_language, api_key, prompt_template)
-            elif provider == 'openrouter':
-                return self._translate_openrouter(text, model, target_language, api_key, prompt_template)
-            elif provider == 'gemini':
-                return self._translate_gemini(text, model, target_language, api_key, prompt_template)
-            elif provider == 'deepseek':
-                return self._translate_deepseek(text, model, target_language, api_key, prompt_template)
-            else:
+                }, False
+            if provider not in PROVIDER_LABELS:
                 return {
                     "success": False,
                     "message": f"Unsupported provider: {provider}"
-                }
-                
+                }, False
+
+            url, headers, data = self._build_request(provider, text, model, target_language, api_key, prompt_template, examples)
+            limiter = engine.limiter(provider, api_key)
+            # Rough token estimate: prompt plus a translation of similar length
+            estimated_tokens = len(json.dumps(data)) / 2
+
+            for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+                async with limiter.queue.slot_async():
+                    await limiter.acquire(estimated_tokens)
+                    response = None
+                    try:
+                        with profiling.span("upstream", provider=provider, model=model, operation="translate"), \
+                                metrics.track_upstream(provider, model, "translate") as outcome:
+                            response = await engine.client.post(url, headers=headers, json=data)
+                            result = self._parse_response(provider, response.status_code, response.text)
+                            if not result.get("success"):
+                                outcome.fail()
+                    finally:
+                        status_code = response.status_code if response is not None else None
+                        retry_after = parse_retry_after(response.headers.get("Retry-After")) if response is not None else None
+                        correction = 0.0
+                        if status_code == 200 and limiter.tokens.capacity:
+                            used = self._usage_tokens(response.text)
+                            correction = used - estimated_tokens if used else 0.0
+                        await limiter.release(status_code, retry_after, correction, attempt)
+                if response.status_code != 429:
+                    break
+                logger.warning(f"{PROVIDER_LABELS[provider]} returned 429, retry {attempt + 1} of {MAX_RATE_LIMIT_RETRIES}")
+
+            # A translation cut off at the token limit says nothing about the provider's health
+            health_failure = response.status_code == 429 or response.status_code >= 500 or (response.status_code == 200 and not result.get("truncated"))
+            return result, not result.get("success") and health_failure
+
         except Exception as e:
-            logger.error(f"Translation failed: {str(e)}")
+            error = str(e) or type(e).__name__
+            logger.error(f"Translation failed: {error}")
             return {
                 "success": False,
-                "message": f"Translation failed: {str(e)}"
-            }
-    
-    def _translate_openai(self, text: str, model: str, target_language: str, api_key: str, prompt_template: Optional[str]) -> Dict[str, Any]:
-        """Translate using OpenAI API"""
-        url = "https://api.openai.com/v1/chat/completions"
+                "message": f"Translation failed: {error}"
+            }, True
+
+    def _build_request(self, provider: str, text: str, model: str, target_language: str, api_key: str, prompt_template: Optional[str], examples: List[Match] = ()) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+        """Return the URL, headers and JSON body of a provider translation request.
+
+        Close matches from the translation memory are sent as earlier turns of
+        the conversation, so the model keeps their wording and terminology.
+        """
         prompt = self._build_prompt(prompt_template, text, target_language)
-        
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "model": model,
-            "messages": [
-                {"role": "system", "content": "You are a translation assistant. Always format your translations as markdown to preserve structure, paragraph breaks, and titles."},
-                {"role": "user", "content": prompt}
-            ],
-            "max_tokens": 2048,
-            "temperature": 0.2
-        }
-        
-        response = requests.post(url, headers=headers, json=data, timeout=30)
-        
-        if response.status_code == 200:
-            result = response.json()
-            if result.get("choices") and result["choices"][0].get("message"):
-                return {
-                    "success": True,
-                    "translated_text": result["choices"][0]["message"]["content"].strip()
+        turns = []
+        for example in examples:
+            turns.append(("user", self._build_prompt(prompt_template, example.source, target_language)))
+            turns.append(("assistant", example.target))
+
+        if provider == 'gemini':
+            url = f"{GEMINI_BASE_URL}/models/{model}:generateContent?key={api_key}"
+            headers = {
+                "Content-Type": "application/json"
+            }
+            data = {
+                "contents": [
+                    {
+                        "role": "model" if role == "assistant" else role,
+                        "parts": [{"text": content}]
+                    }
+                    for role, content in turns + [("user", prompt)]
+                ],
+                "generationConfig": {
+                    "temperature": 0.2,
+                    "maxOutputTokens": 2048
+                },
+                "systemInstruction": {
+                    "parts": [{"text": SYSTEM_PROMPT}]
                 }
-        
-        return {
-            "success": False,
-            "message": f"OpenAI API error: {response.status_code} - {response.text}"
+            }
+            return url, headers, data
+
+        # OpenAI, OpenRouter and DeepSeek share the chat completions format
+        base_urls = {
+            'openai': OPENAI_BASE_URL,
+            'openrouter': OPENROUTER_BASE_URL,
+            'deepseek': DEEPSEEK_BASE_URL
         }
-    
-    def _translate_openrouter(self, text: str, model: str, target_language: str, api_key: str, prompt_template: Optional[str]) -> Dict[str, Any]:
-        """Translate using OpenRouter API"""
-        url = "https://openrouter.ai/api/v1/chat/completions"
-        prompt = self._build_prompt(prompt_template, text, target_language)
-        
+        url = f"{base_urls[provider]}/chat/completions"
         headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
-        
         data = {
             "model": model,
-            "messages": [
-                {"role": "system", "content": "You are a translation assistant. Always format your translations as markdown to preserve structure, paragraph breaks, and titles."},
-                {"role": "user", "content": prompt}
+            "messages": [{"role": "system", "content": SYSTEM_PROMPT}] + [
+                {"role": role, "content": content}
+                for role, content in turns + [("user", prompt)]
             ],
             "max_tokens": 2048,
             "temperature": 0.2
         }
-        
-        response = requests.post(url, headers=headers, json=data, timeout=30)
-        
-        if response.status_code == 200:
-            result = response.json()
-            if result.get("choices") and result["choices"][0].get("message"):
-                return {
-                    "success": True,
-                    "translated_text": result["choices"][0]["message"]["content"].strip()
-                }
-        
-        return {
-            "success": False,
-            "message": f"OpenRouter API error: {response.status_code} - {response.text}"
-        }
-    
-    def _translate_gemini(self, text: str, model: str, target_language: str, api_key: str, prompt_template: Optional[str]) -> Dict[str, Any]:
-        """Translate using Gemini API"""
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
-        prompt = self._build_prompt(prompt_template, text, target_language)
-        
-        headers = {
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "contents": [
-                {
-                    "role": "user",
-                    "parts": [{"text": prompt}]
-                }
-            ],
-            "generationConfig": {
-                "temperature": 0.2,
-                "maxOutputTokens": 2048
-            },
-            "systemInstruction": {
-                "parts": [{"text": "You are a translation assistant. Always format your translations as markdown to preserve structure, paragraph breaks, and titles."}]
-            }
-        }
-        
-        response = requests.post(url, headers=headers, json=data, timeout=30)
-        
-        if response.status_code == 200:
-            result = response.json()
-            if (result.get("candidates") and 
-                result["candidates"][0].get("content") and 
-                result["candidates"][0]["content"].get("parts") and
-                result["candidates"][0]["content"]["parts"][0].get("text")):
+        return url, headers, data
+
+    def _parse_response(self, provider: str, status_code: int, body: str) -> Dict[str, Any]:
+        """Extract the translated text from a provider response; one cut off at the token limit is a failure"""
+        if status_code == 200:
+            result = json.loads(body)
+            first = (result.get("candidates") or result.get("choices") or [{}])[0]
+            if first.get("finishReason") == "MAX_TOKENS" or first.get("finish_reason") == "length":
                 return {
-                    "success": True,
-                    "translated_text": result["candidates"][0]["content"]["parts"][0]["text"].strip()
+                    "success": False,
+                    "truncated": True,
+                    "message": f"{PROVIDER_LABELS[provider]} stopped at the output token limit before the translation was complete"
                 }
-        
-        return {
-            "success": False,
-            "message": f"Gemini API error: {response.status_code} - {response.text}"
-        }
-    
-    def _translate_deepseek(self, text: str, model: str, target_language: str, api_key: str, prompt_template: Optional[str]) -> Dict[str, Any]:
-        """Translate using DeepSeek API"""
-        url = "https://api.deepseek.com/chat/completions"
-        prompt = self._build_prompt(prompt_template, text, target_language)
-        
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "model": model,
-            "messages": [
-                {"role": "system", "content": "You are a translation assistant. Always format your translations as markdown to preserve structure, paragraph breaks, and titles."},
-                {"role": "user", "content": prompt}
-            ],
-            "max_tokens": 2048,
-            "temperature": 0.2
-        }
-        
-        response = requests.post(url, headers=headers, json=data, timeout=30)
-        
-        if response.status_code == 200:
-            result = response.json()
-            if result.get("choices") and result["choices"][0].get("message"):
+            if provider == 'gemini':
+                if (result.get("candidates") and
+                    result["candidates"][0].get("content") and
+                    result["candidates"][0]["content"].get("parts") and
+                    result["candidates"][0]["content"]["parts"][0].get("text")):
+                    return {
+                        "success": True,
+                        "translated_text": result["candidates"][0]["content"]["parts"][0]["text"].strip()
+                    }
+            elif result.get("choices") and result["choices"][0].get("message"):
                 return {
                     "success": True,
                     "translated_text": result["choices"][0]["message"]["content"].strip()
                 }
-        
+
         return {
             "success": False,
-            "message": f"DeepSeek API error: {response.status_code} - {response.text}"
+            "message": f"{PROVIDER_LABELS[provider]} API error: {status_code} - {body}"
         }
 
+    def _usage_tokens(self, body: str) -> int:
+        """Total tokens reported by the provider, or 0 when the response has no usage block"""
+        try:
+            result = json.loads(body)
+        except ValueError:
+            return 0
+        usage = result.get("usage") or {}
+        if usage.get("total_tokens"):
+            return int(usage["total_tokens"])
+        return int((result.get("usageMetadata") or {}).get("totalTokenCount") or 0)
+
 # Global translation service instance
 translation_service = TranslationService()
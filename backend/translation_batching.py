@@ -0,0 +1,164 @@
+import os
+import re
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import metrics
+import scheduler
+
+logger = logging.getLogger(__name__)
+
+# Pack short translation requests that arrive together into one multi-segment prompt
+MICRO_BATCH_ENABLED = os.environ.get("TRANSLATION_MICRO_BATCH", "false").lower() in ("1", "true", "yes")
+
+# How long the first request of a batch waits for company, in milliseconds
+MICRO_BATCH_WINDOW_MS = float(os.environ.get("TRANSLATION_MICRO_BATCH_WINDOW_MS", "25"))
+
+# Limits of one batch, and the longest text that is batched at all
+MICRO_BATCH_MAX_SEGMENTS = int(os.environ.get("TRANSLATION_MICRO_BATCH_MAX_SEGMENTS", "16"))
+MICRO_BATCH_MAX_CHARS = int(os.environ.get("TRANSLATION_MICRO_BATCH_MAX_CHARS", "3000"))
+MICRO_BATCH_MAX_SEGMENT_CHARS = int(os.environ.get("TRANSLATION_MICRO_BATCH_MAX_SEGMENT_CHARS", "500"))
+
+MARKER = "<<<{}>>>"
+_MARKER_RE = re.compile(r"^[ \t]*<<<(\d+)>>>[ \t]*$", re.MULTILINE)
+
+BATCH_PROMPT = (
+    "Translate each of the following {count} segments to {target_language}. "
+    "Format each translation as markdown, preserving paragraph breaks, titles, and other formatting. "
+    "Return exactly {count} translations in the same order. Put each segment's marker "
+    "(<<<1>>>, <<<2>>>, ...) alone on the line before its translation, and write nothing else.\n\n{segments}"
+)
+
+TRANSLATION_MICRO_BATCH_SIZE = metrics.registry.histogram(
+    "notypdf_translation_micro_batch_size",
+    "Segments packed into one upstream translation request",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+TRANSLATION_MICRO_BATCH_SPLITS = metrics.registry.counter(
+    "notypdf_translation_micro_batch_splits_total",
+    "Micro-batches split in half because the answer could not be parsed back into segments",
+)
+
+# Result of one provider call: the result dict and whether a failure reflects provider health
+CallResult = Tuple[Dict[str, Any], bool]
+
+
+def build_batch_prompt(segments: List[str], target_language: str) -> str:
+    body = "\n".join(f"{MARKER.format(index)}\n{text.strip()}" for index, text in enumerate(segments, 1))
+    return BATCH_PROMPT.format(count=len(segments), target_language=target_language, segments=body)
+
+
+def parse_batch_answer(answer: str, count: int) -> Optional[List[str]]:
+    """Translations in segment order, or None unless every marker appears once with text after it"""
+    pieces = _MARKER_RE.split(answer)
+    if pieces[0].strip() or len(pieces) != 2 * count + 1:
+        return None
+    translations = []
+    for position, index in enumerate(range(1, len(pieces), 2), 1):
+        text = pieces[index + 1].strip()
+        if int(pieces[index]) != position or not text:
+            return None
+        translations.append(text)
+    return translations
+
+
+def _shared_failure(result: Dict[str, Any], health_failure: bool, count: int) -> List[CallResult]:
+    """One failed upstream request answering several callers counts once against the provider's health"""
+    return [(result, health_failure)] + [(result, False)] * (count - 1)
+
+
+class _Batch:
+    __slots__ = ("items", "chars", "sent")
+
+    def __init__(self):
+        self.items: List[Tuple[str, str, asyncio.Future]] = []
+        self.chars = 0
+        self.sent = False
+
+
+class MicroBatcher:
+    """Collects short translations per provider, model and language for a brief window.
+
+    A batch is sent when the window closes or it is full. The answer is split
+    back per segment; if it cannot be parsed, each half of the batch is tried
+    on its own, down to single segments sent with the normal prompt. A
+    provider failure fails the whole batch without splitting, so an outage
+    does not multiply requests, and counts once toward the circuit breaker. Must only be used from the engine's loop.
+    """
+
+    def __init__(self, send_batch: Callable[[str, str, str], Awaitable[CallResult]], send_single: Callable[[str, str, str, str], Awaitable[CallResult]]):
+        # send_batch(prompt, provider, model) sends a finished prompt as is;
+        # send_single(text, provider, model, target_language) uses the normal prompt
+        self._send_batch = send_batch
+        self._send_single = send_single
+        self._open: Dict[Tuple[str, str, str], _Batch] = {}
+
+    @staticmethod
+    def accepts(text: str, prompt_template: Optional[str], default_prompt: str) -> bool:
+        """Only short texts using the default prompt can share one"""
+        return (
+            MICRO_BATCH_ENABLED
+            and (prompt_template or default_prompt) == default_prompt
+            and len(text) <= MICRO_BATCH_MAX_SEGMENT_CHARS
+            and "<<<" not in text
+        )
+
+    async def translate(self, text: str, provider: str, model: str, target_language: str) -> CallResult:
+        loop = asyncio.get_running_loop()
+        key = (provider, model, target_language)
+        batch = self._open.get(key)
+        if batch is None:
+            batch = _Batch()
+            self._open[key] = batch
+            loop.call_later(MICRO_BATCH_WINDOW_MS / 1000, self._flush, key, batch)
+        future = loop.create_future()
+        batch.items.append((text, scheduler.current().priority, future))
+        batch.chars += len(text)
+        if len(batch.items) >= MICRO_BATCH_MAX_SEGMENTS or batch.chars >= MICRO_BATCH_MAX_CHARS:
+            self._flush(key, batch)
+        return await future
+
+    def _flush(self, key: Tuple[str, str, str], batch: _Batch) -> None:
+        if self._open.get(key) is batch:
+            del self._open[key]
+        if batch.sent:
+            return
+        batch.sent = True
+        provider, model, target_language = key
+        # The batch goes out with the most urgent class of the requests it carries
+        priority = min((item[1] for item in batch.items), key=scheduler.PRIORITIES.index)
+        with scheduler.work(priority=priority):
+            asyncio.get_running_loop().create_task(self._send(batch.items, provider, model, target_language))
+
+    async def _send(self, items: List[Tuple[str, str, asyncio.Future]], provider: str, model: str, target_language: str) -> None:
+        futures = [future for _, _, future in items]
+        try:
+            results = await self._translate_items([text for text, _, _ in items], provider, model, target_language)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            results = _shared_failure({"success": False, "message": f"Translation failed: {error}"}, True, len(items))
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _translate_items(self, texts: List[str], provider: str, model: str, target_language: str) -> List[CallResult]:
+        if len(texts) == 1:
+            return [await self._send_single(texts[0], provider, model, target_language)]
+
+        TRANSLATION_MICRO_BATCH_SIZE.labels().observe(len(texts))
+        result, health_failure = await self._send_batch(build_batch_prompt(texts, target_language), provider, model)
+        if not result.get("success"):
+            return _shared_failure(result, health_failure, len(texts))
+        translations = parse_batch_answer(result["translated_text"], len(texts))
+        if translations is not None:
+            return [({"success": True, "translated_text": translation}, False) for translation in translations]
+
+        TRANSLATION_MICRO_BATCH_SPLITS.labels().inc()
+        logger.warning(f"Could not split a batch of {len(texts)} translations from {provider}, retrying in halves")
+        middle = len(texts) // 2
+        halves = await asyncio.gather(
+            self._translate_items(texts[:middle], provider, model, target_language),
+            self._translate_items(texts[middle:], provider, model, target_language),
+        )
+        return halves[0] + halves[1]
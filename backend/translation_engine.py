@@ -0,0 +1,106 @@
+import os
+import asyncio
+import hashlib
+import logging
+import threading
+import contextvars
+import concurrent.futures
+from typing import Any, Awaitable, Dict, Optional, Tuple
+
+from provider_limits import AdaptiveLimiter
+from structured_logging import add_request_id_async
+
+logger = logging.getLogger(__name__)
+
+# Default ceiling of concurrent requests per provider and API key
+DEFAULT_PROVIDER_CONCURRENCY = int(os.environ.get("TRANSLATION_MAX_CONCURRENCY", "16"))
+
+# Upper bound of pooled upstream connections shared by all providers
+MAX_CONNECTIONS = int(os.environ.get("TRANSLATION_MAX_CONNECTIONS", "256"))
+
+# Timeout in seconds of a single upstream HTTP request
+REQUEST_TIMEOUT = float(os.environ.get("TRANSLATION_REQUEST_TIMEOUT", "30"))
+
+
+def provider_concurrency(provider: str) -> int:
+    """Concurrency ceiling for a provider, e.g. TRANSLATION_MAX_CONCURRENCY_OPENAI=32"""
+    value = os.environ.get(f"TRANSLATION_MAX_CONCURRENCY_{provider.upper()}")
+    return int(value) if value else DEFAULT_PROVIDER_CONCURRENCY
+
+
+class AsyncEngine:
+    """Shared asyncio event loop running in a background thread.
+
+    Flask handlers are synchronous, so they hand coroutines to this loop and wait
+    on the result. Upstream I/O for every request is multiplexed on the loop's
+    single thread and one pooled HTTP client instead of one blocked thread each.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional["httpx.AsyncClient"] = None
+        self._limiters: Dict[Tuple[str, str], AdaptiveLimiter] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    thread = threading.Thread(target=loop.run_forever, name="translation-engine", daemon=True)
+                    thread.start()
+                    self._loop = loop
+        return self._loop
+
+    @property
+    def client(self) -> "httpx.AsyncClient":
+        """Pooled HTTP client, only to be used from coroutines running on the loop"""
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(
+                timeout=REQUEST_TIMEOUT,
+                limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+                event_hooks={"request": [add_request_id_async]},
+            )
+        return self._client
+
+    def limiter(self, provider: str, api_key: str) -> AdaptiveLimiter:
+        """Adaptive limiter for a provider and API key, only to be used from coroutines running on the loop"""
+        # Rate limits are enforced per key upstream; keep only a fingerprint of it
+        key = (provider, hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12])
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limiter = AdaptiveLimiter(provider, provider_concurrency(provider))
+            self._limiters[key] = limiter
+        return limiter
+
+    def submit(self, coro: Awaitable[Any]) -> concurrent.futures.Future:
+        """Schedule a coroutine on the loop, carrying over the caller's context variables"""
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        context = contextvars.copy_context()
+        loop = self.loop
+
+        def start() -> None:
+            task = loop.create_task(coro, context=context)
+
+            def done(finished: asyncio.Task) -> None:
+                if finished.cancelled():
+                    future.cancel()
+                elif finished.exception() is not None:
+                    future.set_exception(finished.exception())
+                else:
+                    future.set_result(finished.result())
+
+            task.add_done_callback(done)
+
+        loop.call_soon_threadsafe(start)
+        return future
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """Run a coroutine on the loop and block the calling thread until it finishes"""
+        return self.submit(coro).result(timeout)
+
+
+# Global engine instance
+engine = AsyncEngine()
@@ -0,0 +1,496 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import artifacts
+import scheduler
+import shared_state
+from fingerprints import content_hash
+from provider_limits import backoff_delay
+from translation import translation_service
+from translation_engine import engine
+from translation_memory import split_segments
+
+logger = logging.getLogger(__name__)
+
+# Where job state and per-segment checkpoints are kept, one folder per job
+JOBS_DIR = os.environ.get(
+    "TRANSLATION_JOBS_DIR",
+    os.path.join(os.path.dirname(os.environ.get("CONFIG_FILE_PATH", "/app/data/config.json")), "translation_jobs"),
+)
+
+# Segments of one job translated at once
+JOB_CONCURRENCY = int(os.environ.get("TRANSLATION_JOB_CONCURRENCY", "4"))
+
+# Paragraphs are grouped into segments of up to this many characters
+SEGMENT_CHARS = int(os.environ.get("TRANSLATION_JOB_SEGMENT_CHARS", "4000"))
+
+# Attempts per segment, with backoff in between, before the job stops as failed
+MAX_SEGMENT_ATTEMPTS = int(os.environ.get("TRANSLATION_JOB_MAX_ATTEMPTS", "6"))
+
+# Minimum seconds between two writes of a running job's progress
+PROGRESS_SAVE_SECONDS = 2.0
+
+# How often the leader looks for queued or running jobs that no replica is working on
+SWEEP_SECONDS = float(os.environ.get("TRANSLATION_JOB_SWEEP_SECONDS", "60"))
+
+# How long a cancel request stays visible to the replica running the job
+CANCEL_TTL_SECONDS = 24 * 3600
+
+ACTIVE_STATES = ("queued", "running")
+
+# Where a paragraph longer than a segment is split: after the end of a sentence, else at any space
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?\u2026\u3002\uff01\uff1f])(\s+)")
+_SPACE_RE = re.compile(r"(\s+)")
+
+
+def _split_long(text: str, limit: int) -> List[Tuple[str, str]]:
+    """(piece, separator) pairs of a paragraph, each piece at most limit characters"""
+    pieces: List[Tuple[str, str]] = []
+    for pattern in (_SENTENCE_END_RE, _SPACE_RE):
+        parts = pattern.split(text)
+        if len(parts) > 1:
+            for index in range(0, len(parts), 2):
+                piece = parts[index]
+                separator = parts[index + 1] if index + 1 < len(parts) else ""
+                if len(piece) > limit:
+                    pieces.extend(_split_long(piece, limit))
+                    pieces[-1] = (pieces[-1][0], separator)
+                else:
+                    pieces.append((piece, separator))
+            return pieces
+    # A single word longer than a segment is cut where it must be
+    return [(text[start:start + limit], "") for start in range(0, len(text), limit)]
+
+
+def segment_markdown(text: str, limit: int = SEGMENT_CHARS) -> List[Tuple[str, str]]:
+    """Split Markdown into (segment, separator) pairs, grouping paragraphs up to limit characters.
+
+    A paragraph longer than limit is split between sentences, so no request
+    asks for more output than the provider's token limit allows.
+    """
+    parts = split_segments(text)
+    units: List[Tuple[str, str]] = []
+    for index in range(0, len(parts), 2):
+        paragraph = parts[index]
+        separator = parts[index + 1] if index + 1 < len(parts) else ""
+        if len(paragraph) > limit:
+            pieces = _split_long(paragraph, limit)
+            pieces[-1] = (pieces[-1][0], separator)
+            units.extend(pieces)
+        else:
+            units.append((paragraph, separator))
+
+    segments: List[Tuple[str, str]] = []
+    current = ""
+    pending_separator = ""
+    for paragraph, separator in units:
+        if current and len(current) + len(paragraph) > limit:
+            segments.append((current[:len(current) - len(pending_separator)], pending_separator))
+            current = ""
+        current += paragraph + separator
+        pending_separator = separator
+    if current:
+        segments.append((current[:len(current) - len(pending_separator)], pending_separator))
+    return segments
+
+
+def _segment_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+class TranslationJob:
+    """Translation of one workspace PDF into one language, checkpointed segment by segment.
+
+    Finished segments are appended to segments.jsonl keyed by the hash of
+    their source text, so a restarted job, or one started again after the
+    Markdown was regenerated, only translates segments it has not seen. Each
+    line records the provider and model that translated it; both are null
+    for segments reused from the translation memory.
+    """
+
+    FIELDS = (
+        "id", "document", "target_language", "provider", "model", "prompt", "fallbacks", "priority", "tenant",
+        "status", "error", "output", "created", "started", "finished",
+        "segments_total", "segments_done", "chars_total", "chars_done",
+    )
+
+    def __init__(self, directory: str, **fields: Any):
+        self.directory = directory
+        self.id = ""
+        self.document = ""
+        self.target_language = ""
+        self.provider = ""
+        self.model = ""
+        self.prompt: Optional[str] = None
+        self.fallbacks: Any = None
+        self.priority = "bulk"
+        self.tenant = ""
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.output: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.segments_total = 0
+        self.segments_done = 0
+        self.chars_total = 0
+        self.chars_done = 0
+        for key, value in fields.items():
+            if key in self.FIELDS:
+                setattr(self, key, value)
+        # Progress made by the current run, for the ETA
+        self._run_started = 0.0
+        self._run_chars = 0
+        self._last_save = 0.0
+        self._cancel = False
+        self._running = False
+        self._submitted = False
+        self._state_mtime = 0
+
+    @property
+    def state_path(self) -> str:
+        return os.path.join(self.directory, "job.json")
+
+    @property
+    def checkpoint_path(self) -> str:
+        return os.path.join(self.directory, "segments.jsonl")
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {key: getattr(self, key) for key in self.FIELDS}
+        data["progress"] = round(self.chars_done / self.chars_total, 4) if self.chars_total else 0.0
+        data["eta_seconds"] = None
+        elapsed = time.time() - self._run_started
+        if self.status == "running" and self._run_chars and elapsed > 0:
+            rate = self._run_chars / elapsed
+            data["eta_seconds"] = round((self.chars_total - self.chars_done) / rate, 1)
+        return data
+
+    def save(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self.state_path}.{os.getpid()}-{threading.get_ident()}.partial"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({key: getattr(self, key) for key in self.FIELDS}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+        self._last_save = time.monotonic()
+        self._state_mtime = os.stat(self.state_path).st_mtime_ns
+
+    def reload(self) -> None:
+        """Take over state saved by another replica since this one last read or wrote it"""
+        try:
+            mtime = os.stat(self.state_path).st_mtime_ns
+            if mtime == self._state_mtime:
+                return
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                fields = json.load(f)
+        except (OSError, ValueError):
+            return
+        for key, value in fields.items():
+            if key in self.FIELDS:
+                setattr(self, key, value)
+        self._state_mtime = mtime
+
+    def load_checkpoints(self) -> Dict[str, Dict[str, Any]]:
+        """Translated segments by source hash, with their provider and model; a line cut short by a crash is ignored"""
+        checkpoints: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    checkpoints[entry["hash"]] = entry
+        except FileNotFoundError:
+            pass
+        return checkpoints
+
+    def clear_checkpoints(self) -> None:
+        """Forget every translated segment, so the next run translates the whole document"""
+        try:
+            os.remove(self.checkpoint_path)
+        except FileNotFoundError:
+            pass
+        self.segments_done = 0
+        self.chars_done = 0
+
+    def checkpoint(self, segment_hash: str, text: str, provider: Optional[str], model: Optional[str]) -> Dict[str, Any]:
+        entry = {"hash": segment_hash, "text": text, "provider": provider, "model": model}
+        with open(self.checkpoint_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return entry
+
+
+class TranslationJobManager:
+    """Creates, runs, resumes and reports document translation jobs.
+
+    Jobs run on the translation engine's event loop as work of their own
+    priority class, so they queue behind interactive translations.
+    """
+
+    def __init__(self, directory: str = JOBS_DIR):
+        self.directory = directory
+        self.workspace = ""
+        # Returns the Markdown text of a workspace PDF, converting it if needed
+        self.load_markdown: Optional[Callable[[str], str]] = None
+        # Returns the local path of a workspace document, fetching it from storage if needed
+        self.resolve: Optional[Callable[[str], str]] = None
+        self._jobs: Dict[str, TranslationJob] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, workspace: str, load_markdown: Callable[[str], str], resolve: Optional[Callable[[str], str]] = None) -> None:
+        self.workspace = workspace
+        self.load_markdown = load_markdown
+        self.resolve = resolve
+
+    def _pdf_path(self, document: str) -> str:
+        return self.resolve(document) if self.resolve else os.path.join(self.workspace, document)
+
+    def _load(self) -> None:
+        """Read jobs from disk, including those started or advanced by other replicas"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            job = self._jobs.get(name)
+            if job is None:
+                directory = os.path.join(self.directory, name)
+                try:
+                    with open(os.path.join(directory, "job.json"), "r", encoding="utf-8") as f:
+                        fields = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                job = self._jobs.setdefault(fields.get("id") or name, TranslationJob(directory, **fields))
+                job._state_mtime = os.stat(job.state_path).st_mtime_ns
+            elif not job._running:
+                job.reload()
+
+    def job_id(self, pdf_path: str, target_language: str, prompt: Optional[str]) -> str:
+        """Same document content, language and prompt give the same job, so starting it again resumes it"""
+        key = f"{content_hash(pdf_path)}:{artifacts.language_slug(target_language)}:{prompt or ''}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:24]
+
+    def get(self, job_id: str) -> Optional[TranslationJob]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                self._load()
+                return self._jobs.get(job_id)
+            if not job._running:
+                job.reload()
+            return job
+
+    def list(self) -> List[TranslationJob]:
+        with self._lock:
+            self._load()
+            return sorted(self._jobs.values(), key=lambda job: job.created, reverse=True)
+
+    def start(self, document: str, target_language: str, provider: str, model: str, prompt: Optional[str] = None, fallbacks: Any = None, priority: Optional[str] = None) -> TranslationJob:
+        """Start a job for a workspace PDF, or resume the existing job for the same content and language"""
+        pdf_path = self._pdf_path(document)
+        job_id = self.job_id(pdf_path, target_language, prompt)
+        with self._lock:
+            self._load()
+            job = self._jobs.get(job_id)
+            if job is not None and job.status in ACTIVE_STATES:
+                # Left behind by a process that stopped; pick it up rather than wait for the sweep
+                if not job._submitted and not shared_state.locked(f"translation-job:{job.id}"):
+                    self._submit(job)
+                return job
+            if job is None:
+                job = TranslationJob(os.path.join(self.directory, job_id), id=job_id, created=time.time())
+                self._jobs[job_id] = job
+            elif (job.provider, job.model) != (provider, model):
+                # Segments translated by another model must not end up in this one's translation
+                logger.info(f"Translation job {job.id} switched from {job.provider}/{job.model} to {provider}/{model}; starting over")
+                job.clear_checkpoints()
+            job.document = document
+            job.target_language = target_language
+            job.provider = provider
+            job.model = model
+            job.prompt = prompt
+            job.fallbacks = fallbacks
+            # Whole documents are background work unless the caller asks for another class
+            job.priority = scheduler.parse_priority(priority, "bulk")
+            job.tenant = scheduler.current().tenant
+            job.status = "queued"
+            job.error = None
+            job._cancel = False
+            job.save()
+        shared_state.state.delete(self._cancel_key(job.id))
+        self._submit(job)
+        return job
+
+    def resume(self, job_id: str) -> Optional[TranslationJob]:
+        """Run a failed or cancelled job again from its checkpoints"""
+        job = self.get(job_id)
+        if job is None or job.status in ACTIVE_STATES or job.status == "completed":
+            return job
+        job.status = "queued"
+        job.error = None
+        job._cancel = False
+        job.save()
+        shared_state.state.delete(self._cancel_key(job.id))
+        self._submit(job)
+        return job
+
+    def resume_interrupted(self) -> int:
+        """Restart queued or running jobs that no process is working on, such as those of a stopped replica"""
+        jobs = [
+            job for job in self.list()
+            if job.status in ACTIVE_STATES and not job._submitted and not shared_state.locked(f"translation-job:{job.id}")
+        ]
+        for job in jobs:
+            logger.info(f"Resuming translation job {job.id} for {job.document}")
+            self._submit(job)
+        return len(jobs)
+
+    def cancel(self, job_id: str) -> Optional[TranslationJob]:
+        """Stop a job after the segments in flight; its checkpoints are kept for a later resume"""
+        job = self.get(job_id)
+        if job is not None and job.status in ACTIVE_STATES:
+            job._cancel = True
+            # The job may be running on another replica
+            shared_state.state.set(self._cancel_key(job_id), "1", CANCEL_TTL_SECONDS)
+            if job.status == "queued":
+                job.status = "cancelled"
+                job.save()
+        return job
+
+    @staticmethod
+    def _cancel_key(job_id: str) -> str:
+        return shared_state.key("translation-job-cancel", job_id)
+
+    def _cancelled(self, job: TranslationJob) -> bool:
+        if not job._cancel and shared_state.state.get(self._cancel_key(job.id)):
+            job._cancel = True
+        return job._cancel
+
+    def _submit(self, job: TranslationJob) -> None:
+        job._submitted = True
+        with scheduler.work(priority=job.priority, tenant=job.tenant, document=job.document):
+            engine.submit(self._run(job))
+
+    async def _run(self, job: TranslationJob) -> None:
+        # A job resumed while an earlier submission of it is still pending runs once
+        if job._cancel or job._running:
+            job._submitted = job._running
+            return
+        # Only one replica runs a job; the lock passes to another if this one stops
+        run_lock = shared_state.lock(f"translation-job:{job.id}", kind="translation_job")
+        if not await asyncio.to_thread(run_lock.acquire, False):
+            job._submitted = False
+            return
+        try:
+            await asyncio.to_thread(job.reload)
+            if job.status not in ACTIVE_STATES:
+                return
+            await self._run_locked(job)
+        finally:
+            job._submitted = False
+            await asyncio.to_thread(run_lock.release)
+
+    async def _run_locked(self, job: TranslationJob) -> None:
+        job._running = True
+        job.status = "running"
+        job.started = time.time()
+        job.finished = None
+        job._run_started = time.time()
+        job._run_chars = 0
+        await asyncio.to_thread(job.save)
+        try:
+            pdf_path = await asyncio.to_thread(self._pdf_path, job.document)
+            markdown = await asyncio.to_thread(self.load_markdown, pdf_path)
+            segments = segment_markdown(markdown)
+            hashes = [_segment_hash(text) for text, _ in segments]
+            checkpoints = await asyncio.to_thread(job.load_checkpoints)
+
+            job.segments_total = len(segments)
+            job.chars_total = sum(len(text) for text, _ in segments)
+            done = [index for index, segment_hash in enumerate(hashes) if segment_hash in checkpoints]
+            job.segments_done = len(done)
+            job.chars_done = sum(len(segments[index][0]) for index in done)
+            pending = asyncio.Queue()
+            for index, segment_hash in enumerate(hashes):
+                if segment_hash not in checkpoints:
+                    pending.put_nowait(index)
+
+            async def worker() -> None:
+                while job.error is None and not await asyncio.to_thread(self._cancelled, job):
+                    try:
+                        index = pending.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    text = segments[index][0]
+                    result = await self._translate_segment(job, text)
+                    if result is None:
+                        return
+                    checkpoints[hashes[index]] = await asyncio.to_thread(
+                        job.checkpoint, hashes[index], result["translated_text"], result.get("provider"), result.get("model")
+                    )
+                    job.segments_done += 1
+                    job.chars_done += len(text)
+                    job._run_chars += len(text)
+                    if time.monotonic() - job._last_save >= PROGRESS_SAVE_SECONDS:
+                        await asyncio.to_thread(job.save)
+
+            await asyncio.gather(*(worker() for _ in range(max(1, min(JOB_CONCURRENCY, pending.qsize())))))
+
+            if job._cancel:
+                job.status = "cancelled"
+            elif job.error is not None:
+                job.status = "failed"
+            else:
+                translated = "".join(checkpoints[segment_hash]["text"] + separator for segment_hash, (_, separator) in zip(hashes, segments))
+                output_path = artifacts.translation_path(pdf_path, job.target_language)
+                await asyncio.to_thread(artifacts.write_text, output_path, translated)
+                job.output = os.path.relpath(output_path, self.workspace)
+                job.status = "completed"
+                fallback = sum(
+                    1 for segment_hash in hashes
+                    if checkpoints[segment_hash].get("provider") and
+                    (checkpoints[segment_hash]["provider"], checkpoints[segment_hash].get("model")) != (job.provider, job.model)
+                )
+                logger.info(
+                    f"Translation job {job.id} for {job.document} completed ({job.segments_total} segments, "
+                    f"{fallback} translated by a fallback provider)"
+                )
+        except Exception as e:
+            job.error = str(e) or type(e).__name__
+            job.status = "failed"
+            logger.error(f"Translation job {job.id} for {job.document} failed: {job.error}")
+        finally:
+            job.finished = time.time()
+            job._running = False
+            await asyncio.to_thread(job.save)
+
+    async def _translate_segment(self, job: TranslationJob, text: str) -> Optional[Dict[str, Any]]:
+        """Translate one segment, retrying through provider outages; None stops the job, as does an answer cut off at the token limit"""
+        result: Dict[str, Any] = {}
+        for attempt in range(MAX_SEGMENT_ATTEMPTS):
+            if job._cancel:
+                return None
+            result = await translation_service.translate_async(text, job.provider, job.model, job.target_language, job.prompt, job.fallbacks)
+            if result.get("success"):
+                return result
+            if result.get("truncated"):
+                # Asking the same model again gets the same cut-off answer
+                break
+            if attempt + 1 < MAX_SEGMENT_ATTEMPTS:
+                logger.warning(f"Translation job {job.id} segment failed, retry {attempt + 1} of {MAX_SEGMENT_ATTEMPTS - 1}: {result.get('message')}")
+                await asyncio.sleep(backoff_delay(attempt + 1))
+        job.error = result.get("message") or "Translation failed"
+        return None
+
+
+# Global job manager instance
+job_manager = TranslationJobManager()
@@ -0,0 +1,318 @@
+import os
+import re
+import time
+import random
+import struct
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from difflib import SequenceMatcher
+from typing import Dict, List, NamedTuple, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Store segments and reuse earlier translations of the same or nearly the same text
+MEMORY_ENABLED = os.environ.get("TRANSLATION_MEMORY", "true").lower() in ("1", "true", "yes")
+
+# SQLite file holding source/target segment pairs and their similarity index
+MEMORY_PATH = os.environ.get(
+    "TRANSLATION_MEMORY_PATH",
+    os.path.join(os.path.dirname(os.environ.get("CONFIG_FILE_PATH", "/app/data/config.json")), "translation_memory.sqlite3"),
+)
+
+# Similarity at or above which a stored translation is reused as is, and above which it is given to the model as an example
+REUSE_THRESHOLD = float(os.environ.get("TRANSLATION_MEMORY_REUSE_THRESHOLD", "0.95"))
+CONTEXT_THRESHOLD = float(os.environ.get("TRANSLATION_MEMORY_CONTEXT_THRESHOLD", "0.7"))
+
+# MinHash signature length, split into LSH bands; 16 bands of 4 rows find pairs above roughly 0.5 Jaccard
+NUM_PERMUTATIONS = 64
+BANDS = 16
+ROWS = NUM_PERMUTATIONS // BANDS
+
+# Segments kept, least recently used forgotten first when the janitor prunes the memory; 0 keeps every segment
+MAX_SEGMENTS = int(os.environ.get("TRANSLATION_MEMORY_MAX_SEGMENTS", "200000"))
+
+# Candidates from the index that are compared character by character
+MAX_CANDIDATES = 5
+
+# Words per shingle
+SHINGLE_WORDS = 3
+
+_PRIME = (1 << 61) - 1
+# A fixed seed keeps signatures comparable across restarts
+_rng = random.Random(20240601)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERMUTATIONS)]
+_SIGNATURE = struct.Struct(f"<{NUM_PERMUTATIONS}Q")
+
+# Differences that do not change the meaning of a segment
+_SOFT_HYPHEN = "\u00ad"
+_LINE_HYPHEN_RE = re.compile(r"(\w)-\s*\n\s*(\w)")
+_FOOTNOTE_RE = re.compile(r"\[\^?\d{1,3}\]|(?<![\d)])\^\d{1,3}|[\u00b9\u00b2\u00b3\u2070-\u2079]+")
+# Looser, for the similarity index only: digits glued to a word (often an unmarked footnote) and all punctuation
+_WORD_DIGITS_RE = re.compile(r"(?<=[^\W\d])\d{1,3}(?=[\s.,;:!?)]|$)")
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_SEGMENT_SEPARATOR_RE = re.compile(r"(\n[ \t]*\n\s*)")
+# Numbers and symbols that change the meaning ("$100" / "\u20ac100", "x < y" / "x > y", "It is done?"), unlike quotes and plain punctuation
+_SIGNIFICANT_RE = re.compile(r"\d+|_+|[^\w\s.,;:'\"()\[\]{}/\u2010-\u2015\u2018\u2019\u201c\u201d\u00ab\u00bb-]")
+
+TRANSLATION_MEMORY_LOOKUPS = metrics.registry.counter(
+    "notypdf_translation_memory_lookups_total",
+    "Translation memory lookups by outcome: exact, fuzzy (reused), context (offered to the model) or miss",
+    ["outcome"],
+)
+
+
+class Match(NamedTuple):
+    source: str
+    target: str
+    score: float
+
+    @property
+    def reusable(self) -> bool:
+        return self.score >= REUSE_THRESHOLD
+
+    @property
+    def useful(self) -> bool:
+        return self.score >= CONTEXT_THRESHOLD
+
+
+def canonical(text: str) -> str:
+    """Text with soft hyphens, hyphenation, explicit footnote markers and extra spacing removed"""
+    # Footnote markers go before NFKC turns superscript digits into plain ones
+    text = _FOOTNOTE_RE.sub("", text.replace(_SOFT_HYPHEN, ""))
+    text = unicodedata.normalize("NFKC", text)
+    text = _LINE_HYPHEN_RE.sub(r"\1\2", text)
+    return " ".join(text.split())
+
+
+def normalize(text: str) -> str:
+    """Canonical text without punctuation, symbols, case or digits glued to words, for similarity only"""
+    text = _WORD_DIGITS_RE.sub("", canonical(text))
+    text = _PUNCTUATION_RE.sub(" ", text.casefold())
+    return " ".join(text.split())
+
+
+def significant_marks(text: str) -> List[str]:
+    """Numbers and meaningful symbols of a text, in order"""
+    return _SIGNIFICANT_RE.findall(canonical(text))
+
+
+def _key(text: str) -> str:
+    return hashlib.sha256(canonical(text).encode("utf-8")).hexdigest()
+
+
+def split_segments(text: str) -> List[str]:
+    """Paragraphs of a text interleaved with the blank lines between them"""
+    return _SEGMENT_SEPARATOR_RE.split(text)
+
+
+def scope(target_language: str, prompt_template: Optional[str]) -> str:
+    """Memory partition for a target language and prompt; the source language is implied by the text"""
+    prompt = hashlib.sha256((prompt_template or "").encode("utf-8")).hexdigest()[:12]
+    return f"{target_language.strip().lower()}:{prompt}"
+
+
+def _shingles(normalized: str) -> List[int]:
+    words = normalized.split()
+    grams = [" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))]
+    return [int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest(), "little") for gram in set(grams)]
+
+
+def signature(normalized: str) -> List[int]:
+    shingles = _shingles(normalized)
+    return [min((a * x + b) % _PRIME for x in shingles) for a, b in _PERMUTATIONS]
+
+
+def _buckets(values: List[int]) -> List[int]:
+    packed = _SIGNATURE.pack(*values)
+    buckets = []
+    for band in range(BANDS):
+        rows = packed[band * ROWS * 8:(band + 1) * ROWS * 8]
+        # Signed 63-bit, so it fits an SQLite integer; the band number keeps equal rows of different bands apart
+        digest = hashlib.blake2b(bytes([band]) + rows, digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, "little") >> 1)
+    return buckets
+
+
+class TranslationMemory:
+    """Source/target segment pairs per target language, with a MinHash LSH index for near-duplicates.
+
+    Re-extracted text that differs only in hyphenation, explicit footnote
+    markers or spacing is an exact match. Other candidates come from the LSH
+    buckets, which ignore punctuation and case, and are scored with difflib;
+    one whose numbers or symbols differ is never reused as is.
+    """
+
+    def __init__(self, path: str = MEMORY_PATH):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS segments (
+                    id INTEGER PRIMARY KEY,
+                    scope TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    target TEXT NOT NULL,
+                    signature BLOB NOT NULL,
+                    updated REAL NOT NULL,
+                    UNIQUE (scope, key)
+                );
+                CREATE TABLE IF NOT EXISTS buckets (
+                    scope TEXT NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    segment_id INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS buckets_lookup ON buckets (scope, bucket);
+                CREATE INDEX IF NOT EXISTS buckets_segment ON buckets (segment_id);
+                CREATE INDEX IF NOT EXISTS segments_updated ON segments (updated);
+                """
+            )
+            self._connection = connection
+        return self._connection
+
+    def _lookup(self, scope_key: str, text: str) -> Optional[Match]:
+        normalized = normalize(text)
+        if not normalized:
+            return None
+        row = self.connection.execute(
+            "SELECT id, source, target FROM segments WHERE scope = ? AND key = ?", (scope_key, _key(text))
+        ).fetchone()
+        if row:
+            self._touch(row[0])
+            return Match(row[1], row[2], 1.0)
+
+        buckets = _buckets(signature(normalized))
+        candidates = self.connection.execute(
+            f"SELECT segment_id FROM buckets WHERE scope = ? AND bucket IN ({','.join('?' * len(buckets))}) "
+            "GROUP BY segment_id ORDER BY COUNT(*) DESC LIMIT ?",
+            (scope_key, *buckets, MAX_CANDIDATES),
+        ).fetchall()
+        marks = significant_marks(text)
+        best = None
+        best_id = None
+        for (segment_id,) in candidates:
+            source, target = self.connection.execute(
+                "SELECT source, target FROM segments WHERE id = ?", (segment_id,)
+            ).fetchone()
+            matcher = SequenceMatcher(None, normalized, normalize(source), autojunk=False)
+            if matcher.real_quick_ratio() < CONTEXT_THRESHOLD or matcher.quick_ratio() < CONTEXT_THRESHOLD:
+                continue
+            score = matcher.ratio()
+            if significant_marks(source) != marks:
+                # Other amounts, operators or emphasis, or a question instead of a statement: only good as an example
+                score = min(score, REUSE_THRESHOLD - 0.01)
+            if best is None or score > best.score:
+                best = Match(source, target, round(score, 4))
+                best_id = segment_id
+        if best is not None and best.reusable:
+            self._touch(best_id)
+        return best
+
+    def _touch(self, segment_id: int) -> None:
+        # Reused segments count as recently used, so pruning keeps them
+        with self.connection:
+            self.connection.execute("UPDATE segments SET updated = ? WHERE id = ?", (time.time(), segment_id))
+
+    def lookup(self, scope_key: str, segments: List[str]) -> List[Optional[Match]]:
+        """Best stored match of each segment, or None"""
+        results = []
+        with self._lock:
+            for text in segments:
+                try:
+                    match = self._lookup(scope_key, text)
+                except sqlite3.Error as e:
+                    logger.warning(f"Translation memory lookup failed: {str(e)}")
+                    match = None
+                if match is None or not match.useful:
+                    outcome = "miss"
+                elif match.score == 1.0:
+                    outcome = "exact"
+                else:
+                    outcome = "fuzzy" if match.reusable else "context"
+                TRANSLATION_MEMORY_LOOKUPS.labels(outcome).inc()
+                results.append(match if match is not None and match.useful else None)
+        return results
+
+    def _store(self, scope_key: str, source: str, target: str) -> None:
+        normalized = normalize(source)
+        if not normalized or not target.strip():
+            return
+        key = _key(source)
+        values = signature(normalized)
+        connection = self.connection
+        row = connection.execute("SELECT id FROM segments WHERE scope = ? AND key = ?", (scope_key, key)).fetchone()
+        if row:
+            connection.execute(
+                "UPDATE segments SET source = ?, target = ?, updated = ? WHERE id = ?",
+                (source, target, time.time(), row[0]),
+            )
+            return
+        cursor = connection.execute(
+            "INSERT INTO segments (scope, key, source, target, signature, updated) VALUES (?, ?, ?, ?, ?, ?)",
+            (scope_key, key, source, target, _SIGNATURE.pack(*values), time.time()),
+        )
+        connection.executemany(
+            "INSERT INTO buckets (scope, bucket, segment_id) VALUES (?, ?, ?)",
+            [(scope_key, bucket, cursor.lastrowid) for bucket in _buckets(values)],
+        )
+
+    def store(self, scope_key: str, source: str, target: str) -> None:
+        """Remember a translation, and each of its paragraphs when source and target split alike"""
+        pairs = [(source, target)]
+        source_segments = split_segments(source)[::2]
+        target_segments = split_segments(target)[::2]
+        if len(source_segments) > 1 and len(source_segments) == len(target_segments):
+            pairs.extend(zip(source_segments, target_segments))
+        with self._lock:
+            try:
+                with self.connection:
+                    for pair_source, pair_target in pairs:
+                        self._store(scope_key, pair_source, pair_target)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not store translation memory segment: {str(e)}")
+
+    def prune(self, max_segments: int = MAX_SEGMENTS) -> int:
+        """Forget the least recently used segments beyond max_segments, returning how many were removed"""
+        if max_segments <= 0 or not os.path.exists(self.path):
+            return 0
+        with self._lock:
+            try:
+                with self.connection:
+                    count, = self.connection.execute("SELECT COUNT(*) FROM segments").fetchone()
+                    if count <= max_segments:
+                        return 0
+                    ids = self.connection.execute(
+                        "SELECT id FROM segments ORDER BY updated LIMIT ?", (count - max_segments,)
+                    ).fetchall()
+                    self.connection.executemany("DELETE FROM buckets WHERE segment_id = ?", ids)
+                    self.connection.executemany("DELETE FROM segments WHERE id = ?", ids)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not prune translation memory: {str(e)}")
+                return 0
+        # Freed pages are reused by later segments, so the file stops growing
+        logger.info(f"Pruned {len(ids)} translation memory segments")
+        return len(ids)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            segments, = self.connection.execute("SELECT COUNT(*) FROM segments").fetchone()
+            scopes, = self.connection.execute("SELECT COUNT(DISTINCT scope) FROM segments").fetchone()
+        return {"segments": segments, "scopes": scopes}
+
+
+# Global translation memory instance
+translation_memory = TranslationMemory()
@@ -0,0 +1,239 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ordered fallback routes tried after the requested one, e.g. "openrouter:openai/gpt-4o-mini,deepseek:deepseek-chat"
+TRANSLATION_FALLBACKS = os.environ.get("TRANSLATION_FALLBACKS", "")
+
+# Whether a duplicate request is sent to the next route once the primary is slower than its p95
+HEDGE_ENABLED = os.environ.get("TRANSLATION_HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Hedge delay used until enough latency samples exist, and the lower bound of any hedge delay
+HEDGE_DEFAULT_DELAY = float(os.environ.get("TRANSLATION_HEDGE_DEFAULT_DELAY", "5"))
+HEDGE_MIN_DELAY = float(os.environ.get("TRANSLATION_HEDGE_MIN_DELAY", "0.5"))
+
+# Samples kept per route and needed before the observed p95 is trusted
+LATENCY_WINDOW = 200
+LATENCY_MIN_SAMPLES = 20
+
+# Consecutive failures that open a provider's circuit, and seconds before a trial request
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("TRANSLATION_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("TRANSLATION_BREAKER_RESET", "30"))
+
+Route = Tuple[str, str]
+
+
+def parse_routes(value: Any) -> List[Route]:
+    """Parse fallbacks given as "provider:model,..." or a list of {provider, model} objects"""
+    routes = []
+    if isinstance(value, str):
+        for item in value.split(","):
+            provider, _, model = item.strip().partition(":")
+            if provider and model:
+                routes.append((provider, model))
+    elif isinstance(value, list):
+        for item in value:
+            if isinstance(item, dict) and item.get("provider") and item.get("model"):
+                routes.append((item["provider"], item["model"]))
+    return routes
+
+
+class LatencyTracker:
+    """Sliding window of successful call latencies per route"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._window = window
+        self._samples: Dict[Route, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route: Route, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get(route)
+            if samples is None:
+                samples = self._samples[route] = deque(maxlen=self._window)
+            samples.append(seconds)
+
+    def routes(self) -> List[Route]:
+        with self._lock:
+            return list(self._samples)
+
+    def p95(self, route: Route) -> Optional[float]:
+        with self._lock:
+            samples = list(self._samples.get(route, ()))
+        if len(samples) < LATENCY_MIN_SAMPLES:
+            return None
+        samples.sort()
+        return samples[min(len(samples) - 1, int(0.95 * len(samples)))]
+
+    def hedge_delay(self, route: Route) -> float:
+        p95 = self.p95(route)
+        return max(HEDGE_MIN_DELAY, p95 if p95 is not None else HEDGE_DEFAULT_DELAY)
+
+
+class CircuitBreaker:
+    """Per-provider breaker: opens after repeated failures, then lets one trial through"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, provider: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"Circuit closed for provider {self.provider}")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+        metrics.CIRCUIT_OPEN.labels(self.provider).set(0)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"Circuit opened for provider {self.provider} after {self.failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+        if self.state == self.OPEN:
+            metrics.CIRCUIT_OPEN.labels(self.provider).set(1)
+
+    def release(self) -> None:
+        """Give back a half-open trial slot whose request was cancelled"""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+# A provider call returns its result dict and whether the failure says anything about provider health
+ProviderCall = Callable[[str, str], Awaitable[Tuple[Dict[str, Any], bool]]]
+
+
+class RoutingPolicy:
+    """Ordered failover across provider routes with hedged duplicates and circuit breakers"""
+
+    def __init__(self):
+        self.latency = LatencyTracker()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, provider: str) -> CircuitBreaker:
+        breaker = self._breakers.get(provider)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(provider, CircuitBreaker(provider))
+        return breaker
+
+    def status(self) -> Dict[str, Any]:
+        """Breaker state per provider and observed p95 latency per model"""
+        providers: Dict[str, Any] = {
+            provider: {"state": breaker.state, "failures": breaker.failures, "models": {}}
+            for provider, breaker in list(self._breakers.items())
+        }
+        for provider, model in self.latency.routes():
+            entry = providers.setdefault(provider, {"state": CircuitBreaker.CLOSED, "failures": 0, "models": {}})
+            entry["models"][model] = {"p95_seconds": self.latency.p95((provider, model))}
+        return providers
+
+    async def _attempt(self, call: ProviderCall, route: Route) -> Tuple[Route, Dict[str, Any], bool]:
+        provider, model = route
+        breaker = self.breaker(provider)
+        start = time.perf_counter()
+        try:
+            result, health_failure = await call(provider, model)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        if result.get("success"):
+            self.latency.observe(route, time.perf_counter() - start)
+            breaker.record_success()
+        elif health_failure:
+            breaker.record_failure()
+        else:
+            breaker.release()
+        return route, result, health_failure
+
+    async def execute(self, call: ProviderCall, routes: List[Route]) -> Dict[str, Any]:
+        """Run call over routes until one succeeds; the first good answer wins"""
+        routes = list(dict.fromkeys(routes))
+        pending_routes = list(routes)
+        running: Dict[asyncio.Task, Route] = {}
+        last_result: Dict[str, Any] = {
+            "success": False,
+            "message": f"All translation providers are unavailable (circuit open): {', '.join(p for p, _ in routes)}"
+        }
+        attempts: List[Dict[str, Any]] = []
+        latest: Optional[Route] = None
+
+        def launch(hedged: bool = False) -> bool:
+            nonlocal latest
+            while pending_routes:
+                route = pending_routes.pop(0)
+                if not self.breaker(route[0]).allow():
+                    continue
+                if hedged:
+                    metrics.TRANSLATION_HEDGES.labels(route[0]).inc()
+                elif attempts:
+                    metrics.TRANSLATION_FAILOVERS.labels(route[0]).inc()
+                running[asyncio.ensure_future(self._attempt(call, route))] = route
+                latest = route
+                return True
+            return False
+
+        try:
+            launch()
+            while running:
+                timeout = self.latency.hedge_delay(latest) if HEDGE_ENABLED and pending_routes else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch(hedged=True)
+                    continue
+                for task in done:
+                    running.pop(task)
+                    route, result, _ = task.result()
+                    attempts.append({"provider": route[0], "model": route[1], "success": bool(result.get("success"))})
+                    if result.get("success"):
+                        return dict(result, provider=route[0], model=route[1], attempts=attempts)
+                    last_result = result
+                if not running:
+                    launch()
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+        if len(attempts) > 1:
+            return dict(last_result, attempts=attempts)
+        return last_result
+
+
+# Global routing policy instance
+routing_policy = RoutingPolicy()
@@ -0,0 +1,286 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tarfile
+import threading
+from datetime import datetime
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import file_operations
+import fingerprints
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Last member of every backup: the state of all files when it was taken
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+# Members holding the configuration file, the workspace with its archive, and per-document state
+CONFIG_MEMBER = "config/config.json"
+WORKSPACE_PREFIX = "workspace/"
+STATE_PREFIX = "documents/"
+
+# Largest restore accepted, far above the upload limit since a full backup holds the whole workspace
+MAX_RESTORE_BYTES = int(os.environ.get("BACKUP_MAX_RESTORE_BYTES", str(1024 ** 4)))
+
+_CHUNK_SIZE = 1024 * 1024
+_BLOCK_SIZE = tarfile.BLOCKSIZE
+_RECORD_SIZE = tarfile.RECORDSIZE
+
+BACKUP_BYTES = metrics.registry.counter(
+    "notypdf_backup_bytes_total",
+    "Bytes of file content streamed into backups, by mode",
+    ["mode"],
+)
+BACKUP_FILES = metrics.registry.counter(
+    "notypdf_backup_files_total",
+    "Files in backups by outcome: included, or unchanged and left out of an incremental backup",
+    ["outcome"],
+)
+
+
+def parse_since(value: str) -> float:
+    """Unix time from seconds since the epoch or an ISO 8601 timestamp"""
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid timestamp: {value}")
+
+
+def _skipped(name: str) -> bool:
+    """Files that are never backed up: in-flight writes and batch trash"""
+    return name.endswith(".partial") or file_operations.is_trash(name)
+
+
+def scan(workspace: str, config_path: str, state_dir: str = "") -> Iterator[Tuple[str, str, os.stat_result]]:
+    """Member name, path and stat of every file a backup covers, in a stable order"""
+    if os.path.isfile(config_path):
+        yield CONFIG_MEMBER, config_path, os.stat(config_path)
+    if state_dir and os.path.isdir(state_dir):
+        for filename in sorted(os.listdir(state_dir)):
+            path = os.path.join(state_dir, filename)
+            if not _skipped(filename) and os.path.isfile(path) and not os.path.islink(path):
+                yield STATE_PREFIX + filename, path, os.stat(path)
+    for root, dirnames, filenames in os.walk(workspace):
+        dirnames[:] = sorted(name for name in dirnames if not _skipped(name))
+        for filename in sorted(filenames):
+            if _skipped(filename):
+                continue
+            path = os.path.join(root, filename)
+            try:
+                stat = os.stat(path, follow_symlinks=False)
+            except OSError:
+                continue
+            if not os.path.isfile(path) or os.path.islink(path):
+                continue
+            relative = os.path.relpath(path, workspace).replace(os.sep, "/")
+            yield WORKSPACE_PREFIX + relative, path, stat
+
+
+def _header(name: str, size: int, mtime: float) -> bytes:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+
+def _file_member(name: str, path: str, stat: os.stat_result, digest: Any) -> Iterator[bytes]:
+    """Tar member of a file, read in chunks; the size is fixed by the header, so a file that shrank is padded"""
+    yield _header(name, stat.st_size, stat.st_mtime)
+    remaining = stat.st_size
+    with open(path, "rb") as f:
+        while remaining > 0:
+            chunk = f.read(min(_CHUNK_SIZE, remaining))
+            if not chunk:
+                logger.warning(f"{path} shrank while it was backed up")
+                chunk = b"\0" * remaining
+            digest.update(chunk)
+            remaining -= len(chunk)
+            yield chunk
+    yield b"\0" * (-stat.st_size % _BLOCK_SIZE)
+
+
+def stream_backup(workspace: str, config_path: str, base: Optional[Dict[str, Any]] = None, since: Optional[float] = None, state_dir: str = "") -> Iterator[bytes]:
+    """Tar stream of the configuration, per-document state and workspace.
+
+    With a base manifest only files whose content hash differs from it are
+    included; a file with the same size and mtime is taken as unchanged
+    without reading it. With a timestamp only files modified after it are
+    included. Only included files and files whose stat changed are read, so
+    an incremental backup does not read the whole workspace. The manifest at
+    the end lists every file with its size, mtime and, where known, hash, so
+    it can be the base of the next incremental backup, and names the files
+    deleted since the base.
+    """
+    base_files = (base or {}).get("files") or {}
+    mode = "incremental" if base is not None or since is not None else "full"
+    files: Dict[str, Dict[str, Any]] = {}
+    included = 0
+    written = 0
+
+    for name, path, stat in scan(workspace, config_path, state_dir):
+        previous = base_files.get(name) or {}
+        digest = ""
+        if since is not None:
+            changed = stat.st_mtime > since
+        elif base is not None and previous.get("size") == stat.st_size and previous.get("mtime") == stat.st_mtime:
+            changed = False
+            digest = previous.get("sha256") or ""
+        elif base is not None:
+            try:
+                digest = fingerprints.content_hash(path)
+            except OSError:
+                continue
+            changed = digest != previous.get("sha256")
+        else:
+            changed = True
+
+        if changed:
+            hasher = hashlib.sha256()
+            try:
+                for chunk in _file_member(name, path, stat, hasher):
+                    written += len(chunk)
+                    yield chunk
+            except OSError as e:
+                # The header is already out, so the stream cannot continue consistently
+                logger.error(f"Could not read {path} for backup: {str(e)}")
+                raise
+            digest = hasher.hexdigest()
+            included += 1
+            BACKUP_BYTES.labels(mode).inc(stat.st_size)
+            BACKUP_FILES.labels("included").inc()
+        else:
+            # Unchanged files are not read: the hash comes from the base manifest or the hash cache, if known
+            digest = digest or fingerprints.cached_hash(path, stat)
+            BACKUP_FILES.labels("unchanged").inc()
+        files[name] = {"sha256": digest or None, "size": stat.st_size, "mtime": stat.st_mtime}
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "created": datetime.now().isoformat(),
+        "mode": mode,
+        "base": (base or {}).get("created"),
+        "since": since,
+        "included": included,
+        "files": files,
+        "deleted": sorted(set(base_files) - set(files)) if base is not None else [],
+    }
+    data = json.dumps(manifest, indent=2).encode("utf-8")
+    for chunk in (_header(MANIFEST_NAME, len(data), time.time()), data, b"\0" * (-len(data) % _BLOCK_SIZE)):
+        written += len(chunk)
+        yield chunk
+    # End-of-archive marker, padded to a full record as tar expects
+    end = 2 * _BLOCK_SIZE
+    end += -(written + end) % _RECORD_SIZE
+    yield b"\0" * end
+    logger.info(f"Streamed {mode} backup with {included} of {len(files)} files")
+
+
+def _member_path(workspace: str, name: str, state_dir: str = "") -> str:
+    """Path of a workspace or document state member, refusing names that escape their folder"""
+    if name.startswith(STATE_PREFIX) and state_dir:
+        root, relative = state_dir, name[len(STATE_PREFIX):]
+        if "/" in relative:
+            raise ValueError(f"Invalid path in backup: {name}")
+    elif name.startswith(WORKSPACE_PREFIX):
+        root, relative = workspace, name[len(WORKSPACE_PREFIX):]
+    else:
+        raise ValueError(f"Invalid path in backup: {name}")
+    if not relative or os.path.isabs(relative) or any(part in ("", ".", "..") for part in relative.split("/")):
+        raise ValueError(f"Invalid path in backup: {name}")
+    if any(_skipped(part) for part in relative.split("/")):
+        raise ValueError(f"Invalid path in backup: {name}")
+    return os.path.join(root, *relative.split("/"))
+
+
+def _write_member(source: IO[bytes], path: str, mtime: float) -> str:
+    """Write a member beside its target and publish it only once complete, returning its hash"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.partial"
+    digest = hashlib.sha256()
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in iter(lambda: source.read(_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                f.write(chunk)
+        os.utime(tmp_path, (mtime, mtime))
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return digest.hexdigest()
+
+
+def restore(stream: IO[bytes], workspace: str, restore_config: Callable[[Dict[str, Any]], None], prune: bool = False, state_dir: str = "") -> Dict[str, Any]:
+    """Apply a full or incremental backup read as a stream.
+
+    Files are written as their members arrive, so memory use does not grow
+    with the backup. Once the manifest at the end has been read, files
+    deleted since the base of an incremental backup are removed, restored
+    files are checked against their hashes, and with prune every workspace
+    file the manifest does not list is removed too.
+    """
+    restored: Dict[str, str] = {}
+    skipped: List[str] = []
+    manifest: Optional[Dict[str, Any]] = None
+
+    with tarfile.open(fileobj=stream, mode="r|*") as tar:
+        for member in tar:
+            name = member.name
+            if member.isdir():
+                continue
+            if not member.isfile():
+                skipped.append(name)
+                continue
+            source = tar.extractfile(member)
+            if name == MANIFEST_NAME:
+                manifest = json.load(source)
+            elif name == CONFIG_MEMBER:
+                data = source.read()
+                restore_config(json.loads(data))
+                restored[name] = hashlib.sha256(data).hexdigest()
+            elif name.startswith(WORKSPACE_PREFIX) or (state_dir and name.startswith(STATE_PREFIX)):
+                restored[name] = _write_member(source, _member_path(workspace, name, state_dir), member.mtime)
+            else:
+                skipped.append(name)
+
+    removed: List[str] = []
+    mismatched: List[str] = []
+    if manifest is not None:
+        files = manifest.get("files") or {}
+        mismatched = [
+            name for name, digest in restored.items()
+            if name != CONFIG_MEMBER and name in files and files[name].get("sha256") != digest
+        ]
+        doomed = [name for name in manifest.get("deleted") or [] if name != CONFIG_MEMBER]
+        if prune:
+            doomed += [name for name, _, _ in scan(workspace, "", state_dir) if name not in files]
+        for name in sorted(set(doomed)):
+            try:
+                path = _member_path(workspace, name, state_dir)
+            except ValueError:
+                continue
+            if os.path.isfile(path):
+                os.remove(path)
+                removed.append(name)
+    for name in mismatched:
+        logger.warning(f"Restored {name} does not match the hash in the backup manifest")
+
+    return {
+        "restored": len(restored),
+        "removed": removed,
+        "skipped": skipped,
+        "mismatched": mismatched,
+        "manifest": manifest is not None,
+        "mode": (manifest or {}).get("mode"),
+        "created": (manifest or {}).get("created"),
+    }
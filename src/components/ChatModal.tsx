@@ -6,6 +6,7 @@ import { pdfjs } from 'react-pdf';
 import chatService, { ChatMessage, ChatContentPart } from '../services/chatService';
 import apiKeyService from '../services/apiKeyService';
 import { markdownService } from '../services/markdownService';
+import { extractPageText, fileContents } from '../utils/pdfUtils';
 import { TranslationProvider, TranslationModel } from '../types';
 import LoadingSpinner from './LoadingSpinner';
 import './ChatModal.css';
@@ -95,7 +96,8 @@ const ChatModal: React.FC<ChatModalProps> = ({ isOpen, onClose, initialMessage,
   }, [isOpen]);
 
   useEffect(() => {
-    const fileToBase64 = (file: File): Promise<string> => {
+    const fileToBase64 = async (file: File): Promise<string> => {
+      const contents = await fileContents(file);
       return new Promise((resolve, reject) => {
         const reader = new FileReader();
         reader.onload = () => {
@@ -108,17 +110,10 @@ const ChatModal: React.FC<ChatModalProps> = ({ isOpen, onClose, initialMessage,
           }
         };
         reader.onerror = () => reject(new Error('Failed to read file'));
-        reader.readAsDataURL(file);
+        reader.readAsDataURL(contents);
       });
     };
 
-    const getPageText = async (file: File, page: number): Promise<string> => {
-      const pdf = await pdfjs.getDocument(URL.createObjectURL(file)).promise;
-      const pg = await pdf.getPage(page);
-      const tc = await pg.getTextContent();
-      return tc.items.map((i: any) => i.str).join(' ').trim();
-    };
-
     const loadContext = async () => {
       if (isOpen && currentFile && currentFile.name.toLowerCase().endsWith('.pdf')) {
         setIsContextLoading(true);
@@ -132,7 +127,7 @@ const ChatModal: React.FC<ChatModalProps> = ({ isOpen, onClose, initialMessage,
             setFileData(b64);
             setMarkdownContext('');
           } else if (contextMode === 'selected-page') {
-            const txt = await getPageText(currentFile, currentPage);
+            const txt = await extractPageText(currentFile, currentPage);
             setMarkdownContext(txt);
             setFileData('');
           } else if (contextMode === 'no-context') {
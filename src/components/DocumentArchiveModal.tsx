@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { X, Upload, FileText, Trash2, Download, Calendar, Search, Play, Archive, ArchiveRestore } from 'lucide-react';
 import './DocumentManagerModal.css';
 import { fileService, FileInfo } from '../services/fileService';
+import { workspaceFile } from '../utils/pdfUtils';
 import ConfirmationModal from './ConfirmationModal';
 
 interface DocumentArchiveModalProps {
@@ -173,27 +174,10 @@ const DocumentArchiveModal: React.FC<DocumentArchiveModalProps> = ({
     await handleMultipleFiles([file]);
   };
 
-  const handleLoadDocument = async (doc: FileInfo) => {
-    try {
-      setIsLoading(true);
-      const url = fileService.getArchivedDownloadUrl(doc.name);
-      const response = await fetch(url);
-      
-      if (!response.ok) {
-        throw new Error(`Failed to fetch file: ${response.status} ${response.statusText}`);
-      }
-      
-      const blob = await response.blob();
-      const file = new File([blob], doc.name, { type: doc.type || 'application/pdf' });
-      
-      onFileUpload(file);
-      onClose();
-    } catch (error) {
-      console.error('Error loading file:', error);
-      alert('Failed to load file. Please try again.');
-    } finally {
-      setIsLoading(false);
-    }
+  const handleLoadDocument = (doc: FileInfo) => {
+    // The viewer reads the document from its URL in ranges, so large PDFs open without a full download
+    onFileUpload(workspaceFile(fileService.getArchivedDownloadUrl(doc.name), fileService.getArchivedStoragePath(doc.name), doc.type || 'application/pdf'));
+    onClose();
   };
 
   const handleDownloadDocument = async (doc: FileInfo, event: React.MouseEvent) => {
@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { Upload, FileText, Trash2, Download, Calendar, Search, Play, Archive, FolderPlus, Folder } from 'lucide-react';
 import './DocumentManagerModal.css';
 import { fileService, FileInfo } from '../services/fileService';
+import { workspaceFile } from '../utils/pdfUtils';
 import ConfirmationModal from './ConfirmationModal';
 import DocumentArchiveModal from './DocumentArchiveModal';
 import CreateFolderModal from './CreateFolderModal';
@@ -167,26 +168,9 @@ const DocumentManagerPanel: React.FC<DocumentManagerPanelProps> = ({ onFileUploa
     await handleMultipleFiles([file]);
   };
 
-  const handleLoadDocument = async (doc: FileInfo) => {
-    try {
-      setIsLoading(true);
-      const url = fileService.getDownloadUrl(doc.name);
-      const response = await fetch(url);
-
-      if (!response.ok) {
-        throw new Error(`Failed to fetch file: ${response.status} ${response.statusText}`);
-      }
-
-      const blob = await response.blob();
-      const file = new File([blob], doc.name, { type: doc.type || 'application/pdf' });
-
-      onFileUpload(file);
-    } catch (error) {
-      console.error('Error loading file:', error);
-      alert('Failed to load file. Please try again.');
-    } finally {
-      setIsLoading(false);
-    }
+  const handleLoadDocument = (doc: FileInfo) => {
+    // The viewer reads the document from its URL in ranges, so large PDFs open without a full download
+    onFileUpload(workspaceFile(fileService.getDownloadUrl(doc.path), doc.path, doc.type || 'application/pdf'));
   };
 
   const handleDownloadDocument = async (doc: FileInfo, event: React.MouseEvent) => {
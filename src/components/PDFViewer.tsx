@@ -7,7 +7,7 @@ import configService from '../services/configService';
 import translationService, { translateTextStreaming } from '../services/translationService';
 import { fileService } from '../services/fileService';
 import apiKeyService from '../services/apiKeyService';
-import { renderPageToImage } from '../utils/pdfUtils';
+import { extractPageText, pdfSource, renderPageToImage, RANGE_LOADING_OPTIONS } from '../utils/pdfUtils';
 
 pdfjs.GlobalWorkerOptions.workerSrc = `//unpkg.com/pdfjs-dist@${pdfjs.version}/legacy/build/pdf.worker.min.js`;
 
@@ -40,6 +40,8 @@ const PDFViewer: React.FC<PDFViewerProps> = ({ file, onFileUpload, onTextSelecti
   const pdfContainerRef = useRef<HTMLDivElement>(null);
   const pageRefs = useRef<(HTMLDivElement | null)[]>([]);
   const documentRef = useRef<any>(null);
+  // Workspace documents are opened by URL so PDF.js can fetch them in ranges
+  const documentSource = file ? pdfSource(file) : null;
 
   useEffect(() => {
     if (onPageChange) onPageChange(pageNumber);
@@ -50,8 +52,7 @@ const PDFViewer: React.FC<PDFViewerProps> = ({ file, onFileUpload, onTextSelecti
     const loadBookmark = async () => {
       if (file) {
         try {
-          const cfg = await configService.getConfig();
-          const serverPage = cfg.bookmarks ? cfg.bookmarks[file.name] : undefined;
+          const serverPage = await configService.getBookmark(file);
           const saved = serverPage ?? localStorage.getItem(`bookmark_${file.name}`);
           if (saved) {
             const page = parseInt(saved as any, 10);
@@ -237,20 +238,9 @@ const PDFViewer: React.FC<PDFViewerProps> = ({ file, onFileUpload, onTextSelecti
         setPageNumber(Math.min(Math.max(1, targetPage), numPages || targetPage));
       }
       
-      // Load the PDF document
-      const loadingTask = pdfjs.getDocument(URL.createObjectURL(file));
-      const pdf = await loadingTask.promise;
-      
-      // Get the target page (default to current)
+      // Get the target page (default to current) and extract its text
       const pageIdx = targetPage ?? pageNumber;
-      const page = await pdf.getPage(pageIdx);
-      const textContent = await page.getTextContent();
-      
-      // Extract text from text items
-      const extractedText = textContent.items
-        .map((item: any) => item.str)
-        .join(' ')
-        .trim();
+      const extractedText = await extractPageText(file, pageIdx);
       
       if (extractedText && onPageTextExtracted) {
         onPageTextExtracted(extractedText, pageIdx);
@@ -338,13 +328,13 @@ const PDFViewer: React.FC<PDFViewerProps> = ({ file, onFileUpload, onTextSelecti
       if (isBookmarked) {
         localStorage.removeItem(bookmarkKey);
         setBookmarkedPage(null);
-        configService.removeBookmark(file.name).catch(err =>
+        configService.removeBookmark(file).catch(err =>
           console.error('Error removing bookmark:', err)
         );
       } else {
         localStorage.setItem(bookmarkKey, pageNumber.toString());
         setBookmarkedPage(pageNumber);
-        configService.saveBookmark(file.name, pageNumber).catch(err =>
+        configService.saveBookmark(file, pageNumber).catch(err =>
           console.error('Error saving bookmark:', err)
         );
       }
@@ -674,7 +664,8 @@ const PDFViewer: React.FC<PDFViewerProps> = ({ file, onFileUpload, onTextSelecti
               }}
             >
               <Document
-                file={file}
+                file={documentSource}
+                options={RANGE_LOADING_OPTIONS}
                 onLoadSuccess={onDocumentLoadSuccess}
                 onLoadError={onDocumentLoadError}
                 loading={<div className="loading">Loading PDF...</div>}
@@ -1,4 +1,5 @@
 import { SavedDatabaseId, NotionConfig, TagMapping, AppConfig } from '../types';
+import { isWorkspaceFile } from '../utils/pdfUtils';
 
 class ConfigService {
   private baseUrl: string;
@@ -21,7 +22,6 @@ class ConfigService {
       return {
         savedDatabaseIds: [],
         columnMappings: {},
-        bookmarks: {},
         lastUpdated: new Date().toISOString()
       };
     }
@@ -140,27 +140,72 @@ class ConfigService {
     }
   }
 
-  async getBookmarks(): Promise<Record<string, number>> {
-    const config = await this.getConfig();
-    return config.bookmarks || {};
+  private encodePath(path: string): string {
+    return path
+      .split('/')
+      .map(segment => encodeURIComponent(segment))
+      .join('/');
   }
 
-  async saveBookmark(fileName: string, page: number): Promise<void> {
+  /**
+   * URL of a document's stored state: by its workspace path when it was opened
+   * from the workspace, else by the SHA-256 of its content
+   */
+  private async documentStateUrl(file: File): Promise<string> {
+    if (isWorkspaceFile(file)) {
+      return `${this.baseUrl}/files/${this.encodePath(file.path)}/state`;
+    }
+    if (window.crypto?.subtle) {
+      const digest = new Uint8Array(await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer()));
+      const hex = Array.from(digest).map(byte => ('0' + byte.toString(16)).slice(-2)).join('');
+      return `${this.baseUrl}/documents/${hex}/state`;
+    }
+    // Without Web Crypto (plain HTTP), only a file at the workspace root can be found by name
+    return `${this.baseUrl}/files/${this.encodePath(file.name)}/state`;
+  }
+
+  /**
+   * Merge changes into the stored state of a document; null removes a key
+   */
+  private async patchDocumentState(file: File, changes: Record<string, unknown>): Promise<void> {
+    const response = await fetch(await this.documentStateUrl(file), {
+      method: 'PATCH',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify(changes),
+    });
+    if (!response.ok) {
+      const errorData = await response.json();
+      throw new Error(errorData.error || `Failed to update document state: ${response.statusText}`);
+    }
+  }
+
+  async getBookmark(file: File): Promise<number | null> {
+    try {
+      const response = await fetch(await this.documentStateUrl(file));
+      if (!response.ok) {
+        return null;
+      }
+      const data = await response.json();
+      return typeof data.state?.bookmark === 'number' ? data.state.bookmark : null;
+    } catch (error) {
+      console.error('Error fetching bookmark:', error);
+      return null;
+    }
+  }
+
+  async saveBookmark(file: File, page: number): Promise<void> {
     try {
-      const config = await this.getConfig();
-      const updated = { ...(config.bookmarks || {}), [fileName]: page };
-      await this.updateConfig({ bookmarks: updated });
+      await this.patchDocumentState(file, { bookmark: page });
     } catch (error) {
       console.error('Error saving bookmark:', error);
     }
   }
 
-  async removeBookmark(fileName: string): Promise<void> {
+  async removeBookmark(file: File): Promise<void> {
     try {
-      const config = await this.getConfig();
-      const updated = { ...(config.bookmarks || {}) };
-      delete updated[fileName];
-      await this.updateConfig({ bookmarks: updated });
+      await this.patchDocumentState(file, { bookmark: null });
     } catch (error) {
       console.error('Error removing bookmark:', error);
     }
@@ -18,6 +18,23 @@ export interface FileListResponse {
   files: FileInfo[];
 }
 
+export interface FileOperation {
+  op: 'move' | 'copy' | 'archive' | 'unarchive' | 'delete';
+  path: string;
+  destination?: string;
+  name?: string;
+  archived?: boolean;
+}
+
+/** Raised when the storage backend cannot run batches (object storage answers 501) */
+export class BatchUnsupportedError extends Error {
+  constructor(message: string) {
+    super(message);
+    // Checked by name: with an ES5 target, subclasses of Error fail instanceof
+    this.name = 'BatchUnsupportedError';
+  }
+}
+
 class FileService {
   private baseUrl = '/api';
 
@@ -295,15 +312,43 @@ class FileService {
     }
   }
 
-  async moveFiles(paths: string[], destination: string): Promise<void> {
-    const response = await fetch(`${this.baseUrl}/files/move`, {
+  /**
+   * Run several move, copy, archive, unarchive and delete operations in one request.
+   * With atomic set (the default) nothing changes unless every operation succeeds.
+   */
+  async batchOperations(operations: FileOperation[], atomic = true): Promise<void> {
+    const response = await fetch(`${this.baseUrl}/files/batch`, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ filenames: paths, destination })
+      body: JSON.stringify({ operations, atomic })
     });
-    if (!response.ok) {
+    const data = await response.json().catch(() => ({}));
+    if (response.status === 501) {
+      throw new BatchUnsupportedError(data.error || 'Batch file operations are not supported');
+    }
+    if (!response.ok || data.success === false) {
+      const failed = (data.errors || data.results || []).find((result: { error?: string }) => result.error);
+      throw new Error(data.error || failed?.error || 'File operation failed');
+    }
+  }
+
+  async moveFiles(paths: string[], destination: string): Promise<void> {
+    try {
+      await this.batchOperations(paths.map(path => ({ op: 'move', path, destination })));
+    } catch (error) {
+      if ((error as Error).name !== 'BatchUnsupportedError') {
+        throw error;
+      }
+      // S3 storage has no atomic batches; move the files one by one instead
+      const response = await fetch(`${this.baseUrl}/files/move`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filenames: paths, destination })
+      });
       const data = await response.json().catch(() => ({}));
-      throw new Error(data.error || 'Failed to move files');
+      if (!response.ok || data.success === false) {
+        throw new Error(data.error || data.errors?.[0]?.error || 'Failed to move files');
+      }
     }
   }
 
@@ -359,6 +404,13 @@ class FileService {
     return `${this.baseUrl}/files/archived/${this.encodePath(path)}`;
   }
 
+  /**
+   * Get the path from the workspace root of an archived file
+   */
+  getArchivedStoragePath(path: string): string {
+    return `archive/${path}`;
+  }
+
   /**
    * Download a file and open it
    */
@@ -2,14 +2,14 @@ class MarkdownService {
   private baseUrl = '/api';
 
   async getMarkdown(filename: string): Promise<string> {
-    const url = `${this.baseUrl}/files/${encodeURIComponent(filename)}/markdown`;
+    // Raw format lets the backend send the stored compressed sidecar as-is
+    const url = `${this.baseUrl}/files/${encodeURIComponent(filename)}/markdown?format=raw`;
     const response = await fetch(url);
     if (!response.ok) {
       const data = await response.json().catch(() => ({}));
       throw new Error(data.error || 'Failed to fetch markdown');
     }
-    const data = await response.json();
-    return data.markdown as string;
+    return response.text();
   }
 }
 
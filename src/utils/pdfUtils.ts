@@ -2,8 +2,53 @@ import { pdfjs } from 'react-pdf';
 
 pdfjs.GlobalWorkerOptions.workerSrc = `//unpkg.com/pdfjs-dist@${pdfjs.version}/legacy/build/pdf.worker.min.js`;
 
+/**
+ * A document opened from the workspace. It carries no bytes: PDF.js loads it
+ * from its URL in ranges, so the first page shows before the rest arrives.
+ */
+export interface WorkspaceFile extends File {
+  url: string;
+  /** Path from the workspace root, which the backend knows the document by */
+  path: string;
+}
+
+export function workspaceFile(url: string, path: string, type = 'application/pdf'): WorkspaceFile {
+  const name = path.split('/').pop() || path;
+  return Object.assign(new File([], name, { type }), { url, path });
+}
+
+export function isWorkspaceFile(file: File): file is WorkspaceFile {
+  return typeof (file as WorkspaceFile).url === 'string';
+}
+
+/** Fetch only the ranges PDF.js needs instead of the whole file */
+export const RANGE_LOADING_OPTIONS = { disableAutoFetch: true, disableStream: false };
+
+/** What PDF.js should open: the URL of a workspace document, else the file's own bytes */
+export function pdfSource(file: File): string | File {
+  return isWorkspaceFile(file) ? file.url : file;
+}
+
+function loadPdf(file: File) {
+  return isWorkspaceFile(file)
+    ? pdfjs.getDocument({ url: file.url, ...RANGE_LOADING_OPTIONS })
+    : pdfjs.getDocument(URL.createObjectURL(file));
+}
+
+/** The whole content of a file, downloading a workspace document */
+export async function fileContents(file: File): Promise<Blob> {
+  if (!isWorkspaceFile(file)) {
+    return file;
+  }
+  const response = await fetch(file.url);
+  if (!response.ok) {
+    throw new Error(`Failed to fetch file: ${response.status} ${response.statusText}`);
+  }
+  return response.blob();
+}
+
 export async function extractPageText(file: File, pageNumber: number): Promise<string> {
-  const loadingTask = pdfjs.getDocument(URL.createObjectURL(file));
+  const loadingTask = loadPdf(file);
   const pdf = await loadingTask.promise;
   const page = await pdf.getPage(pageNumber);
   const textContent = await page.getTextContent();
@@ -11,7 +56,7 @@ export async function extractPageText(file: File, pageNumber: number): Promise<s
 }
 
 export async function getNumPages(file: File): Promise<number> {
-  const loadingTask = pdfjs.getDocument(URL.createObjectURL(file));
+  const loadingTask = loadPdf(file);
   const pdf = await loadingTask.promise;
   return pdf.numPages;
 }
@@ -21,7 +66,7 @@ export async function renderPageToImage(
   pageNumber: number,
   scale = 2
 ): Promise<string> {
-  const loadingTask = pdfjs.getDocument(URL.createObjectURL(file));
+  const loadingTask = loadPdf(file);
   const pdf = await loadingTask.promise;
   const page = await pdf.getPage(pageNumber);
   const viewport = page.getViewport({ scale });